@@ -71,6 +71,7 @@ def _run_process():
 
     if not running():  # check that the previous process has finished
         logging.debug('running cleanup process...')
+        mediafiles.invalidate_media_groups()
 
         _process = multiprocessing.Process(target=_do_cleanup)
         _process.start()
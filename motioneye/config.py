@@ -14,10 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
 import logging
 import os.path
 import subprocess
 import tarfile
+import time
 from collections import OrderedDict
 from datetime import timedelta
 from errno import EEXIST, ENOENT
@@ -72,6 +74,13 @@ _camera_ids_cache = None
 _additional_section_funcs: list = []
 _additional_config_funcs: list = []
 _additional_structure_cache: dict = {}
+_additional_structure_version = 0
+_ui_config_cache: dict = {}  # (key, camera config, ui config) indexed by camera id
+_file_stats: dict = {}  # (camera id or name, (mtime, size)) indexed by file path
+_last_check_time = 0
+_generation = 0  # incremented with each config change
+_generations: dict = {}  # generation of the last change indexed by camera id
+_all_generation = 0  # generation of the last change that affects all cameras
 _monitor_command_cache: dict = {}
 
 _USED_MOTION_OPTIONS = {
@@ -282,13 +291,17 @@ def additional_config(func):
 def get_main(as_lines=False):
     global _main_config_cache
 
-    if not as_lines and _main_config_cache is not None:
-        return _main_config_cache
+    if not as_lines:
+        _check_files()
+        if _main_config_cache is not None:
+            return _main_config_cache
 
     config_file_path = os.path.join(settings.CONF_PATH, _MAIN_CONFIG_FILE_NAME)
 
     logging.debug(f'reading main config from file {config_file_path}...')
 
+    file_stat = _get_file_stat(config_file_path)
+
     lines = None
     try:
         f = open(config_file_path)
@@ -377,6 +390,8 @@ def get_main(as_lines=False):
     _set_default_motion(main_config)
 
     _main_config_cache = main_config
+    if not save_needed:
+        _file_stats[config_file_path] = ('main', file_stat)
 
     return main_config
 
@@ -387,6 +402,7 @@ def set_main(main_config):
     main_config = dict(main_config)
     for n, v in list(_main_config_cache.items()):
         main_config.setdefault(n, v)
+    changed = main_config != _main_config_cache
     _main_config_cache = main_config
 
     main_config = dict(main_config)
@@ -431,10 +447,15 @@ def set_main(main_config):
     finally:
         f.close()
 
+    _file_stats[config_file_path] = ('main', _get_file_stat(config_file_path))
+    if changed:
+        _add_generation()
+
 
 def get_camera_ids(filter_valid=True):
     global _camera_ids_cache
 
+    _check_files()
     if _camera_ids_cache is not None:
         return _camera_ids_cache
 
@@ -442,6 +463,8 @@ def get_camera_ids(filter_valid=True):
 
     logging.debug(f'listing config dir {config_path}...')
 
+    dir_stat = _get_file_stat(config_path)
+
     try:
         ls = os.listdir(config_path)
 
@@ -472,6 +495,7 @@ def get_camera_ids(filter_valid=True):
             filtered_camera_ids.append(camera_id)
 
     _camera_ids_cache = filtered_camera_ids
+    _file_stats[config_path] = ('dir', dir_stat)
 
     return filtered_camera_ids
 
@@ -517,8 +541,10 @@ def get_network_shares():
 
 
 def get_camera(camera_id, as_lines=False):
-    if not as_lines and camera_id in _camera_config_cache:
-        return _camera_config_cache[camera_id]
+    if not as_lines:
+        _check_files()
+        if camera_id in _camera_config_cache:
+            return _camera_config_cache[camera_id]
 
     camera_config_path = os.path.join(settings.CONF_PATH, _CAMERA_CONFIG_FILE_NAME) % {
         'id': camera_id
@@ -526,6 +552,8 @@ def get_camera(camera_id, as_lines=False):
 
     logging.debug(f'reading camera config from {camera_config_path}...')
 
+    file_stat = _get_file_stat(camera_config_path)
+
     try:
         f = open(camera_config_path)
 
@@ -615,6 +643,7 @@ def get_camera(camera_id, as_lines=False):
         return None
 
     _camera_config_cache[camera_id] = dict(camera_config)
+    _file_stats[camera_config_path] = (camera_id, file_stat)
 
     return camera_config
 
@@ -694,6 +723,9 @@ def set_camera(camera_id, camera_config):
     finally:
         f.close()
 
+    _file_stats[camera_config_path] = (camera_id, _get_file_stat(camera_config_path))
+    _add_generation(camera_id)
+
 
 def make_netcam_userpass(url, raw_username, raw_password, camera_id):
     raw_username = str(raw_username)
@@ -839,6 +871,7 @@ def rem_camera(camera_id):
 
     _camera_ids_cache = None
     _camera_config_cache.clear()
+    _add_generation(camera_id)
 
     try:
         os.remove(camera_config_path)
@@ -1010,6 +1043,8 @@ def motion_camera_ui_to_dict(ui, prev_config=None):
         '@upload_secret_key': ui['upload_secret_key'],
         '@upload_bucket': ui['upload_bucket'],
         '@upload_sse_c_key': ui['upload_sse_c_key'],
+        '@upload_concurrency': int(ui['upload_concurrency']),
+        '@upload_bandwidth': int(ui['upload_bandwidth']),
         '@clean_cloud_enabled': ui['clean_cloud_enabled'],
         # text overlay
         'text_left': '',
@@ -1209,6 +1244,7 @@ def motion_camera_ui_to_dict(ui, prev_config=None):
             0,
             uploadservices.update,
             tag=f"uploadservices.update({ui['upload_service']})",
+            lane='upload',
             camera_id=prev_config['@id'],
             service_name=ui['upload_service'],
             settings=upload_settings,
@@ -1506,7 +1542,153 @@ def motion_camera_ui_to_dict(ui, prev_config=None):
     return prev_config
 
 
-def motion_camera_dict_to_ui(data):  # noqa: C901
+def motion_camera_dict_to_ui(data):
+    # the ui config is reused for as long as the camera config (both on disk and
+    # in memory) and the additional config structure stay the same;
+    # the values that depend on the state of the system are determined each time
+    camera_id = data['@id']
+    key = (get_generation(camera_id), _additional_structure_version)
+    cached = _ui_config_cache.get(camera_id)
+    if cached and cached[0] == key and cached[1] == data:
+        ui = copy.deepcopy(cached[2])
+
+    else:
+        ui = _motion_camera_dict_to_ui(data)
+        _ui_config_cache[camera_id] = (key, copy.deepcopy(data), copy.deepcopy(ui))
+
+    _motion_camera_system_to_ui(data, ui)
+
+    return ui
+
+
+def _motion_camera_system_to_ui(data, ui):
+    # devices, disks and mounts
+    ui['available_disks'] = diskctl.list_mounted_disks()
+
+    if utils.is_net_camera(data):
+        ui['device_url'] = data['netcam_url']
+        ui['proto'] = 'netcam'
+
+        # resolutions
+        if match(r'^rtsp|^rtmp', data['netcam_url']):
+            # motion uses the configured width and height for RTSP/RTMP cameras
+            resolutions = utils.COMMON_RESOLUTIONS
+            resolutions = [r for r in resolutions if motionctl.resolution_is_valid(*r)]
+            ui['available_resolutions'] = [
+                (str(w) + 'x' + str(h)) for (w, h) in resolutions
+            ]
+            ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
+
+            threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
+
+        else:  # width & height are not available for other netcams
+            # we have no other choice but use something like 640x480 as reference
+            threshold = data['threshold'] * 100.0 / (640 * 480)
+
+    elif utils.is_mmal_camera(data):
+        ui['device_url'] = data['mmalcam_name']
+        ui['proto'] = 'mmal'
+
+        resolutions = utils.COMMON_RESOLUTIONS
+        resolutions = [r for r in resolutions if motionctl.resolution_is_valid(*r)]
+        ui['available_resolutions'] = [
+            (str(w) + 'x' + str(h)) for (w, h) in resolutions
+        ]
+        ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
+
+        threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
+
+    else:  # assuming v4l2
+        ui['device_url'] = data['videodevice']
+        ui['proto'] = 'v4l2'
+
+        # resolutions
+        resolutions = v4l2ctl.list_resolutions(data['videodevice'])
+        ui['available_resolutions'] = [
+            (str(w) + 'x' + str(h)) for (w, h) in resolutions
+        ]
+        ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
+
+        video_controls = v4l2ctl.list_ctrls(data['videodevice'])
+        video_controls = [
+            (n, c)
+            for (n, c) in list(video_controls.items())
+            if 'min' in c and 'max' in c and 'value' in c
+        ]
+
+        vid_control_params = data['vid_control_params'].split(',')
+        vid_control_values = {}
+        for param in vid_control_params:
+            parts = param.split('=')
+            if len(parts) == 1:
+                name, value = param, 1
+
+            elif len(parts) == 2:
+                name, value = parts
+
+            else:
+                continue  # ignore any other kind of param
+
+            vid_control_values[name] = value
+
+        ui['video_controls'] = {
+            n: {
+                'min': int(c['min']),
+                'max': int(c['max']),
+                'step': int(c['step']) if 'step' in c else None,
+                'value': int(vid_control_values.get(n, c['value'])),
+            }
+            for n, c in video_controls
+        }
+
+        threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
+
+    ui['frame_change_threshold'] = threshold
+
+    if (data['@storage_device'] == 'network-share') and settings.SMB_SHARES:
+        mount_point = smbctl.make_mount_point(
+            data['@network_server'],
+            data['@network_share_name'],
+            data['@network_username'],
+        )
+
+        ui['root_directory'] = data['target_dir'][len(mount_point) :] or '/'
+
+    elif data['@storage_device'].startswith('local-disk'):
+        target_dev = data['@storage_device'][10:].replace('-', '/')
+        mounted_partitions = diskctl.list_mounted_partitions()
+        for partition in list(mounted_partitions.values()):
+            if partition['target'] == target_dev and data['target_dir'].startswith(
+                partition['mount_point']
+            ):
+                ui['root_directory'] = (
+                    data['target_dir'][len(partition['mount_point']) :] or '/'
+                )
+                break
+
+        else:  # not found for some reason
+            logging.error(
+                f'could not find mounted partition for device "{target_dev}" and target dir "{data["target_dir"]}"'
+            )
+
+            ui['root_directory'] = data['target_dir']
+
+    else:
+        ui['root_directory'] = data['target_dir']
+
+    # disk usage
+    usage = None
+    if os.path.exists(data['target_dir']):
+        usage = utils.get_disk_usage(data['target_dir'])
+    if usage:
+        ui['disk_used'], ui['disk_total'] = usage
+
+    # action commands
+    action_commands = get_action_commands(data)
+    ui['actions'] = list(action_commands.keys())
+
+
+def _motion_camera_dict_to_ui(data):  # noqa: C901
     ui = {
         # device
         'name': data['camera_name'],
@@ -1528,7 +1710,6 @@ def motion_camera_dict_to_ui(data):  # noqa: C901
         'network_password': data['@network_password'],
         'disk_used': 0,
         'disk_total': 0,
-        'available_disks': diskctl.list_mounted_disks(),
         'upload_enabled': data['@upload_enabled'],
         'upload_picture': data['@upload_picture'],
         'upload_movie': data['@upload_movie'],
@@ -1546,6 +1727,8 @@ def motion_camera_dict_to_ui(data):  # noqa: C901
         'upload_secret_key': data['@upload_secret_key'],
         'upload_bucket': data['@upload_bucket'],
         'upload_sse_c_key': data['@upload_sse_c_key'],
+        'upload_concurrency': data['@upload_concurrency'],
+        'upload_bandwidth': data['@upload_bandwidth'],
         'clean_cloud_enabled': data['@clean_cloud_enabled'],
         'web_hook_storage_enabled': False,
         'command_storage_enabled': False,
@@ -1636,124 +1819,6 @@ def motion_camera_dict_to_ui(data):  # noqa: C901
         ui['streaming_username'] = streaming_username
         ui['streaming_password'] = '*****' if streaming_password else ''
 
-    if utils.is_net_camera(data):
-        ui['device_url'] = data['netcam_url']
-        ui['proto'] = 'netcam'
-
-        # resolutions
-        if match(r'^rtsp|^rtmp', data['netcam_url']):
-            # motion uses the configured width and height for RTSP/RTMP cameras
-            resolutions = utils.COMMON_RESOLUTIONS
-            resolutions = [r for r in resolutions if motionctl.resolution_is_valid(*r)]
-            ui['available_resolutions'] = [
-                (str(w) + 'x' + str(h)) for (w, h) in resolutions
-            ]
-            ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
-
-            threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
-
-        else:  # width & height are not available for other netcams
-            # we have no other choice but use something like 640x480 as reference
-            threshold = data['threshold'] * 100.0 / (640 * 480)
-
-    elif utils.is_mmal_camera(data):
-        ui['device_url'] = data['mmalcam_name']
-        ui['proto'] = 'mmal'
-
-        resolutions = utils.COMMON_RESOLUTIONS
-        resolutions = [r for r in resolutions if motionctl.resolution_is_valid(*r)]
-        ui['available_resolutions'] = [
-            (str(w) + 'x' + str(h)) for (w, h) in resolutions
-        ]
-        ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
-
-        threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
-
-    else:  # assuming v4l2
-        ui['device_url'] = data['videodevice']
-        ui['proto'] = 'v4l2'
-
-        # resolutions
-        resolutions = v4l2ctl.list_resolutions(data['videodevice'])
-        ui['available_resolutions'] = [
-            (str(w) + 'x' + str(h)) for (w, h) in resolutions
-        ]
-        ui['resolution'] = str(data['width']) + 'x' + str(data['height'])
-
-        video_controls = v4l2ctl.list_ctrls(data['videodevice'])
-        video_controls = [
-            (n, c)
-            for (n, c) in list(video_controls.items())
-            if 'min' in c and 'max' in c and 'value' in c
-        ]
-
-        vid_control_params = data['vid_control_params'].split(',')
-        vid_control_values = {}
-        for param in vid_control_params:
-            parts = param.split('=')
-            if len(parts) == 1:
-                name, value = param, 1
-
-            elif len(parts) == 2:
-                name, value = parts
-
-            else:
-                continue  # ignore any other kind of param
-
-            vid_control_values[name] = value
-
-        ui['video_controls'] = {
-            n: {
-                'min': int(c['min']),
-                'max': int(c['max']),
-                'step': int(c['step']) if 'step' in c else None,
-                'value': int(vid_control_values.get(n, c['value'])),
-            }
-            for n, c in video_controls
-        }
-
-        threshold = data['threshold'] * 100.0 / (data['width'] * data['height'])
-
-    ui['frame_change_threshold'] = threshold
-
-    if (data['@storage_device'] == 'network-share') and settings.SMB_SHARES:
-        mount_point = smbctl.make_mount_point(
-            data['@network_server'],
-            data['@network_share_name'],
-            data['@network_username'],
-        )
-
-        ui['root_directory'] = data['target_dir'][len(mount_point) :] or '/'
-
-    elif data['@storage_device'].startswith('local-disk'):
-        target_dev = data['@storage_device'][10:].replace('-', '/')
-        mounted_partitions = diskctl.list_mounted_partitions()
-        for partition in list(mounted_partitions.values()):
-            if partition['target'] == target_dev and data['target_dir'].startswith(
-                partition['mount_point']
-            ):
-                ui['root_directory'] = (
-                    data['target_dir'][len(partition['mount_point']) :] or '/'
-                )
-                break
-
-        else:  # not found for some reason
-            logging.error(
-                f'could not find mounted partition for device "{target_dev}" and target dir "{data["target_dir"]}"'
-            )
-
-            ui['root_directory'] = data['target_dir']
-
-    else:
-        ui['root_directory'] = data['target_dir']
-
-    # disk usage
-    usage = None
-    if os.path.exists(data['target_dir']):
-        usage = utils.get_disk_usage(data['target_dir'])
-    if usage:
-        ui['disk_used'], ui['disk_total'] = usage
-
     ui['text_scale'] = data['text_scale']
     text_left = data['text_left']
     text_right = data['text_right']
@@ -2018,10 +2083,6 @@ def motion_camera_dict_to_ui(data):  # noqa: C901
 
     ui['extra_options'] = extra_options
 
-    # action commands
-    action_commands = get_action_commands(data)
-    ui['actions'] = list(action_commands.keys())
-
     return ui
 
 
@@ -2092,15 +2153,16 @@ def get_action_commands(camera_config):
 
 
 def get_monitor_command(camera_id):
-    if camera_id not in _monitor_command_cache:
+    generation = get_generation(camera_id)
+    cached = _monitor_command_cache.get(camera_id)
+    if cached is None or cached[0] != generation:
         path = os.path.join(settings.CONF_PATH, f'monitor_{camera_id}')
-        if os.access(path, os.X_OK):
-            _monitor_command_cache[camera_id] = path
+        if not os.access(path, os.X_OK):
+            path = None
 
-        else:
-            _monitor_command_cache[camera_id] = None
+        cached = _monitor_command_cache[camera_id] = (generation, path)
 
-    return _monitor_command_cache[camera_id]
+    return cached[1]
 
 
 def invalidate_monitor_commands():
@@ -2184,12 +2246,82 @@ def invalidate():
     global _camera_config_cache
     global _camera_ids_cache
     global _additional_structure_cache
+    global _additional_structure_version
 
     logging.debug('invalidating config cache')
     _main_config_cache = None
     _camera_config_cache = {}
     _camera_ids_cache = None
     _additional_structure_cache = {}
+    _additional_structure_version += 1
+    _file_stats.clear()
+    _add_generation()
+
+
+def get_generation(camera_id=None):
+    """Returns a number that changes whenever the config of the given camera
+    changes, for the caches of values derived from it. Changes to the main
+    config count as changes to all cameras."""
+
+    _check_files()
+
+    return max(_generations.get(camera_id, 0), _all_generation)
+
+
+def _add_generation(camera_id=None):
+    global _generation
+    global _all_generation
+
+    _generation += 1
+    if camera_id is None:
+        _all_generation = _generation
+
+    else:
+        _generations[camera_id] = _generation
+
+
+def _get_file_stat(path):
+    try:
+        st = os.stat(path)
+
+    except OSError:
+        return None
+
+    return st.st_mtime_ns, st.st_size
+
+
+def _check_files():
+    # picks up the config files that were changed by others,
+    # checking them at most once every CONFIG_CHECK_INTERVAL seconds
+    global _last_check_time
+    global _main_config_cache
+    global _camera_ids_cache
+
+    now = time.monotonic()
+    if now - _last_check_time < settings.CONFIG_CHECK_INTERVAL:
+        return
+
+    _last_check_time = now
+
+    for path, (owner, file_stat) in list(_file_stats.items()):
+        if _get_file_stat(path) == file_stat:
+            continue
+
+        del _file_stats[path]
+        if owner == 'dir':  # camera config files were added or removed
+            _camera_ids_cache = None
+            continue
+
+        logging.debug(f'config file {path} has changed')
+        if owner == 'main':  # the enabled state of all cameras may have changed
+            _main_config_cache = None
+            _camera_config_cache.clear()
+
+        else:
+            _camera_config_cache.pop(owner, None)
+            _camera_ids_cache = None
+
+        _add_generation(None if owner == 'main' else owner)
 
 
 def _value_to_python(value):
@@ -2425,6 +2557,8 @@ def _set_default_motion_camera(camera_id, data):
     data.setdefault('@upload_secret_key', '')
     data.setdefault('@upload_bucket', '')
     data.setdefault('@upload_sse_c_key', '')
+    data.setdefault('@upload_concurrency', 2)
+    data.setdefault('@upload_bandwidth', 0)
     data.setdefault('@clean_cloud_enabled', False)
 
     data.setdefault('stream_localhost', True)
@@ -116,6 +116,29 @@ class BaseHandler(RequestHandler):
 
         return argument
 
+    def get_paging_arguments(self) -> dict:
+        """Returns the limit, cursor, order and since arguments of a media listing request."""
+
+        try:
+            limit = self.get_argument('limit', None)
+            limit = int(limit) if limit is not None else None
+            since = self.get_argument('since', None)
+            since = float(since) if since is not None else None
+
+        except ValueError:
+            raise HTTPError(400, 'invalid paging arguments')
+
+        order = self.get_argument('order', 'asc')
+        if order not in ('asc', 'desc') or (limit is not None and limit < 1):
+            raise HTTPError(400, 'invalid paging arguments')
+
+        return {
+            'limit': limit,
+            'cursor': self.get_argument('cursor', None),
+            'order': order,
+            'since': since,
+        }
+
     def finish(self, chunk=None):
         if not self._finished:
             import motioneye
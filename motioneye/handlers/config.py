@@ -19,8 +19,10 @@ import datetime
 import json
 import logging
 import socket
+from typing import Optional
 from urllib.parse import urlparse
 
+from tornado import gen
 from tornado.ioloop import IOLoop
 from tornado.web import HTTPError
 
@@ -421,69 +423,47 @@ class ConfigHandler(BaseHandler):
     def finish_json_with_error(self, error_msg: str):
         return self.finish_json({'error': error_msg})
 
-    def check_finished(self, cameras: list, length: list) -> bool:
-        if len(cameras) == length[0]:
-            cameras.sort(key=lambda c: c['id'])
-            self.finish_json({'cameras': cameras})
-            return True
-        else:
-            return False
-
-    def _handle_get_config_response(
-        self,
-        camera_id,
-        local_config,
-        resp: utils.GetConfigResponse,
-        cameras: list,
-        length: list,
-    ) -> None:
+    def _make_remote_ui_config(
+        self, camera_id, local_config, resp: utils.GetConfigResponse
+    ) -> Optional[dict]:
         if resp.error:
             msg = f'Failed to get remote camera configuration for {remote.pretty_camera_url(local_config)}: {resp.error}.'
-            cameras.append(
-                {
-                    'id': camera_id,
-                    'name': f'Camera {camera_id} - Connection failed',
-                    'enabled': False,
-                    'connection_failed': True,
-                    'connection_error': msg,
-                    'connection_url': remote.pretty_camera_url(
-                        local_config, camera=False
-                    ),
-                    'streaming_framerate': 1,
-                    'framerate': 1,
-                }
-            )
-
-        else:
-            resp.remote_ui_config['id'] = camera_id
-
-            # admin_only is a local-only flag and is never synced from the remote
-            local_config.setdefault('@admin_only', False)
-            admin_only = bool(local_config.get('@admin_only', False))
-
-            # do not add this camera to the list if admin-only, but reduce the async counter so listing can finish
-            if admin_only and self.current_user not in ['admin', 'peer']:
-                length[0] -= 1
-                self.check_finished(cameras, length)
-                return
-
-            if not resp.remote_ui_config['enabled'] and local_config['@enabled']:
-                # if a remote camera is disabled, make sure it's disabled locally as well
-                local_config['@enabled'] = False
-                config.set_camera(camera_id, local_config)
+            return {
+                'id': camera_id,
+                'name': f'Camera {camera_id} - Connection failed',
+                'enabled': False,
+                'connection_failed': True,
+                'connection_error': msg,
+                'connection_url': remote.pretty_camera_url(local_config, camera=False),
+                'streaming_framerate': 1,
+                'framerate': 1,
+            }
+
+        resp.remote_ui_config['id'] = camera_id
+
+        # admin_only is a local-only flag and is never synced from the remote
+        local_config.setdefault('@admin_only', False)
+        admin_only = bool(local_config.get('@admin_only', False))
+
+        # do not add this camera to the list if admin-only
+        if admin_only and self.current_user not in ['admin', 'peer']:
+            return None
+
+        if not resp.remote_ui_config['enabled'] and local_config['@enabled']:
+            # if a remote camera is disabled, make sure it's disabled locally as well
+            local_config['@enabled'] = False
+            config.set_camera(camera_id, local_config)
 
-            elif resp.remote_ui_config['enabled'] and not local_config['@enabled']:
-                # if a remote camera is locally disabled, make sure the remote config says the same thing
-                resp.remote_ui_config['enabled'] = False
+        elif resp.remote_ui_config['enabled'] and not local_config['@enabled']:
+            # if a remote camera is locally disabled, make sure the remote config says the same thing
+            resp.remote_ui_config['enabled'] = False
 
-            for key, value in list(local_config.items()):
-                if key == '@remote_secret':
-                    continue
-                resp.remote_ui_config[key.replace('@', '')] = value
+        for key, value in list(local_config.items()):
+            if key == '@remote_secret':
+                continue
+            resp.remote_ui_config[key.replace('@', '')] = value
 
-            cameras.append(resp.remote_ui_config)
-
-        self.check_finished(cameras, length)
+        return resp.remote_ui_config
 
     @BaseHandler.auth()
     @BaseHandler.peer_allowed()
@@ -566,13 +546,11 @@ class ConfigHandler(BaseHandler):
             return self.finish_json({'cameras': cameras})
 
         else:  # assuming local motionEye camera listing
-            cameras = []
             camera_ids = config.get_camera_ids()
             if not config.get_main().get('@enabled'):
                 camera_ids = []
 
-            length = [len(camera_ids)]
-
+            local_configs = {}
             for camera_id in camera_ids:
                 local_config = config.get_camera(camera_id)
                 if local_config is None:
@@ -585,38 +563,42 @@ class ConfigHandler(BaseHandler):
                 ):
                     continue
 
+                local_configs[camera_id] = local_config
+
+            # the configs of the remote cameras are fetched concurrently;
+            # don't try to reach the remote if the camera is disabled
+            force = self.get_argument('force', None) == 'true'
+            remote_camera_ids = [
+                camera_id
+                for camera_id, local_config in local_configs.items()
+                if utils.is_remote_camera(local_config)
+                and (local_config.get('@enabled') or force)
+            ]
+            responses = await gen.multi(
+                [remote.get_config(local_configs[i]) for i in remote_camera_ids]
+            )
+            responses = dict(zip(remote_camera_ids, responses))
+
+            cameras = []
+            for camera_id, local_config in local_configs.items():
                 if utils.is_local_motion_camera(local_config):
-                    ui_config = config.motion_camera_dict_to_ui(local_config)
-                    cameras.append(ui_config)
-                    if self.check_finished(cameras, length):
-                        return
+                    cameras.append(config.motion_camera_dict_to_ui(local_config))
 
                 elif utils.is_remote_camera(local_config):
-                    if (
-                        local_config.get('@enabled')
-                        or self.get_argument('force', None) == 'true'
-                    ):
-                        resp = await remote.get_config(local_config)
-                        if self._handle_get_config_response(
-                            camera_id, local_config, resp, cameras, length
-                        ):
-                            return
-
-                    else:  # don't try to reach the remote of the camera is disabled
-                        if self._handle_get_config_response(
-                            camera_id,
-                            local_config,
-                            utils.GetConfigResponse(None, error=True),
-                            cameras,
-                            length,
-                        ):
-                            return
+                    resp = responses.get(camera_id)
+                    if resp is None:
+                        resp = utils.GetConfigResponse(None, error=True)
+
+                    ui_config = self._make_remote_ui_config(
+                        camera_id, local_config, resp
+                    )
+                    if ui_config is not None:
+                        cameras.append(ui_config)
 
                 else:  # assuming simple mjpeg camera
-                    ui_config = config.simple_mjpeg_camera_dict_to_ui(local_config)
-                    cameras.append(ui_config)
-                    if self.check_finished(cameras, length):
-                        return
+                    cameras.append(config.simple_mjpeg_camera_dict_to_ui(local_config))
+
+            cameras.sort(key=lambda c: c['id'])
 
             return self.finish_json({'cameras': cameras})
 
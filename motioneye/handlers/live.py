@@ -0,0 +1,153 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import json
+import logging
+import struct
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketClosedError, WebSocketHandler
+
+from motioneye import config, liveview, mediafiles, mjpgclient, utils
+from motioneye.handlers.base import BaseHandler
+
+__all__ = ('LiveHandler',)
+
+
+# live view of local cameras over a WebSocket;
+# the client sends {"cameras": {"<id>": {"width": ..., "height": ...}, ...}}
+# to (re)define its subscriptions and receives binary messages made of the
+# camera id (4 bytes, big endian) followed by a JPEG frame, as well as
+# {"status": {"<id>": {...}}} text messages with the changed status values
+class LiveHandler(WebSocketHandler, BaseHandler):
+    @BaseHandler.auth(prompt=False)
+    async def get(self, *args, **kwargs):
+        await WebSocketHandler.get(self, *args, **kwargs)
+
+    def open(self):
+        self._cameras = {}  # subscription (width, height) indexed by camera id
+        self._listeners = {}  # mjpg client frame listeners indexed by camera id
+        self._frames = {}  # latest unsent (jpg, seq) indexed by camera id
+        self._sending = False
+
+        logging.debug(f'live view client connected from {self.request.remote_ip}')
+
+    def on_message(self, message):
+        try:
+            cameras = json.loads(message)['cameras']
+            cameras = {
+                int(camera_id): (
+                    _get_size(options, 'width'),
+                    _get_size(options, 'height'),
+                )
+                for camera_id, options in cameras.items()
+            }
+
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logging.error(f'invalid live view message: {message!r}')
+            return self.close(1003, 'invalid message')
+
+        for camera_id in list(self._cameras):
+            if camera_id not in cameras:
+                self._unsubscribe(camera_id)
+
+        status = {}
+        for camera_id, size in cameras.items():
+            if camera_id in self._cameras:
+                self._cameras[camera_id] = size
+                continue
+
+            camera_config = config.get_camera(camera_id)
+            if not camera_config or not utils.is_local_motion_camera(camera_config):
+                logging.warning(f'ignoring live view of camera {camera_id}')
+                continue
+
+            # block access to admin-only cameras for non-admin users
+            if camera_config.get('@admin_only') and (
+                self.current_user not in ['admin', 'peer']
+            ):
+                logging.warning(f'live view of camera {camera_id} denied')
+                continue
+
+            self._cameras[camera_id] = size
+            self._listeners[camera_id] = functools.partial(self._on_frame, camera_id)
+            mjpgclient.add_listener(camera_id, self._listeners[camera_id])
+            mjpgclient.get_jpg(camera_id)  # makes sure the mjpg client is running
+            status[str(camera_id)] = liveview.get_status(camera_id)
+            liveview.add_subscriber(camera_id, self._on_status)
+
+        if status:
+            self._write_status(status)
+
+    def on_close(self):
+        for camera_id in list(self._cameras):
+            self._unsubscribe(camera_id)
+
+        self._frames.clear()
+
+        logging.debug(f'live view client disconnected from {self.request.remote_ip}')
+
+    def _unsubscribe(self, camera_id):
+        del self._cameras[camera_id]
+        self._frames.pop(camera_id, None)
+        mjpgclient.remove_listener(camera_id, self._listeners.pop(camera_id))
+        liveview.remove_subscriber(camera_id, self._on_status)
+
+    def _on_status(self, camera_id, delta):
+        self._write_status({str(camera_id): delta})
+
+    def _write_status(self, status):
+        try:
+            self.write_message(json.dumps({'status': status}))
+
+        except WebSocketClosedError:
+            pass
+
+    def _on_frame(self, camera_id, jpg, seq):
+        # only the latest frame of each camera is kept while a previous
+        # one is still being sent, so slow clients skip frames
+        self._frames[camera_id] = (jpg, seq)
+        if not self._sending:
+            self._sending = True
+            IOLoop.current().spawn_callback(self._send_frames)
+
+    async def _send_frames(self):
+        try:
+            while self._frames:
+                camera_id = next(iter(self._frames))
+                jpg, seq = self._frames.pop(camera_id)
+                width, height = self._cameras[camera_id]
+                jpg = mediafiles.resize_current_picture(
+                    config.get_camera(camera_id), jpg, width, height, seq=seq
+                )
+                if not jpg:
+                    continue
+
+                await self.write_message(
+                    struct.pack('>I', camera_id) + jpg, binary=True
+                )
+
+        except WebSocketClosedError:
+            self._frames.clear()
+
+        finally:
+            self._sending = False
+
+
+def _get_size(options, name):
+    value = options.get(name)
+    return value and float(value)
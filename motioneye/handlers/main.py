@@ -37,6 +37,7 @@ class MainHandler(BaseHandler):
         self.render(
             'main.html',
             frame=False,
+            frame_streaming=settings.ENABLE_FRAME_STREAMING,
             motion_version=motion_info[1] if motion_info else '(none)',
             os_version=' '.join(os_version),
             enable_update=settings.ENABLE_UPDATE,
@@ -57,6 +57,10 @@ class MovieHandler(BaseHandler):
             await self.list(camera_id)
             return
 
+        elif op == 'groups':
+            await self.groups(camera_id)
+            return
+
         elif op == 'preview':
             await self.preview(camera_id, filename)
             return
@@ -120,25 +124,38 @@ class MovieHandler(BaseHandler):
             # Get with_stat parameter from query string, default to True
             # Only 'false' is treated as false, everything else is true
             with_stat = self.get_argument('with_stat', 'true').lower() != 'false'
+            paging = self.get_paging_arguments()
 
             media_list = await mediafiles.list_media(
                 camera_config,
                 media_type='movie',
                 prefix=self.get_argument('prefix', None),
                 with_stat=with_stat,
+                **paging,
             )
             if media_list is None:
                 return self.finish_json({'error': 'Failed to get movies list.'})
 
-            return self.finish_json(
-                {'mediaList': media_list, 'cameraName': camera_config['camera_name']}
-            )
+            result = {
+                'mediaList': media_list,
+                'cameraName': camera_config['camera_name'],
+            }
+            if paging['limit'] is not None:
+                # a full page means there might be more files after it
+                result['nextCursor'] = (
+                    media_list[-1]['path']
+                    if len(media_list) == paging['limit']
+                    else None
+                )
+
+            return self.finish_json(result)
 
         elif utils.is_remote_camera(camera_config):
             resp = await remote.list_media(
                 camera_config,
                 media_type='movie',
                 prefix=self.get_argument('prefix', None),
+                **self.get_paging_arguments(),
             )
             if resp.error:
                 return self.finish_json(
@@ -154,6 +171,37 @@ class MovieHandler(BaseHandler):
         else:  # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
 
+    @BaseHandler.auth()
+    @BaseHandler.peer_allowed()
+    async def groups(self, camera_id):
+        logging.debug(f'listing movie groups for camera {camera_id}')
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            groups = await mediafiles.get_media_groups(camera_config, 'movie')
+            if groups is None:
+                return self.finish_json({'error': 'Failed to get movie groups.'})
+
+            return self.finish_json(
+                {'groups': groups, 'cameraName': camera_config['camera_name']}
+            )
+
+        elif utils.is_remote_camera(camera_config):
+            resp = await remote.get_media_groups(camera_config, media_type='movie')
+            if resp.error:
+                return self.finish_json(
+                    {
+                        'error': 'Failed to get movie groups for {url}: {msg}.'.format(
+                            url=remote.pretty_camera_url(camera_config), msg=resp.error
+                        )
+                    }
+                )
+
+            return self.finish_json(resp.result)
+
+        else:  # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
     @BaseHandler.auth()
     @BaseHandler.peer_allowed()
     async def preview(self, camera_id, filename):
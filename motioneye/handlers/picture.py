@@ -16,11 +16,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+from datetime import timedelta
 from os.path import basename, join
 from re import sub
 from typing import Optional
 
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Event
 from tornado.web import HTTPError
 
 from motioneye import (
@@ -29,6 +34,7 @@ from motioneye import (
     mjpgclient,
     monitor,
     motionctl,
+    preparedcache,
     remote,
     settings,
     utils,
@@ -39,6 +45,8 @@ __all__ = ('PictureHandler',)
 
 
 class PictureHandler(BaseHandler):
+    _BOUNDARY = 'motioneyeframe'
+
     def compute_etag(self):
         return None
 
@@ -49,6 +57,9 @@ class PictureHandler(BaseHandler):
         filename: Optional[str] = None,
         group: Optional[str] = None,
     ):
+        if camera_id == 'batch':
+            return await self.current_batch()
+
         camera_id = int(camera_id)  # type: ignore[assignment]
         if camera_id not in config.get_camera_ids():
             raise HTTPError(404, 'no such camera')
@@ -82,9 +93,18 @@ class PictureHandler(BaseHandler):
         if op == 'current':
             await self.current(camera_id)
 
+        elif op == 'stream':
+            await self.stream(camera_id)
+
+        elif op == 'recent':
+            await self.recent(camera_id)
+
         elif op == 'list':
             await self.list(camera_id)
 
+        elif op == 'groups':
+            await self.groups(camera_id)
+
         elif op == 'frame':
             await self.frame(camera_id)
 
@@ -149,7 +169,72 @@ class PictureHandler(BaseHandler):
 
     @BaseHandler.auth(prompt=False)
     @BaseHandler.peer_allowed()
-    async def current(self, camera_id, retry=0):
+    async def current_batch(self):
+        # the current pictures of several local cameras, as a multipart response
+        # with the status of each camera in the part headers
+        try:
+            camera_ids = [int(i) for i in self.get_argument('ids').split(',') if i]
+
+        except ValueError:
+            raise HTTPError(400, 'invalid ids argument')
+
+        width = self.get_argument('width', None)
+        height = self.get_argument('height', None)
+
+        width = width and float(width)
+        height = height and float(height)
+
+        camera_configs = {}
+        for camera_id in camera_ids:
+            camera_config = config.get_camera(camera_id)
+            if not camera_config or not utils.is_local_motion_camera(camera_config):
+                continue
+
+            # block access to admin-only cameras for non-admin users
+            if camera_config.get('@admin_only') and self.current_user not in [
+                'admin',
+                'peer',
+            ]:
+                continue
+
+            camera_configs[camera_id] = camera_config
+
+        pictures = await gen.multi(
+            [
+                _wait_current_picture(camera_configs[camera_id], width, height)
+                for camera_id in camera_configs
+            ]
+        )
+
+        self.set_header('Content-Type', 'multipart/mixed; boundary=' + self._BOUNDARY)
+        self.set_header('Cache-Control', 'no-store, must-revalidate')
+        self.set_header('Pragma', 'no-cache')
+        self.set_header('Expires', '0')
+
+        for camera_id, picture in zip(camera_configs, pictures):
+            picture = picture or b''
+            self.write(
+                b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+                b'X-Camera-Id: %d\r\nX-Motion-Detected: %s\r\n'
+                b'X-Capture-Fps: %.1f\r\nX-Monitor-Info: %s\r\n\r\n'
+                % (
+                    self._BOUNDARY.encode(),
+                    len(picture),
+                    camera_id,
+                    str(motionctl.is_motion_detected(camera_id)).lower().encode(),
+                    mjpgclient.get_fps(camera_id),
+                    monitor.get_monitor_info(camera_id).encode(),
+                )
+            )
+            self.write(picture)
+            self.write(b'\r\n')
+
+        self.write(b'--%s--\r\n' % self._BOUNDARY.encode())
+        self.finish()
+
+    @BaseHandler.auth(prompt=False)
+    @BaseHandler.peer_allowed()
+    async def current(self, camera_id):
         self.set_header('Content-Type', 'image/jpeg')
         self.set_header('Cache-Control', 'no-store, must-revalidate')
         self.set_header('Pragma', 'no-cache')
@@ -165,16 +250,12 @@ class PictureHandler(BaseHandler):
 
         camera_config = config.get_camera(camera_id)
         if utils.is_local_motion_camera(camera_config):
-            picture = mediafiles.get_current_picture(
-                camera_config, width=width, height=height
-            )
+            # clients that receive the frames via stream only ask for the status cookies
+            if self.get_argument('status', None) == 'true':
+                picture = b''
 
-            # picture is not available usually when the corresponding internal mjpeg client has been closed;
-            # get_current_picture() will make sure to start a client, but a jpeg frame is not available right away;
-            # wait at most 5 seconds and retry every 200 ms.
-            if not picture and retry < 25:
-                await gen.sleep(0.2)
-                return await self.current(camera_id=camera_id, retry=retry + 1)
+            else:
+                picture = await _wait_current_picture(camera_config, width, height)
 
             self.set_cookie(
                 'motion_detected_' + camera_id_str,
@@ -207,6 +288,107 @@ class PictureHandler(BaseHandler):
         else:  # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
 
+    @BaseHandler.auth(prompt=False)
+    @BaseHandler.peer_allowed()
+    async def stream(self, camera_id):
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            raise HTTPError(400, 'unknown operation')
+
+        width = self.get_argument('width', None)
+        height = self.get_argument('height', None)
+
+        width = width and float(width)
+        height = height and float(height)
+
+        self.set_header(
+            'Content-Type', 'multipart/x-mixed-replace; boundary=' + self._BOUNDARY
+        )
+        self.set_header('Cache-Control', 'no-store, must-revalidate')
+        self.set_header('Pragma', 'no-cache')
+        self.set_header('Expires', '0')
+
+        logging.debug(f'starting frame stream for camera {camera_id}')
+
+        # only the latest frame is kept for each subscriber; frames that arrive
+        # while the previous one is still being sent to a slow client are dropped
+        latest = []
+        frame_ready = Event()
+
+        def on_frame(jpg, seq):
+            latest[:] = [(jpg, seq)]
+            frame_ready.set()
+
+        mjpgclient.add_listener(camera_id, on_frame)
+        mjpgclient.get_jpg(camera_id)  # makes sure the mjpg client is running
+
+        stream = self.request.connection.stream
+        try:
+            while not stream.closed():
+                try:
+                    await frame_ready.wait(timeout=timedelta(seconds=1))
+
+                except gen.TimeoutError:
+                    # (re)starts the mjpg client if it's not running
+                    mjpgclient.get_jpg(camera_id)
+                    continue
+
+                frame_ready.clear()
+                jpg, seq = latest.pop()
+                jpg = mediafiles.resize_current_picture(
+                    camera_config, jpg, width, height, seq=seq
+                )
+                if not jpg:
+                    continue
+
+                self.write(
+                    b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                    % (self._BOUNDARY.encode(), len(jpg))
+                )
+                self.write(jpg)
+                self.write(b'\r\n')
+                await self.flush()
+
+        except StreamClosedError:
+            pass
+
+        finally:
+            mjpgclient.remove_listener(camera_id, on_frame)
+            logging.debug(f'frame stream for camera {camera_id} closed')
+
+    @BaseHandler.auth(prompt=False)
+    @BaseHandler.peer_allowed()
+    async def recent(self, camera_id):
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            raise HTTPError(400, 'unknown operation')
+
+        try:
+            since = self.get_argument('since', None)
+            since = int(since) if since is not None else None
+
+        except ValueError:
+            raise HTTPError(400, 'invalid since argument')
+
+        frames = mjpgclient.get_recent_frames(camera_id, since) or []
+
+        logging.debug(f'sending {len(frames)} recent frames of camera {camera_id}')
+
+        # each frame is sent as a part, along with its sequence number and time
+        self.set_header('Content-Type', 'multipart/mixed; boundary=' + self._BOUNDARY)
+        self.set_header('Cache-Control', 'no-store, must-revalidate')
+        for seq, frame_time, jpg in frames:
+            self.write(
+                b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+                b'X-Frame-Sequence: %d\r\nX-Frame-Time: %.3f\r\n\r\n'
+                % (self._BOUNDARY.encode(), len(jpg), seq, frame_time)
+            )
+            self.write(jpg)
+            self.write(b'\r\n')
+
+        self.write(b'--%s--\r\n' % self._BOUNDARY.encode())
+        self.finish()
+
     @BaseHandler.auth()
     @BaseHandler.peer_allowed()
     async def list(self, camera_id):
@@ -217,25 +399,38 @@ class PictureHandler(BaseHandler):
             # Get with_stat parameter from query string, default to True
             # Only 'false' is treated as false, everything else is true
             with_stat = self.get_argument('with_stat', 'true').lower() != 'false'
+            paging = self.get_paging_arguments()
 
             media_list = await mediafiles.list_media(
                 camera_config,
                 media_type='picture',
                 prefix=self.get_argument('prefix', None),
                 with_stat=with_stat,
+                **paging,
             )
             if media_list is None:
                 return self.finish_json({'error': 'Failed to get movies list.'})
 
-            return self.finish_json(
-                {'mediaList': media_list, 'cameraName': camera_config['camera_name']}
-            )
+            result = {
+                'mediaList': media_list,
+                'cameraName': camera_config['camera_name'],
+            }
+            if paging['limit'] is not None:
+                # a full page means there might be more files after it
+                result['nextCursor'] = (
+                    media_list[-1]['path']
+                    if len(media_list) == paging['limit']
+                    else None
+                )
+
+            return self.finish_json(result)
 
         elif utils.is_remote_camera(camera_config):
             resp = await remote.list_media(
                 camera_config,
                 media_type='picture',
                 prefix=self.get_argument('prefix', None),
+                **self.get_paging_arguments(),
             )
             if resp.error:
                 return self.finish_json(
@@ -251,6 +446,37 @@ class PictureHandler(BaseHandler):
         else:  # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
 
+    @BaseHandler.auth()
+    @BaseHandler.peer_allowed()
+    async def groups(self, camera_id):
+        logging.debug(f'listing picture groups for camera {camera_id}')
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            groups = await mediafiles.get_media_groups(camera_config, 'picture')
+            if groups is None:
+                return self.finish_json({'error': 'Failed to get picture groups.'})
+
+            return self.finish_json(
+                {'groups': groups, 'cameraName': camera_config['camera_name']}
+            )
+
+        elif utils.is_remote_camera(camera_config):
+            resp = await remote.get_media_groups(camera_config, media_type='picture')
+            if resp.error:
+                return self.finish_json(
+                    {
+                        'error': 'Failed to get picture groups for {url}: {msg}.'.format(
+                            url=remote.pretty_camera_url(camera_config), msg=resp.error
+                        )
+                    }
+                )
+
+            return self.finish_json(resp.result)
+
+        else:  # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
     async def frame(self, camera_id):
         camera_config = config.get_camera(camera_id)
 
@@ -434,8 +660,38 @@ class PictureHandler(BaseHandler):
     @BaseHandler.peer_allowed()
     async def zipped(self, camera_id, group):
         key = self.get_argument('key', None)
+        stream = self.get_argument('stream', None) == 'true'
         camera_config = config.get_camera(camera_id)
 
+        if stream and utils.is_local_motion_camera(camera_config):
+            logging.debug(
+                'streaming zip file for group "{group}" of camera {id}'.format(
+                    group=group or 'ungrouped', id=camera_id
+                )
+            )
+
+            zip_stream = await mediafiles.get_zip_stream(
+                camera_config, media_type='picture', group=group
+            )
+            if zip_stream is None:
+                raise HTTPError(500, 'failed to list media files')
+
+            self.set_zip_headers(camera_config, group)
+            self.set_header('Content-Length', zip_stream.size())
+            await self.write_chunks(zip_stream.chunks())
+            return self.finish()
+
+        elif stream and utils.is_remote_camera(camera_config):
+            # remote instances may not know about streaming, so the zip file is
+            # prepared there first and then relayed
+            resp = await remote.make_zipped_content(
+                camera_config, media_type='picture', group=group
+            )
+            if resp.error:
+                raise HTTPError(502, resp.error)
+
+            key = resp.result['key']
+
         if key:
             logging.debug(
                 'serving zip file for group "{group}" of camera {id} with key {key}'.format(
@@ -444,23 +700,12 @@ class PictureHandler(BaseHandler):
             )
 
             if utils.is_local_motion_camera(camera_config):
-                data = mediafiles.get_prepared_cache(key)
-                if not data:
-                    logging.error(
-                        'prepared cache data for key "%s" does not exist' % key
-                    )
+                f = self.open_prepared_cache(key)
+                with f:
+                    self.set_zip_headers(camera_config, group)
+                    await self.write_prepared_file(f)
 
-                    raise HTTPError(404, 'no such key')
-
-                pretty_filename = camera_config['camera_name'] + '_' + group
-                pretty_filename = sub('[^a-zA-Z0-9]', '_', pretty_filename)
-
-                self.set_header('Content-Type', 'application/zip')
-                self.set_header(
-                    'Content-Disposition',
-                    'attachment; filename=' + pretty_filename + '.zip;',
-                )
-                return self.finish(data)
+                return self.finish()
 
             elif utils.is_remote_camera(camera_config):
                 resp = await remote.get_zipped_content(
@@ -493,13 +738,12 @@ class PictureHandler(BaseHandler):
             )
 
             if utils.is_local_motion_camera(camera_config):
-                data = await mediafiles.get_zipped_content(
+                key = await mediafiles.get_zipped_content(
                     camera_config, media_type='picture', group=group
                 )
-                if data is None:
+                if key is None:
                     return self.finish_json({'error': 'Failed to create zip file.'})
 
-                key = mediafiles.set_prepared_cache(data)
                 logging.debug(
                     'prepared zip file for group "{group}" of camera {id} with key {key}'.format(
                         group=group or 'ungrouped', id=camera_id, key=key
@@ -526,11 +770,54 @@ class PictureHandler(BaseHandler):
             else:  # assuming simple mjpeg camera
                 raise HTTPError(400, 'unknown operation')
 
+    def set_zip_headers(self, camera_config, group):
+        pretty_filename = camera_config['camera_name'] + '_' + group
+        pretty_filename = sub('[^a-zA-Z0-9]', '_', pretty_filename)
+
+        self.set_header('Content-Type', 'application/zip')
+        self.set_header(
+            'Content-Disposition',
+            'attachment; filename=' + pretty_filename + '.zip;',
+        )
+
+    def open_prepared_cache(self, key):
+        f = mediafiles.open_prepared_cache(key)
+        if f is None:
+            logging.error('prepared cache data for key "%s" does not exist' % key)
+
+            raise HTTPError(404, 'no such key')
+
+        return f
+
+    async def write_prepared_file(self, f):
+        self.set_header('Content-Length', os.fstat(f.fileno()).st_size)
+        await self.write_chunks(preparedcache.read_chunks(f))
+
+    async def write_chunks(self, chunks):
+        # files are read in a worker thread, one chunk at a time; waiting for
+        # each chunk to be flushed keeps memory usage bounded on slow clients
+        io_loop = IOLoop.current()
+        try:
+            while True:
+                chunk = await io_loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+
+                self.write(chunk)
+                await self.flush()
+
+        except StreamClosedError:
+            logging.debug('client closed connection while streaming file')
+
+        finally:
+            chunks.close()
+
     @BaseHandler.auth()
     @BaseHandler.peer_allowed()
     async def timelapse(self, camera_id, group):
         key = self.get_argument('key', None)
         check = self.get_argument('check', False)
+        job_id = self.get_argument('job', None)
         camera_config = config.get_camera(camera_id)
 
         if key:  # download
@@ -541,14 +828,7 @@ class PictureHandler(BaseHandler):
             )
 
             if utils.is_local_motion_camera(camera_config):
-                data = mediafiles.get_prepared_cache(key)
-                if data is None:
-                    logging.error(
-                        'prepared cache data for key "%s" does not exist' % key
-                    )
-
-                    raise HTTPError(404, 'no such key')
-
+                f = self.open_prepared_cache(key)
                 pretty_filename = camera_config['camera_name'] + '_' + group
                 pretty_filename = sub('[^a-zA-Z0-9]', '_', pretty_filename)
                 filename_ext = mediafiles.FFMPEG_EXT_MAPPING.get(
@@ -566,7 +846,10 @@ class PictureHandler(BaseHandler):
                     'Content-Disposition',
                     'attachment; filename=' + pretty_filename + ';',
                 )
-                return self.finish(data)
+                with f:
+                    await self.write_prepared_file(f)
+
+                return self.finish()
 
             elif utils.is_remote_camera(camera_config):
                 resp = await remote.get_timelapse_movie(camera_config, key, group=group)
@@ -596,21 +879,20 @@ class PictureHandler(BaseHandler):
             )
 
             if utils.is_local_motion_camera(camera_config):
-                status = mediafiles.check_timelapse_movie()
-                if status['progress'] == -1 and status['data']:
-                    key = mediafiles.set_prepared_cache(status['data'])
+                status = mediafiles.check_timelapse_movie(camera_id, group, job_id)
+                if status['progress'] == -1 and status['key']:
                     logging.debug(
                         'prepared timelapse movie for group "{group}" of camera {id} with key {key}'.format(
-                            group=group or 'ungrouped', id=camera_id, key=key
+                            group=group or 'ungrouped', id=camera_id, key=status['key']
                         )
                     )
-                    return self.finish_json({'key': key, 'progress': -1})
 
-                else:
-                    return self.finish_json(status)
+                return self.finish_json(status)
 
             elif utils.is_remote_camera(camera_config):
-                resp = await remote.check_timelapse_movie(camera_config, group=group)
+                resp = await remote.check_timelapse_movie(
+                    camera_config, group=group, job_id=job_id
+                )
                 if resp.error:
                     msg = 'Failed to check timelapse movie progress at {url}: {msg}.'.format(
                         url=remote.pretty_camera_url(camera_config), msg=resp.error
@@ -640,17 +922,18 @@ class PictureHandler(BaseHandler):
             logging.debug(msg)
 
             if utils.is_local_motion_camera(camera_config):
-                status = mediafiles.check_timelapse_movie()
+                status = mediafiles.check_timelapse_movie(camera_id, group)
                 if status['progress'] != -1:
+                    # timelapse already active for this group
                     return self.finish_json(
-                        {'progress': status['progress']}
-                    )  # timelapse already active
+                        {'progress': status['progress'], 'jobId': status['jobId']}
+                    )
 
                 else:
-                    mediafiles.make_timelapse_movie(
+                    job_id = mediafiles.make_timelapse_movie(
                         camera_config, framerate, interval, group=group
                     )
-                    return self.finish_json({'progress': -1})
+                    return self.finish_json({'progress': -1, 'jobId': job_id})
 
             elif utils.is_remote_camera(camera_config):
                 check_timelapse_resp = await remote.check_timelapse_movie(
@@ -669,7 +952,10 @@ class PictureHandler(BaseHandler):
                 if check_timelapse_resp.result['progress'] != -1:
                     # timelapse already active
                     return self.finish_json(
-                        {'progress': check_timelapse_resp.result['progress']}
+                        {
+                            'progress': check_timelapse_resp.result['progress'],
+                            'jobId': check_timelapse_resp.result.get('jobId'),
+                        }
                     )
 
                 make_timelapse_resp = await remote.make_timelapse_movie(
@@ -685,7 +971,9 @@ class PictureHandler(BaseHandler):
                         }
                     )
 
-                return self.finish_json({'progress': -1})
+                return self.finish_json(
+                    {'progress': -1, 'jobId': make_timelapse_resp.result.get('jobId')}
+                )
 
             else:  # assuming simple mjpeg camera
                 raise HTTPError(400, 'unknown operation')
@@ -732,3 +1020,19 @@ class PictureHandler(BaseHandler):
 
         except OSError as e:
             logging.warning(f'could not write response: {str(e)}')
+
+
+async def _wait_current_picture(camera_config, width, height):
+    # picture is not available usually when the corresponding internal mjpeg client has been closed;
+    # get_current_picture() will make sure to start a client, but a jpeg frame is not available right away;
+    # wait at most 5 seconds and retry every 200 ms.
+    picture = mediafiles.get_current_picture(camera_config, width=width, height=height)
+    retry = 0
+    while picture is None and retry < 25:
+        await gen.sleep(0.2)
+        retry += 1
+        picture = mediafiles.get_current_picture(
+            camera_config, width=width, height=height
+        )
+
+    return picture
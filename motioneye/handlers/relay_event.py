@@ -19,7 +19,16 @@ import logging
 from os import sep
 from typing import Optional
 
-from motioneye import config, mediafiles, motionctl, tasks, uploadservices, utils
+from motioneye import (
+    config,
+    mediafiles,
+    mjpgclient,
+    motionctl,
+    settings,
+    tasks,
+    uploadservices,
+    utils,
+)
 from motioneye.handlers.base import BaseHandler
 
 __all__ = ('RelayEventHandler',)
@@ -88,44 +97,40 @@ class RelayEventHandler(BaseHandler):
 
             motionctl.set_motion_detected(camera_id, True)
 
+            # pre-event pictures for the notifications
+            if settings.MJPG_CLIENT_RECENT_FRAMES:
+                mjpgclient.save_event_frames(camera_id)
+
         elif event == 'stop':
             motionctl.set_motion_detected(camera_id, False)
 
         elif event == 'movie_end':
+            mediafiles.add_media_file(camera_config, filename)
+
             # generate preview (thumbnail)
             tasks.add(
                 5,
                 mediafiles.make_movie_preview,
                 tag='make_movie_preview(%s)' % filename,
+                lane='preview',
                 camera_config=camera_config,
                 full_path=filename,
             )
 
             # upload to external service
             if camera_config['@upload_enabled'] and camera_config['@upload_movie']:
-                self.upload_media_file(filename, camera_id, camera_config)
+                uploadservices.schedule_upload(camera_id, camera_config, filename)
 
         elif event == 'picture_save':
-            # upload to external service
+            mediafiles.add_media_file(camera_config, filename)
+
+            # upload to external service, along with the other pictures of a burst
             if camera_config['@upload_enabled'] and camera_config['@upload_picture']:
-                self.upload_media_file(filename, camera_id, camera_config)
+                uploadservices.schedule_upload(
+                    camera_id, camera_config, filename, batch=True
+                )
 
         else:
             logging.warning(f'unknown event {event}')
 
         self.finish_json()
-
-    def upload_media_file(self, filename, camera_id, camera_config):
-        service_name = camera_config['@upload_service']
-
-        tasks.add(
-            5,
-            uploadservices.upload_media_file,
-            tag='upload_media_file(%s)' % filename,
-            camera_id=camera_id,
-            service_name=service_name,
-            camera_name=camera_config['camera_name'],
-            target_dir=camera_config['@upload_subfolders']
-            and camera_config['target_dir'],
-            filename=filename,
-        )
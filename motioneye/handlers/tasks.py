@@ -0,0 +1,58 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from tornado.web import HTTPError
+
+from motioneye import tasks
+from motioneye.handlers.base import BaseHandler
+
+__all__ = ('TasksHandler',)
+
+
+class TasksHandler(BaseHandler):
+    @BaseHandler.auth(admin=True)
+    def get(self, op):
+        if op == 'status':
+            self.finish_json(tasks.get_status())
+
+        elif op == 'dead':
+            self.finish_json({'tasks': tasks.get_dead()})
+
+        else:
+            raise HTTPError(400, 'unknown operation')
+
+    @BaseHandler.auth(admin=True)
+    def post(self, op):
+        if op == 'replay':
+            self.replay()
+
+        else:
+            raise HTTPError(400, 'unknown operation')
+
+    def replay(self):
+        # replays the given dead tasks, or all of them if no ids are given
+        ids = self.get_argument('ids', None)
+        if ids is not None:
+            try:
+                if isinstance(ids, str):
+                    ids = ids.split(',')
+
+                ids = {int(i) for i in ids}
+
+            except (TypeError, ValueError):
+                raise HTTPError(400, 'invalid task ids')
+
+        self.finish_json({'replayed': tasks.replay(ids)})
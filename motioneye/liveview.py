@@ -0,0 +1,118 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Live status of the local cameras (motion detected, capture fps and monitor info),
+pushed to the subscribed live view clients whenever it changes.
+
+Motion detection changes are announced by motionctl; the capture fps and the
+monitor info are sampled once per second, but only for cameras that have
+subscribers.
+"""
+
+import datetime
+import logging
+from typing import Callable
+
+from tornado.ioloop import IOLoop
+
+_SAMPLE_INTERVAL = 1  # seconds
+
+_status: dict = {}  # status dicts indexed by camera id
+_subscribers: dict = {}  # sets of status callbacks indexed by camera id
+_sample_timeout = None
+
+
+def get_status(camera_id: int) -> dict:
+    update_status(camera_id, **_read_status(camera_id))
+
+    return dict(_status[camera_id])
+
+
+def add_subscriber(camera_id: int, callback: Callable[[int, dict], None]) -> None:
+    """Registers a callback to be called with (camera_id, changed values)
+    whenever the status of a camera changes."""
+
+    global _sample_timeout
+
+    _subscribers.setdefault(camera_id, set()).add(callback)
+
+    if _sample_timeout is None:
+        io_loop = IOLoop.current()
+        _sample_timeout = io_loop.add_timeout(
+            datetime.timedelta(seconds=_SAMPLE_INTERVAL), _sample
+        )
+
+
+def remove_subscriber(camera_id: int, callback: Callable[[int, dict], None]) -> None:
+    subscribers = _subscribers.get(camera_id)
+    if subscribers is None:
+        return
+
+    subscribers.discard(callback)
+    if not subscribers:
+        del _subscribers[camera_id]
+
+
+def update_status(camera_id: int, **values) -> None:
+    status = _status.setdefault(camera_id, {})
+    delta = {k: v for k, v in values.items() if status.get(k) != v}
+    if not delta:
+        return
+
+    status.update(delta)
+
+    for callback in list(_subscribers.get(camera_id, ())):
+        try:
+            callback(camera_id, delta)
+
+        except Exception as e:
+            logging.error(f'live status subscriber failed: {e}', exc_info=True)
+
+
+def _read_status(camera_id: int) -> dict:
+    from motioneye import mjpgclient, monitor, motionctl
+
+    return {
+        'motion_detected': motionctl.is_motion_detected(camera_id),
+        'capture_fps': round(mjpgclient.get_fps(camera_id), 1),
+        'monitor_info': monitor.get_monitor_info(camera_id),
+    }
+
+
+def _sample() -> None:
+    global _sample_timeout
+
+    from motioneye import mjpgclient
+
+    _sample_timeout = None
+    if not _subscribers:
+        return  # sampling is resumed by the next subscriber
+
+    for camera_id in list(_subscribers):
+        try:
+            mjpgclient.get_jpg(camera_id)  # (re)starts the mjpg client if needed
+            update_status(camera_id, **_read_status(camera_id))
+
+        except Exception as e:
+            logging.error(
+                f'failed to sample live status of camera {camera_id}: {e}',
+                exc_info=True,
+            )
+
+    io_loop = IOLoop.current()
+    _sample_timeout = io_loop.add_timeout(
+        datetime.timedelta(seconds=_SAMPLE_INTERVAL), _sample
+    )
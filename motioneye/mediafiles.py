@@ -14,28 +14,36 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
-import fcntl
-import functools
 import logging
-import multiprocessing
 import os.path
 import re
+import signal
 import subprocess
-from errno import EAGAIN, ENOENT
-from hashlib import sha1
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from errno import ENOENT
 from io import BytesIO
 from shlex import quote
-from signal import SIGKILL, SIGTERM
-from time import time
-from typing import Awaitable, List, Optional
+from typing import Awaitable, Callable, List, Optional
 from zipfile import ZipFile
 
 from PIL import Image
+from tornado import gen
 from tornado.concurrent import Future
-from tornado.ioloop import IOLoop
 
-from motioneye import config, settings, uploadservices, utils
+from motioneye import (
+    config,
+    mediaindex,
+    mediawatcher,
+    preparedcache,
+    settings,
+    uploadservices,
+    utils,
+    zipstream,
+)
 from motioneye.utils.dtconv import pretty_date_time
 
 _PICTURE_EXTS = ['.jpg']
@@ -95,11 +103,25 @@ MOVIE_EXT_TYPE_MAPPING = {
     'mkv': 'video/x-matroska',
 }
 
-# a cache of prepared files (whose preparing time is significant)
-_prepared_files: dict = {}
-
-_timelapse_process = None
-_timelapse_data = None
+# per-group aggregates (count, total size, newest mtime) of the media files,
+# indexed by (camera id, media type); each entry is an (expiry time, groups,
+# files) tuple, where files maps the counted paths to their sizes, unless the
+# groups come from the media index; the generation changes along with the
+# media files, so that groups listed meanwhile are not cached
+_media_groups_cache: dict = {}
+_media_groups_generation = 0
+_MEDIA_GROUPS_CACHE_TTL = 300  # seconds
+
+# resized variants of the last frame of each camera, indexed by camera id;
+# each entry is a (frame sequence, {(width, height): jpg}) tuple
+_resized_frames_cache: dict = {}
+_RESIZED_FRAMES_MAX_SIZES = 8
+
+# the pool of processes that list and zip media files, and its running tasks,
+# indexed by request
+_workers: Optional[ProcessPoolExecutor] = None
+_in_flight: dict = {}
+_submitted: set = set()  # the futures of the tasks submitted to the pool
 
 _ffmpeg_binary_cache = None
 
@@ -109,6 +131,20 @@ def _list_media_files(
     exts: List[str],
     sub_path: Optional[str] = None,
     with_stat: bool = True,
+) -> List[tuple]:
+    # answer from the live catalogue, if it covers the requested path
+    media_files = mediawatcher.list_media_files(base_path, exts, sub_path, with_stat)
+    if media_files is not None:
+        return media_files
+
+    return _scan_media_files(base_path, exts, sub_path, with_stat)
+
+
+def _scan_media_files(
+    base_path: str,
+    exts: List[str],
+    sub_path: Optional[str] = None,
+    with_stat: bool = True,
 ) -> List[tuple]:
     # Determine scan path based on sub_path parameter
     if sub_path is not None:
@@ -147,7 +183,7 @@ def _list_media_files(
 
         # recurse into subdirectories only when no sub_path filter is set
         elif sub_path is None and entry.is_dir(follow_symlinks=False):
-            media_files.extend(_list_media_files(entry.path, exts, with_stat=with_stat))
+            media_files.extend(_scan_media_files(entry.path, exts, with_stat=with_stat))
 
     return media_files
 
@@ -159,10 +195,12 @@ def _remove_older_files(
     exts: List[str],
 ):
     removed_folder_count = 0
+    removed_files = []
     for full_path, st in _list_media_files(directory, exts, with_stat=True):
         file_moment = datetime.datetime.fromtimestamp(st.st_mtime)
         if file_moment < moment:
             logging.debug(f'removing file {full_path}...')
+            removed_files.append(full_path)
 
             # remove the file itself
             try:
@@ -205,47 +243,124 @@ def _remove_older_files(
     if clean_cloud_info and removed_folder_count > 0:
         uploadservices.clean_cloud(directory, {}, clean_cloud_info)
 
+    return removed_files
 
-def _do_list_media(pipe, target_dir, exts, sub_path, with_stat):
+
+def _make_media_entry(path: str, timestamp: float, size: int) -> dict:
     from mimetypes import guess_type
 
-    mf = _list_media_files(target_dir, exts, sub_path, with_stat)
+    mime_type = guess_type(path)[0]
+
+    return {
+        'path': path,
+        'mimeType': mime_type if mime_type is not None else 'video/mpeg',
+        'momentStr': pretty_date_time(datetime.datetime.fromtimestamp(timestamp)),
+        'momentStrShort': pretty_date_time(
+            datetime.datetime.fromtimestamp(timestamp), short=True
+        ),
+        'size': size,
+        'sizeStr': utils.pretty_size(size),
+        'timestamp': timestamp,
+    }
+
+
+def _rel_media_path(target_dir: str, full_path: str) -> str:
+    path = full_path[len(target_dir) :]
+    if not path.startswith('/'):
+        path = '/' + path
+
+    return path
+
+
+def _select_page(
+    media_files: List[tuple],
+    target_dir: str,
+    limit: Optional[int],
+    cursor: Optional[str],
+    order: str,
+    since: Optional[float],
+    with_stat: bool,
+) -> List[tuple]:
+    # media files are expected to carry their stat only when filtering by time
+    if since is not None:
+        media_files = [(p, st) for p, st in media_files if st.st_mtime > since]
+
+    reverse = order == 'desc'
+    media_files.sort(key=lambda e: e[0], reverse=reverse)
+
+    if cursor is not None:
+        if reverse:
+            media_files = [
+                e for e in media_files if _rel_media_path(target_dir, e[0]) < cursor
+            ]
+
+        else:
+            media_files = [
+                e for e in media_files if _rel_media_path(target_dir, e[0]) > cursor
+            ]
+
+    if limit is not None:
+        media_files = media_files[:limit]
+
+    if not with_stat:
+        return [(p, None) for p, st in media_files]
+
+    # only stat the files that made it into the page
+    page = []
+    for p, st in media_files:
+        if st is None:
+            try:
+                st = os.stat(p, follow_symlinks=False)
+
+            except Exception as e:
+                logging.error(f'stat failed: {e}')
+                continue
+
+        page.append((p, st))
+
+    return page
+
+
+def _do_list_media(
+    target_dir,
+    exts,
+    sub_path,
+    with_stat,
+    limit=None,
+    cursor=None,
+    order='asc',
+    since=None,
+    media_files=None,
+):
+    # the files are ordered even when not paged, just like the media index
+    # returns them; only the selected ones are stat'ed. The files come from the
+    # catalogue of the parent process, if it covers them; the copy of the
+    # catalogue inherited by the workers is not kept up to date.
+    mf = media_files
+    if mf is None:
+        mf = _scan_media_files(target_dir, exts, sub_path, since is not None)
+
+    mf = _select_page(mf, target_dir, limit, cursor, order, since, with_stat)
+
+    media_list = []
     for p, st in mf:
-        path = p[len(target_dir) :]
-        if not path.startswith('/'):
-            path = '/' + path
+        path = _rel_media_path(target_dir, p)
 
         if with_stat and st is not None:
-            timestamp = st.st_mtime
-            size = st.st_size
-
-            pipe.send(
-                {
-                    'path': path,
-                    'mimeType': (
-                        guess_type(path)[0]
-                        if guess_type(path)[0] is not None
-                        else 'video/mpeg'
-                    ),
-                    'momentStr': pretty_date_time(
-                        datetime.datetime.fromtimestamp(timestamp)
-                    ),
-                    'momentStrShort': pretty_date_time(
-                        datetime.datetime.fromtimestamp(timestamp), short=True
-                    ),
-                    'sizeStr': utils.pretty_size(size),
-                    'timestamp': timestamp,
-                }
-            )
+            media_list.append(_make_media_entry(path, st.st_mtime, st.st_size))
+
         else:
             # When stat is not available, only send the path
-            pipe.send({'path': path})
+            media_list.append({'path': path})
+
+    return media_list
 
-    pipe.close()
 
+def _do_zip(target_dir, exts, sub_path, zip_filename, media_files=None):
+    mf = media_files
+    if mf is None:
+        mf = _scan_media_files(target_dir, exts, sub_path, with_stat=False)
 
-def _do_zip(pipe, target_dir, exts, sub_path, working):
-    mf = _list_media_files(target_dir, exts, sub_path, with_stat=False)
     paths = []
     for p, st in mf:  # st will be None when with_stat=False
         path = p[len(target_dir) :]
@@ -254,7 +369,6 @@ def _do_zip(pipe, target_dir, exts, sub_path, working):
 
         paths.append(path)
 
-    zip_filename = os.path.join(settings.MEDIA_PATH, f'.zip-{int(time())}')
     logging.debug(f'adding {len(paths)} files to zip file "{zip_filename}"')
 
     try:
@@ -266,37 +380,117 @@ def _do_zip(pipe, target_dir, exts, sub_path, working):
     except Exception as e:
         logging.error(f'failed to create zip file "{zip_filename}": {e}')
 
-        working.value = False
-        pipe.close()
-        return
+        try:
+            os.remove(zip_filename)
+
+        except OSError:
+            pass
 
-    logging.debug(f'reading zip file "{zip_filename}" into memory')
+        return None
 
-    try:
-        with open(zip_filename, mode='rb') as f:
-            data = f.read()
+    logging.debug(f'zip file "{zip_filename}" ready')
 
-        working.value = False
-        pipe.send(data)
-        logging.debug('zip data ready')
+    return zip_filename
 
-    except Exception as e:
-        logging.error(f'failed to read zip file "{zip_filename}": {e}')
-        working.value = False
 
-    finally:
-        os.remove(zip_filename)
-        pipe.close()
+def _init_worker():
+    # this will be executed in the worker processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
-def _do_list_pictures(pipe, target_dir, sub_path):
-    mf = _list_media_files(target_dir, _PICTURE_EXTS, sub_path, with_stat=True)
-    for p, st in mf:
-        timestamp = st.st_mtime
+def _run_in_worker(key: tuple, timeout: int, func: Callable, *args) -> Future:
+    """Runs a function in the media worker pool and returns a future of its result
+    (None in case of error). Identical requests that are still in progress share
+    the same future, so their result must not be modified by callers."""
+
+    fut = _in_flight.get(key)
+    if fut is not None:
+        logging.debug(f'joining in-flight media worker task {key[0]}')
+        return fut
 
-        pipe.send({'path': p, 'timestamp': timestamp})
+    async def run():
+        # a task is retried once if the pool was broken by another task
+        for attempt in range(2):
+            workers = _get_workers()
+            submitted = None
+            try:
+                submitted = workers.submit(func, *args)
+                _submitted.add(submitted)
+
+                return await gen.with_timeout(
+                    datetime.timedelta(seconds=timeout),
+                    asyncio.wrap_future(submitted),
+                    quiet_exceptions=(BrokenProcessPool,),
+                )
 
-    pipe.close()
+            except gen.TimeoutError:
+                # the worker can't be interrupted, so the pool is replaced
+                logging.error(
+                    f'timeout waiting for media worker task {key[0]} to finish, '
+                    'restarting the media worker pool'
+                )
+                _kill_workers(workers)
+
+            except BrokenProcessPool:
+                _kill_workers(workers)
+                if attempt:
+                    logging.error(f'media worker pool broken twice by {key[0]}')
+
+                else:
+                    logging.warning(f'media worker pool is broken, retrying {key[0]}')
+                    continue
+
+            except Exception as e:
+                logging.error(f'media worker task {key[0]} failed: {e}', exc_info=True)
+
+            finally:
+                _submitted.discard(submitted)
+
+            break
+
+        return None
+
+    fut = _in_flight[key] = gen.convert_yielded(run())
+    fut.add_done_callback(lambda f: _in_flight.pop(key, None))
+
+    return fut
+
+
+def _get_workers() -> ProcessPoolExecutor:
+    global _workers
+
+    if _workers is None:
+        _workers = ProcessPoolExecutor(
+            max_workers=settings.MEDIA_WORKERS, initializer=_init_worker
+        )
+
+    return _workers
+
+
+def _kill_workers(workers: ProcessPoolExecutor) -> None:
+    global _workers
+
+    # another task may have replaced the pool already
+    if _workers is workers:
+        _workers = None
+
+    # the executor offers no way of killing its processes
+    for process in list((workers._processes or {}).values()):
+        process.kill()
+
+    workers.shutdown(wait=False)
+
+
+def stop_workers():
+    global _workers
+
+    if _workers is not None:
+        for submitted in list(_submitted):
+            submitted.cancel()
+
+        _workers.shutdown(wait=False)
+        _workers = None
 
 
 def find_ffmpeg() -> tuple:
@@ -419,9 +613,10 @@ def cleanup_media(media_type: str) -> None:
         logging.debug(
             f'calling _remove_older_files: {cloud_enabled} {clean_cloud_enabled} {clean_cloud_info}'
         )
-        _remove_older_files(
+        removed_files = _remove_older_files(
             target_dir, preserve_moment, clean_cloud_info or {}, exts=exts
         )
+        mediaindex.remove_files(camera_id, target_dir, removed_files)
 
 
 def get_movie_duration_seconds(path: str) -> int:
@@ -530,7 +725,17 @@ def list_media(
     media_type: str,
     prefix: Optional[str] = None,
     with_stat: bool = True,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order: str = 'asc',
+    since: Optional[float] = None,
 ) -> Awaitable:
+    """Lists the media files of a camera, optionally one page at a time.
+
+    Pages are ordered by path; the path of the last file of a page is the
+    cursor for the next one. When given, since only keeps the files modified
+    after that timestamp."""
+
     target_dir = camera_config.get('target_dir')
     utils.validate_paths(prefix, target_dir=target_dir)
 
@@ -540,54 +745,140 @@ def list_media(
     elif media_type == 'movie':
         exts = _MOVIE_EXTS
 
-    logging.debug('starting media listing subprocess...')
+    indexed = mediaindex.query(
+        camera_config, media_type, prefix, limit, cursor, order, since
+    )
+    if indexed is not None:
+        if with_stat:
+            media_list = [_make_media_entry(p, t, z) for p, t, z in indexed]
+
+        else:
+            media_list = [{'path': p} for p, t, z in indexed]
+
+        logging.debug(f'media index has returned {len(media_list)} files')
 
-    parent_pipe, child_pipe = multiprocessing.Pipe(duplex=False)
-    process = multiprocessing.Process(
-        target=_do_list_media, args=(child_pipe, target_dir, exts, prefix, with_stat)
+        fut: Future = Future()
+        fut.set_result(media_list)
+        return fut
+
+    logging.debug('starting media listing task...')
+
+    args = (prefix, with_stat, limit, cursor, order, since)
+    media_files = mediawatcher.list_media_files(
+        target_dir, exts, prefix, with_stat or since is not None
     )
-    process.start()
-    child_pipe.close()
 
-    # poll the subprocess to see when it has finished
-    started = datetime.datetime.now()
-    media_list = []
+    return _run_in_worker(
+        ('list', media_type, target_dir) + args,
+        settings.LIST_MEDIA_TIMEOUT,
+        _do_list_media,
+        target_dir,
+        exts,
+        *args,
+        media_files,
+    )
 
-    def read_media_list():
-        while parent_pipe.poll():
-            try:
-                media_list.append(parent_pipe.recv())
-
-            except EOFError:
-                break
-
-    def poll_process():
-        io_loop = IOLoop.current()
-        if process.is_alive():  # not finished yet
-            now = datetime.datetime.now()
-            delta = now - started
-            if delta.seconds < settings.LIST_MEDIA_TIMEOUT:
-                io_loop.add_timeout(datetime.timedelta(seconds=0.5), poll_process)
-                read_media_list()
-
-            else:  # process did not finish in time
-                logging.error('timeout waiting for the media listing process to finish')
-                try:
-                    os.kill(process.pid, SIGKILL)
 
-                except:
-                    pass  # nevermind
+def add_media_file(camera_config: dict, full_path: Optional[str]) -> None:
+    """Takes note of a media file that has just been written by motion."""
 
-                fut.set_result(None)
+    global _media_groups_generation
 
-        else:  # finished
-            read_media_list()
-            logging.debug(f'media listing process has returned {len(media_list)} files')
-            fut.set_result(media_list)
+    mediaindex.add_file(camera_config, full_path)
+    _media_groups_generation += 1
 
-    fut: Future = Future()
-    poll_process()
-    return fut
+    media_type = full_path and mediaindex.get_media_type(full_path)
+    key = (camera_config['@id'], media_type)
+    if key not in _media_groups_cache:
+        return
+
+    expires, groups, files = _media_groups_cache[key]
+    if files is None:
+        # the media index already has the file, it is simply queried again
+        del _media_groups_cache[key]
+        return
+
+    target_dir = camera_config['target_dir']
+    if not full_path.startswith(target_dir.rstrip('/') + '/'):
+        return
+
+    try:
+        st = os.stat(full_path)
+
+    except OSError:
+        return
+
+    path = _rel_media_path(target_dir, full_path)
+    group = os.path.dirname(path).strip('/')
+    count, size, newest = groups.get(group, (0, 0, 0))
+    if path in files:  # reported once again
+        count -= 1
+        size -= files[path]
+
+    files[path] = st.st_size
+    groups[group] = (count + 1, size + st.st_size, max(newest, st.st_mtime))
+
+
+def invalidate_media_groups(camera_id: Optional[int] = None) -> None:
+    global _media_groups_generation
+
+    _media_groups_generation += 1
+    for key in list(_media_groups_cache):
+        if camera_id is None or key[0] == camera_id:
+            del _media_groups_cache[key]
+
+
+async def get_media_groups(camera_config: dict, media_type: str) -> Optional[list]:
+    """Returns the media groups of a camera along with their file count,
+    total size and newest file timestamp, without listing every file."""
+
+    from motioneye import cleanup
+
+    key = (camera_config['@id'], media_type)
+    now = time.time()
+    expires, groups, files = _media_groups_cache.get(key, (0, None, None))
+
+    if expires <= now:
+        generation = _media_groups_generation
+        rows = mediaindex.query_groups(camera_config, media_type)
+        if rows is not None:
+            groups = {g: (c, z, t) for g, c, z, t in rows}
+            files = None
+
+        else:
+            media_list = await list_media(camera_config, media_type)
+            if media_list is None:
+                return None
+
+            groups = {}
+            files = {}
+            for m in media_list:
+                group = os.path.dirname(m['path']).strip('/')
+                count, size, newest = groups.get(group, (0, 0, 0))
+                groups[group] = (
+                    count + 1,
+                    size + m['size'],
+                    max(newest, m['timestamp']),
+                )
+                files[m['path']] = m['size']
+
+        # files added or removed meanwhile (e.g. by a running cleanup) may not
+        # be accounted for
+        if generation == _media_groups_generation and not cleanup.running():
+            expires = now + _MEDIA_GROUPS_CACHE_TTL
+            _media_groups_cache[key] = (expires, groups, files)
+
+    return [
+        {
+            'path': group,
+            'count': count,
+            'size': size,
+            'sizeStr': utils.pretty_size(size),
+            'timestamp': newest,
+            'momentStr': pretty_date_time(datetime.datetime.fromtimestamp(newest)),
+        }
+        for group, (count, size, newest) in sorted(groups.items())
+    ]
 
 
 def get_media_path(camera_config, path: str, media_type):
@@ -613,6 +904,9 @@ def get_media_content(camera_config, path: str, media_type):
 
 
 def get_zipped_content(camera_config: dict, media_type: str, group: str) -> Awaitable:
+    """Creates a zip file of a media group and adds it to the prepared cache,
+    resolving to its key."""
+
     target_dir = camera_config.get('target_dir')
     utils.validate_paths(group, target_dir=target_dir)
 
@@ -622,279 +916,88 @@ def get_zipped_content(camera_config: dict, media_type: str, group: str) -> Awai
     elif media_type == 'movie':
         exts = _MOVIE_EXTS
 
-    working = multiprocessing.Value('b')
-    working.value = True
-
-    logging.debug('starting zip subprocess...')
-
-    parent_pipe, child_pipe = multiprocessing.Pipe(duplex=False)
-    process = multiprocessing.Process(
-        target=_do_zip, args=(child_pipe, target_dir, exts, group, working)
-    )
-    process.start()
-    child_pipe.close()
-
-    # poll the subprocess to see when it has finished
-    started = datetime.datetime.now()
-
-    def poll_process():
-        io_loop = IOLoop.current()
-        if working.value:
-            now = datetime.datetime.now()
-            delta = now - started
-            if delta.seconds < settings.ZIP_TIMEOUT:
-                io_loop.add_timeout(datetime.timedelta(seconds=0.5), poll_process)
-
-            else:  # process did not finish in time
-                logging.error('timeout waiting for the zip process to finish')
-                try:
-                    os.kill(process.pid, SIGTERM)
-
-                except:
-                    pass  # nevermind
-
-                fut.set_result(None)
+    key = ('zip', media_type, target_dir, group)
+    fut = _in_flight.get(key)
+    if fut is not None:
+        logging.debug('joining in-flight zip task')
+        return fut
+
+    logging.debug('starting zip task...')
+
+    async def make_zip():
+        zip_filename = await _run_in_worker(
+            key + ('worker',),
+            settings.ZIP_TIMEOUT,
+            _do_zip,
+            target_dir,
+            exts,
+            group,
+            preparedcache.make_temp_path('.zip'),
+            mediawatcher.list_media_files(target_dir, exts, group, False),
+        )
+        _in_flight.pop(key, None)
+        if zip_filename is None:
+            return None
 
-        else:  # finished
-            try:
-                data = parent_pipe.recv()
-                logging.debug(f'zip process has returned {len(data)} bytes')
+        logging.debug('zip task has finished')
 
-            except:
-                data = None
+        return set_prepared_cache_file(zip_filename)
 
-            fut.set_result(data)
+    fut = _in_flight[key] = gen.convert_yielded(make_zip())
 
-    fut: Future = Future()
-    poll_process()
     return fut
 
 
-def make_timelapse_movie(camera_config, framerate, interval, group: str):
-    global _timelapse_process
-    global _timelapse_data
+async def get_zip_stream(
+    camera_config: dict, media_type: str, group: str
+) -> Optional[zipstream.ZipStream]:
+    """Prepares a zip archive of a media group that is to be streamed to the
+    client, without creating it on disk or in memory."""
 
     target_dir = camera_config.get('target_dir')
     utils.validate_paths(group, target_dir=target_dir)
-    # save movie_codec as a different variable so it doesn't get lost in the CODEC_MAPPING
-    movie_codec = camera_config.get('movie_codec')
-
-    codec = FFMPEG_CODEC_MAPPING.get(movie_codec, movie_codec)
-    fmt = FFMPEG_FORMAT_MAPPING.get(movie_codec, movie_codec)
-    file_format = FFMPEG_EXT_MAPPING.get(movie_codec, movie_codec)
-
-    logging.debug('starting picture listing subprocess...')
-
-    parent_pipe, child_pipe = multiprocessing.Pipe(duplex=False)
-    _timelapse_process = multiprocessing.Process(
-        target=_do_list_pictures, args=(child_pipe, target_dir, group)
-    )
-    setattr(_timelapse_process, 'progress', 0)
-    _timelapse_process.start()
-    _timelapse_data = None
-
-    child_pipe.close()
-
-    started = [datetime.datetime.now()]
-    media_list = []
-
-    # use correct extension for the movie_codec
-    tmp_filename = os.path.join(settings.MEDIA_PATH, f'.{int(time())}.{file_format}')
-
-    def read_media_list():
-        while parent_pipe.poll():
-            try:
-                media_list.append(parent_pipe.recv())
-
-            except EOFError:
-                break
-
-    def poll_media_list_process():
-        io_loop = IOLoop.current()
-        if _timelapse_process.is_alive():  # not finished yet
-            now = datetime.datetime.now()
-            delta = now - started[0]
-            if (
-                delta.seconds < settings.TIMELAPSE_TIMEOUT
-            ):  # the subprocess has limited time to complete its job
-                io_loop.add_timeout(
-                    datetime.timedelta(seconds=0.5), poll_media_list_process
-                )
-                read_media_list()
-
-            else:  # process did not finish in time
-                logging.error('timeout waiting for the media listing process to finish')
-                try:
-                    os.kill(_timelapse_process.pid, SIGTERM)
-
-                except:
-                    pass  # nevermind
-
-                _timelapse_process.progress = -1
-
-        else:  # finished
-            read_media_list()
-            logging.debug(f'media listing process has returned {len(media_list)} files')
-
-            if not media_list:
-                _timelapse_process.progress = -1
-
-                return
-
-            pictures = select_pictures(media_list)
-            make_movie(pictures)
-
-    def select_pictures(media_list):
-        media_list.sort(key=lambda e: e['timestamp'])
-        start = media_list[0]['timestamp']
-        slices = {}
-        max_idx = 0
-        for m in media_list:
-            offs = m['timestamp'] - start
-            pos = float(offs) / interval - 0.5
-            idx = int(round(pos))
-            max_idx = idx
-            m['delta'] = abs(pos - idx)
-            slices.setdefault(idx, []).append(m)
-
-        selected = []
-        for i in range(max_idx + 1):
-            s = slices.get(i)
-            if not s:
-                continue
-
-            selected.append(min(s, key=lambda m: m['delta']))
-
-        logging.debug(f'selected {len(selected)}/{len(media_list)} media files')
-
-        return selected
-
-    def make_movie(pictures):
-        global _timelapse_process
-
-        # don't specify file format with -f, let ffmpeg work it out from the extension
-        cmd = 'rm -f %(tmp_filename)s;'
-        cmd += (
-            'cat %(jpegs)s | ffmpeg -framerate %(framerate)s -f image2pipe -vcodec mjpeg -i - -vcodec %(codec)s '
-            '-format %(format)s -b:v %(bitrate)s -qscale:v 0.1 %(tmp_filename)s'
-        )
-
-        bitrate = 9999999
 
-        cmd = cmd % {
-            'tmp_filename': tmp_filename,
-            'jpegs': ' '.join(('"' + p['path'] + '"') for p in pictures),
-            'framerate': framerate,
-            'codec': codec,
-            'format': fmt,
-            'bitrate': bitrate,
-        }
-
-        logging.debug(f'executing "{cmd}"')
+    media_list = await list_media(camera_config, media_type, prefix=group)
+    if media_list is None:
+        return None
 
-        _timelapse_process = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True
+    entries = [
+        zipstream.ZipEntry(
+            os.path.join(target_dir, m['path'].lstrip('/')),
+            m['path'].lstrip('/'),
+            m['size'],
+            m['timestamp'],
         )
-        _timelapse_process.progress = 0.01  # 1%
-
-        # make subprocess stdout pipe non-blocking
-        fd = _timelapse_process.stdout.fileno()
-        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
-        poll_movie_process(pictures)
-
-    def poll_movie_process(pictures):
-        global _timelapse_process
-        global _timelapse_data
-
-        io_loop = IOLoop.current()
-        if _timelapse_process.poll() is None:  # not finished yet
-            io_loop.add_timeout(
-                datetime.timedelta(seconds=0.5),
-                functools.partial(poll_movie_process, pictures),
-            )
-
-            try:
-                output = _timelapse_process.stdout.read()
-                if not output:
-                    return
-
-            except OSError as e:
-                if e.errno == EAGAIN:
-                    return
-
-                raise
-
-            frame_index = re.findall(rb'frame=\s*(\d+)', output)
-            try:
-                frame_index = int(frame_index[-1])
-
-            except (IndexError, ValueError):
-                return
-
-            _timelapse_process.progress = max(0.01, float(frame_index) / len(pictures))
-
-            logging.debug(
-                f'timelapse progress: {int(100 * _timelapse_process.progress)} %'
-            )
-
-        else:  # finished
-            exit_code = _timelapse_process.poll()
-            _timelapse_process = None
-
-            if exit_code != 0:
-                logging.error('ffmpeg process failed')
-                _timelapse_data = None
+        for m in sorted(media_list, key=lambda m: m['path'])
+    ]
 
-                try:
-                    os.remove(tmp_filename)
+    logging.debug(f'streaming {len(entries)} files as zip')
 
-                except:
-                    pass
+    return zipstream.ZipStream(entries)
 
-            else:
-                logging.debug(
-                    f'reading timelapse movie file "{tmp_filename}" into memory'
-                )
 
-                try:
-                    with open(tmp_filename, mode='rb') as f:
-                        _timelapse_data = f.read()
+def make_timelapse_movie(camera_config, framerate, interval, group: str) -> str:
+    """Queues a timelapse movie job for a media group and returns its id."""
 
-                    logging.debug(
-                        f'timelapse movie process has returned {len(_timelapse_data)} bytes'
-                    )
+    from motioneye import timelapse
 
-                except Exception as e:
-                    logging.error(
-                        f'failed to read timelapse movie file "{tmp_filename}": {e}'
-                    )
-
-                finally:
-                    try:
-                        os.remove(tmp_filename)
+    target_dir = camera_config.get('target_dir')
+    utils.validate_paths(group, target_dir=target_dir)
 
-                    except:
-                        pass
+    return timelapse.start_job(camera_config, framerate, interval, group).id
 
-    poll_media_list_process()
 
+def check_timelapse_movie(camera_id, group: str, job_id=None) -> dict:
+    """Reports the status of a timelapse movie job; progress is -1 unless the
+    job is queued or running, and the key is set once the movie is ready."""
 
-def check_timelapse_movie():
-    if _timelapse_process:
-        if (
-            hasattr(_timelapse_process, 'poll') and _timelapse_process.poll() is None
-        ) or (
-            hasattr(_timelapse_process, 'is_alive') and _timelapse_process.is_alive()
-        ):
-            return {'progress': _timelapse_process.progress, 'data': None}
+    from motioneye import timelapse
 
-        else:
-            return {'progress': _timelapse_process.progress, 'data': _timelapse_data}
+    job = timelapse.find_job(camera_id, group, job_id)
+    if job is None:
+        return {'progress': -1, 'key': None}
 
-    else:
-        return {'progress': -1, 'data': _timelapse_data}
+    return job.status()
 
 
 def get_media_preview(camera_config, path: str, media_type, width, height):
@@ -954,6 +1057,8 @@ def del_media_content(camera_config, path: str, media_type):
     try:
         # remove the file itself
         os.remove(full_path)
+        mediaindex.remove_files(camera_config['@id'], target_dir, [full_path])
+        invalidate_media_groups(camera_config['@id'])
 
         # remove the thumb file
         try:
@@ -1004,6 +1109,9 @@ def del_media_group(camera_config, group: str, media_type):
             logging.error(f'failed to remove file {full_path}: {str(e)}')
             raise
 
+    mediaindex.remove_group(camera_config['@id'], group, media_type)
+    invalidate_media_groups(camera_config['@id'])
+
     # remove the group directory if empty or contains only thumb files
     listing = os.listdir(full_path)
     thumbs = [line for line in listing if line.endswith('.thumb')]
@@ -1020,11 +1128,18 @@ def del_media_group(camera_config, group: str, media_type):
 def get_current_picture(camera_config, width, height):
     from motioneye import mjpgclient
 
-    jpg = mjpgclient.get_jpg(camera_config['@id'])
+    jpg, seq = mjpgclient.get_frame(camera_config['@id'])
 
     if jpg is None:
         return None
 
+    return resize_current_picture(camera_config, jpg, width, height, seq=seq)
+
+
+def resize_current_picture(camera_config, jpg, width, height, seq=None):
+    """Scales down a frame of a camera; when the frame sequence number is given,
+    the result is cached so that each size is produced only once per frame."""
+
     if width is height is None:
         return jpg  # no server-side resize needed
 
@@ -1054,35 +1169,50 @@ def get_current_picture(camera_config, width, height):
     if width >= image.size[0] and height >= image.size[1]:
         return jpg  # no enlarging of the picture on the server side
 
-    image.thumbnail((width, height))
+    # the size of the result, which keeps the aspect ratio of the picture
+    ratio = min(width / image.size[0], height / image.size[1])
+    size = (
+        max(1, round(image.size[0] * ratio)),
+        max(1, round(image.size[1] * ratio)),
+    )
+
+    camera_id = camera_config['@id']
+    variants = None
+    if seq is not None:
+        cached_seq, variants = _resized_frames_cache.get(camera_id, (None, None))
+        if cached_seq != seq:
+            variants = {}
+            _resized_frames_cache[camera_id] = (seq, variants)
+
+        elif size in variants:
+            return variants[size]
+
+    # let the JPEG decoder do most of the downscaling, which is a lot cheaper
+    # than decoding the full picture; thumbnail() takes care of the rest
+    image.draft('RGB', size)
+    image.thumbnail(size)
 
     bio = BytesIO()
     image.save(bio, format='JPEG')
+    resized = bio.getvalue()
 
-    return bio.getvalue()
+    if variants is not None and len(variants) < _RESIZED_FRAMES_MAX_SIZES:
+        variants[size] = resized
 
-
-def get_prepared_cache(key):
-    return _prepared_files.pop(key, None)
+    return resized
 
 
-def set_prepared_cache(data):
-    key = sha1(str(time()).encode()).hexdigest()  # nosec B303, B324
+def get_prepared_cache(key):
+    return preparedcache.get_data(key)
 
-    if key in _prepared_files:
-        logging.warning(f'key "{key}" already present in prepared cache')
 
-    _prepared_files[key] = data
+def open_prepared_cache(key):
+    return preparedcache.open_file(key)
 
-    def clear():
-        if _prepared_files.pop(key, None) is not None:
-            logging.warning(
-                f'key "{key}" was still present in the prepared cache, removed'
-            )
 
-    timeout = 3600  # the user has 1 hour to download the file after creation
+def set_prepared_cache(data):
+    return preparedcache.add_data(data)
 
-    io_loop = IOLoop.current()
-    io_loop.add_timeout(datetime.timedelta(seconds=timeout), clear)
 
-    return key
+def set_prepared_cache_file(path):
+    return preparedcache.add_file(path)
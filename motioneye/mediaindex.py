@@ -0,0 +1,371 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent per-camera index of the media files found in the camera target dir.
+
+The index is kept in a small SQLite database under the media path. It is fed
+with the files announced by motion through relay events and reconciled with the
+actual contents of the target dir by a periodic background rescan.
+"""
+
+import datetime
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+from contextlib import closing
+from time import time
+from typing import Iterable, List, Optional
+
+from tornado.ioloop import IOLoop
+
+from motioneye import config, settings, utils
+
+_DB_FILE_NAME = '.mediaindex-%(id)s.db'
+_CONNECT_TIMEOUT = 5
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS media ('
+    ' path TEXT PRIMARY KEY,'
+    ' grp TEXT NOT NULL,'
+    ' media_type TEXT NOT NULL,'
+    ' mtime REAL NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' indexed REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS media_type_grp ON media (media_type, grp)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+)
+
+_rescan_processes: dict = {}  # rescan subprocesses indexed by camera id
+_initialized_dbs: set = set()
+_started = False
+
+
+def start():
+    global _started
+
+    if not settings.ENABLE_MEDIA_INDEX:
+        return
+
+    _started = True
+
+    # schedule the first rescan a bit later to improve performance at startup
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(datetime.timedelta(seconds=30), _rescan_all)
+
+
+def stop():
+    global _started
+
+    _started = False
+
+    for camera_id, process in list(_rescan_processes.items()):
+        if process.is_alive():
+            process.join(timeout=10)
+
+        if process.is_alive():
+            logging.error(
+                f'media index rescan process for camera {camera_id} did not finish in time, killing it...'
+            )
+            os.kill(process.pid, signal.SIGKILL)
+
+    _rescan_processes.clear()
+
+
+def get_media_type(path: str) -> Optional[str]:
+    from motioneye.mediafiles import _MOVIE_EXTS, _PICTURE_EXTS
+
+    path = path.lower()
+    if any(path.endswith(e) for e in _PICTURE_EXTS):
+        return 'picture'
+
+    if any(path.endswith(e) for e in _MOVIE_EXTS):
+        return 'movie'
+
+    return None
+
+
+def ready(camera_config: dict) -> bool:
+    """Tells if the index of a camera has been fully built for its current target dir."""
+
+    if not settings.ENABLE_MEDIA_INDEX:
+        return False
+
+    camera_id = camera_config.get('@id')
+    if camera_id is None or not os.path.exists(_db_path(camera_id)):
+        return False
+
+    try:
+        with closing(_connect(camera_id)) as conn:
+            rows = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to read media index for camera {camera_id}: {e}')
+        return False
+
+    return (
+        rows.get('target_dir') == camera_config.get('target_dir')
+        and rows.get('last_scan') is not None
+    )
+
+
+def query(
+    camera_config: dict,
+    media_type: str,
+    prefix: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order: str = 'asc',
+    since: Optional[float] = None,
+) -> Optional[List[tuple]]:
+    """Returns (path, mtime, size) tuples of indexed media files, or None if the
+    index is not usable. Paths are relative to the target dir and start with a
+    slash, just like the ones produced by the media listing subprocess.
+
+    Files are ordered by path; when a cursor is given, only the files that come
+    after it (in the requested order) are returned."""
+
+    if not ready(camera_config):
+        if _started and camera_config.get('@id') is not None:
+            rescan(camera_config)  # have the index ready for the next listing
+
+        return None
+
+    camera_id = camera_config['@id']
+    sql = 'SELECT path, mtime, size FROM media WHERE media_type = ?'
+    args: list = [media_type]
+    if prefix is not None:
+        sql += ' AND grp = ?'
+        args.append('' if prefix == 'ungrouped' else prefix.strip('/'))
+
+    if since is not None:
+        sql += ' AND mtime > ?'
+        args.append(since)
+
+    if cursor is not None:
+        sql += ' AND path < ?' if order == 'desc' else ' AND path > ?'
+        args.append(cursor)
+
+    sql += ' ORDER BY path DESC' if order == 'desc' else ' ORDER BY path'
+
+    if limit is not None:
+        sql += ' LIMIT ?'
+        args.append(limit)
+
+    try:
+        with closing(_connect(camera_id)) as conn:
+            return conn.execute(sql, args).fetchall()
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to query media index for camera {camera_id}: {e}')
+        return None
+
+
+def query_groups(camera_config: dict, media_type: str) -> Optional[List[tuple]]:
+    """Returns (group, count, total size, newest mtime) tuples of indexed media
+    files, or None if the index is not usable."""
+
+    if not ready(camera_config):
+        return None
+
+    camera_id = camera_config['@id']
+    try:
+        with closing(_connect(camera_id)) as conn:
+            return conn.execute(
+                'SELECT grp, COUNT(*), SUM(size), MAX(mtime) FROM media'
+                ' WHERE media_type = ? GROUP BY grp ORDER BY grp',
+                (media_type,),
+            ).fetchall()
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to query media index for camera {camera_id}: {e}')
+        return None
+
+
+def add_file(camera_config: dict, full_path: Optional[str]) -> None:
+    if not settings.ENABLE_MEDIA_INDEX or not full_path:
+        return
+
+    camera_id = camera_config['@id']
+    path = _rel_path(camera_config['target_dir'], full_path)
+    media_type = get_media_type(full_path)
+    if path is None or media_type is None:
+        return
+
+    try:
+        st = os.stat(full_path)
+
+    except OSError as e:
+        logging.error(f'failed to add {full_path} to media index: {e}')
+        return
+
+    try:
+        with closing(_connect(camera_id)) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)',
+                (path, _group(path), media_type, st.st_mtime, st.st_size, time()),
+            )
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to add {full_path} to media index: {e}')
+
+
+def remove_files(camera_id: int, target_dir: str, full_paths: Iterable[str]) -> None:
+    if not settings.ENABLE_MEDIA_INDEX or not os.path.exists(_db_path(camera_id)):
+        return
+
+    paths = [_rel_path(target_dir, p) for p in full_paths]
+    paths = [(p,) for p in paths if p is not None]
+    if not paths:
+        return
+
+    try:
+        with closing(_connect(camera_id)) as conn, conn:
+            conn.executemany('DELETE FROM media WHERE path = ?', paths)
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to remove files from media index: {e}')
+
+
+def remove_group(camera_id: int, group: str, media_type: str) -> None:
+    if not settings.ENABLE_MEDIA_INDEX or not os.path.exists(_db_path(camera_id)):
+        return
+
+    try:
+        with closing(_connect(camera_id)) as conn, conn:
+            conn.execute(
+                'DELETE FROM media WHERE grp = ? AND media_type = ?',
+                (group.strip('/'), media_type),
+            )
+
+    except sqlite3.Error as e:
+        logging.error(f'failed to remove group from media index: {e}')
+
+
+def rescan(camera_config: dict) -> None:
+    """Starts a background subprocess that reconciles the index of a camera
+    with the contents of its target dir."""
+
+    camera_id = camera_config['@id']
+    process = _rescan_processes.get(camera_id)
+    if process is not None and process.is_alive():
+        return  # previous rescan still in progress
+
+    logging.debug(f'starting media index rescan for camera {camera_id}...')
+
+    process = multiprocessing.Process(
+        target=_rescan_process, args=(camera_id, camera_config['target_dir'])
+    )
+    process.start()
+    _rescan_processes[camera_id] = process
+
+
+def _rescan_all():
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(
+        datetime.timedelta(seconds=settings.MEDIA_INDEX_RESCAN_INTERVAL), _rescan_all
+    )
+
+    for camera_id in config.get_camera_ids():
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config) and camera_config.get(
+            'target_dir'
+        ):
+            rescan(camera_config)
+
+
+def _rescan_process(camera_id: int, target_dir: str) -> None:
+    # this will be executed in a separate subprocess
+
+    # ignore the terminate and interrupt signals in this subprocess
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    _do_rescan(camera_id, target_dir)
+
+
+def _do_rescan(camera_id: int, target_dir: str) -> None:
+    from motioneye.mediafiles import _MOVIE_EXTS, _PICTURE_EXTS, _list_media_files
+
+    started = time()
+    rows = []
+    try:
+        if os.path.exists(target_dir):
+            for full_path, st in _list_media_files(
+                target_dir, _PICTURE_EXTS + _MOVIE_EXTS
+            ):
+                path = _rel_path(target_dir, full_path)
+                rows.append(
+                    (
+                        path,
+                        _group(path),
+                        get_media_type(full_path),
+                        st.st_mtime,
+                        st.st_size,
+                        started,
+                    )
+                )
+
+        with closing(_connect(camera_id)) as conn, conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)', rows
+            )
+
+            # entries added by relay events while scanning have a newer index time
+            conn.execute('DELETE FROM media WHERE indexed < ?', (started,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                [('target_dir', target_dir), ('last_scan', str(started))],
+            )
+
+        logging.debug(
+            f'media index rescan for camera {camera_id} done: {len(rows)} files'
+        )
+
+    except Exception as e:
+        logging.error(
+            f'failed to rescan media index for camera {camera_id}: {e}', exc_info=True
+        )
+
+
+def _db_path(camera_id: int) -> str:
+    return os.path.join(settings.MEDIA_PATH, _DB_FILE_NAME % {'id': camera_id})
+
+
+def _connect(camera_id: int) -> sqlite3.Connection:
+    db_path = _db_path(camera_id)
+    conn = sqlite3.connect(db_path, timeout=_CONNECT_TIMEOUT)
+    if db_path not in _initialized_dbs:
+        with conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+        _initialized_dbs.add(db_path)
+
+    return conn
+
+
+def _rel_path(target_dir: str, full_path: str) -> Optional[str]:
+    if not full_path.startswith(target_dir.rstrip('/') + '/'):
+        return None
+
+    return '/' + full_path[len(target_dir) :].lstrip('/')
+
+
+def _group(path: str) -> str:
+    return os.path.dirname(path).strip('/')
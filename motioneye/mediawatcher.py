@@ -0,0 +1,496 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Live in-memory catalogue of the files under the local cameras' target dirs.
+
+Each target dir is watched recursively using Linux inotify, so that media
+listings, cleanups and group removals can be answered from memory instead of
+walking the file system over and over again. Each target dir has its own inotify
+instance; when its kernel event queue overflows, only that tree is rescanned and,
+until that completes, callers fall back to scanning the file system themselves.
+"""
+
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import logging
+import os
+import struct
+from collections import namedtuple
+from typing import Dict, List, Optional, Set, Tuple
+
+from tornado.ioloop import IOLoop
+
+from motioneye import config, settings, utils
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+_REFRESH_INTERVAL = 60
+
+MediaStat = namedtuple('MediaStat', ('st_mtime', 'st_size'))
+
+
+class _Dir:
+    __slots__ = ('files', 'subdirs', 'wd')
+
+    def __init__(self, wd: int):
+        self.files: Dict[str, MediaStat] = {}
+        self.subdirs: Set[str] = set()
+        self.wd = wd
+
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)  # failures mean the watch is already gone
+
+    def read_events(self) -> List[Tuple[int, int, int, str]]:
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+
+        except BlockingIOError:
+            return []
+
+        events = []
+        offs = 0
+        while offs + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offs)
+            offs += _EVENT_HEADER.size
+            name = os.fsdecode(data[offs : offs + length].rstrip(b'\0'))
+            offs += length
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+_started = False
+_roots: Dict[str, int] = {}  # watched target dirs and their camera ids
+_inotifies: Dict[str, _Inotify] = {}  # inotify instances indexed by root
+_complete_roots: Set[str] = set()  # roots whose catalogue can be trusted
+_dirs: Dict[str, _Dir] = {}
+_wds: Dict[str, Dict[int, str]] = {}  # watched dirs indexed by root and wd
+_pending_events: Dict[str, list] = {}  # events received while scanning a root
+_building: Dict[str, int] = {}  # number of scans in progress for each root
+
+
+def start():
+    global _started
+
+    if not settings.ENABLE_MEDIA_WATCHER:
+        return
+
+    try:
+        _Inotify().close()
+
+    except Exception as e:
+        logging.warning(f'media watcher not available, falling back to scanning: {e}')
+        return
+
+    _started = True
+    _refresh()
+
+
+def stop():
+    global _started
+
+    if not _started:
+        return
+
+    _started = False
+    for root in list(_roots):
+        _drop_root(root)
+
+    _complete_roots.clear()
+    _dirs.clear()
+    _wds.clear()
+    _pending_events.clear()
+    _building.clear()
+
+
+def running() -> bool:
+    return _started
+
+
+def list_media_files(
+    base_path: str,
+    exts: List[str],
+    sub_path: Optional[str] = None,
+    with_stat: bool = True,
+) -> Optional[List[tuple]]:
+    """Returns the same (path, stat) list as a file system scan would, or None
+    if the requested directory is not (fully) covered by the catalogue."""
+
+    if not _started:
+        return None
+
+    base_path = os.path.normpath(base_path)
+    root = _find_root(base_path)
+    if root is None or root not in _complete_roots:
+        return None
+
+    if sub_path is not None:
+        if sub_path == 'ungrouped':
+            sub_path = ''
+
+        scan_path = os.path.normpath(os.path.join(base_path, sub_path))
+        if scan_path not in _dirs:
+            return [] if not os.path.exists(scan_path) else None
+
+    else:
+        scan_path = base_path
+
+    media_files: List[tuple] = []
+    if not _collect(scan_path, exts, sub_path is None, with_stat, media_files):
+        return None
+
+    return media_files
+
+
+def _collect(
+    dir_path: str, exts: List[str], recursive: bool, with_stat: bool, result: list
+) -> bool:
+    d = _dirs.get(dir_path)
+    if d is None:
+        return False
+
+    for name, st in d.files.items():
+        if not any(name.lower().endswith(e) for e in exts):
+            continue
+
+        result.append((os.path.join(dir_path, name), st if with_stat else None))
+
+    if recursive:
+        for name in d.subdirs:
+            if not _collect(
+                os.path.join(dir_path, name), exts, True, with_stat, result
+            ):
+                return False
+
+    return True
+
+
+def _ignored(name: str) -> bool:
+    return name.startswith('.') or name == 'lastsnap.jpg'
+
+
+def _find_root(path: str) -> Optional[str]:
+    for root in _roots:
+        if path == root or path.startswith(root + os.sep):
+            return root
+
+    return None
+
+
+def _refresh():
+    # pick up added or removed cameras and target dir changes
+    if not _started:
+        return
+
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(datetime.timedelta(seconds=_REFRESH_INTERVAL), _refresh)
+
+    wanted = {}
+    for camera_id in config.get_camera_ids():
+        camera_config = config.get_camera(camera_id)
+        target_dir = camera_config.get('target_dir')
+        if not utils.is_local_motion_camera(camera_config) or not target_dir:
+            continue
+
+        wanted[os.path.normpath(target_dir)] = camera_id
+
+    for root in list(_roots):
+        if root not in wanted:
+            logging.debug(f'media watcher: no longer watching {root}')
+            _drop_root(root)
+
+    for root, camera_id in wanted.items():
+        if root not in _roots and os.path.isdir(root):
+            _add_root(root, camera_id)
+
+
+def _add_root(root: str, camera_id: int) -> None:
+    try:
+        inotify = _Inotify()
+
+    except Exception as e:
+        # e.g. fs.inotify.max_user_instances reached
+        logging.warning(f'media watcher: cannot watch {root}: {e}')
+        return
+
+    _roots[root] = camera_id
+    _inotifies[root] = inotify
+    _wds[root] = {}
+
+    IOLoop.current().add_handler(
+        inotify.fd, lambda fd, events: _on_events(root), IOLoop.READ
+    )
+    _build(root)
+
+
+def _build(path: str) -> None:
+    """Scans a directory tree in a worker thread, watching all its directories."""
+
+    root = _find_root(path)
+    if root is None:
+        return
+
+    _complete_roots.discard(root)
+    _building[root] = _building.get(root, 0) + 1
+
+    logging.debug(f'media watcher: scanning {path}...')
+
+    io_loop = IOLoop.current()
+    fut = io_loop.run_in_executor(None, _scan_tree, _inotifies[root], path)
+    io_loop.add_future(fut, lambda f: _on_built(root, path, f))
+
+
+def _scan_tree(inotify: _Inotify, path: str) -> Dict[str, _Dir]:
+    # this will be executed in a worker thread; the watch is added before
+    # listing a directory, so that no file can slip in between unnoticed
+    tree: Dict[str, _Dir] = {}
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            d = _Dir(inotify.add_watch(dir_path, _WATCH_MASK))
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if _ignored(entry.name):
+                        continue
+
+                    if entry.is_dir(follow_symlinks=False):
+                        d.subdirs.add(entry.name)
+                        stack.append(entry.path)
+
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+
+                        except OSError:
+                            continue  # removed in the meantime
+
+                        d.files[entry.name] = MediaStat(st.st_mtime, st.st_size)
+
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                continue  # removed in the meantime
+
+            raise
+
+        tree[dir_path] = d
+
+    return tree
+
+
+def _on_built(root: str, path: str, fut) -> None:
+    if root in _building:
+        _building[root] -= 1
+        if not _building[root]:
+            _building.pop(root)
+
+    try:
+        tree = fut.result()
+
+    except Exception as e:
+        if getattr(e, 'errno', None) == errno.ENOSPC:
+            logging.warning(
+                f'media watcher: inotify watch limit reached while watching {path}, '
+                'consider increasing fs.inotify.max_user_watches'
+            )
+
+        else:
+            logging.error(f'media watcher: failed to scan {path}: {e}')
+
+        tree = None
+
+    if root not in _roots:
+        return
+
+    if tree is None:
+        # leave the root to the file system scans, until the next refresh retries it
+        _drop_root(root)
+        return
+
+    for dir_path, d in tree.items():
+        _dirs[dir_path] = d
+        _wds[root][d.wd] = dir_path
+
+    logging.debug(
+        f'media watcher: {path} scanned, {sum(len(d.files) for d in tree.values())} files'
+    )
+
+    if root not in _building:
+        _complete_roots.add(root)
+
+        events = _pending_events.pop(root, None)
+        if events:
+            _handle_events(root, events)
+
+
+def _drop_root(root: str) -> None:
+    _unwatch_tree(root)
+    _roots.pop(root, None)
+    _complete_roots.discard(root)
+    _pending_events.pop(root, None)
+    _wds.pop(root, None)
+
+    # closing the instance removes all of its remaining watches
+    inotify = _inotifies.pop(root, None)
+    if inotify is not None:
+        IOLoop.current().remove_handler(inotify.fd)
+        inotify.close()
+
+
+def _forget_tree(root: str) -> None:
+    # the watches are kept, scanning the tree again will reuse them
+    for dir_path in list(_dirs):
+        if dir_path == root or dir_path.startswith(root + os.sep):
+            _dirs.pop(dir_path)
+
+    _wds[root].clear()
+
+
+def _unwatch_tree(path: str) -> None:
+    d = _dirs.pop(path, None)
+    if d is None:
+        return
+
+    root = _find_root(path)
+    _wds.get(root, {}).pop(d.wd, None)
+    if root in _inotifies:
+        _inotifies[root].rm_watch(d.wd)
+
+    for name in d.subdirs:
+        _unwatch_tree(os.path.join(path, name))
+
+
+def _on_events(root: str) -> None:
+    inotify = _inotifies.get(root)
+    if inotify is None:
+        return
+
+    try:
+        inotify_events = inotify.read_events()
+
+    except OSError as e:
+        logging.error(f'media watcher: failed to read events of {root}: {e}')
+        return
+
+    if root in _building:
+        # the tree is being scanned; events will be replayed on top of its results
+        _pending_events.setdefault(root, []).extend(inotify_events)
+        return
+
+    _handle_events(root, inotify_events)
+
+
+def _handle_events(root: str, events: List[Tuple[int, int, int, str]]) -> None:
+    wds = _wds.get(root)
+    if wds is None:
+        return
+
+    for wd, mask, cookie, name in events:  # @UnusedVariable
+        if mask & IN_Q_OVERFLOW:
+            logging.warning(f'media watcher: event queue overflow, rescanning {root}')
+            _forget_tree(root)
+            _build(root)
+
+            return
+
+        dir_path = wds.get(wd)
+        if dir_path is None:
+            continue
+
+        if mask & IN_IGNORED:
+            wds.pop(wd, None)
+            continue
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            continue  # handled by the event on the parent directory
+
+        d = _dirs.get(dir_path)
+        if d is None or _ignored(name):
+            continue
+
+        path = os.path.join(dir_path, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                d.subdirs.add(name)
+                _build(path)
+
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                d.subdirs.discard(name)
+                _unwatch_tree(path)
+
+        elif mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+            try:
+                st = os.stat(path, follow_symlinks=False)
+
+            except OSError:
+                d.files.pop(name, None)  # already gone
+                continue
+
+            d.files[name] = MediaStat(st.st_mtime, st.st_size)
+
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            d.files.pop(name, None)
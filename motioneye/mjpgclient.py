@@ -14,25 +14,32 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
 import logging
+import os
 import socket
+from collections import deque
 from datetime import timedelta
 from errno import ECONNREFUSED
 from re import findall, match
 from time import time
-from typing import Any, Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
 from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
-from tornado.iostream import IOStream
+from tornado.iostream import IOStream, StreamClosedError
 
 from motioneye import config, motionctl, settings, utils
 
 
 class MjpgClient(IOStream):
     _FPS_LEN = 10
+    _BUFFER_SIZE = 512 * 1024  # initial size of the buffered parser's buffer
+    _MAX_BUFFER_SIZE = 32 * 1024 * 1024
 
     clients: dict = {}  # dictionary of clients indexed by camera id
+    listeners: dict = {}  # sets of frame callbacks indexed by camera id
+    _frame_seq = itertools.count(1)  # unique across clients, even restarted ones
     _last_erroneous_close_time = (
         0  # helps detecting erroneous connections and restart motion
     )
@@ -47,7 +54,10 @@ class MjpgClient(IOStream):
 
         self._last_access = 0
         self._last_jpg = None
+        self._last_jpg_seq = None
         self._last_jpg_times = []
+        self._recent_frames: deque = deque()  # (seq, time, jpg), oldest first
+        self._recent_size = 0
 
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
         IOStream.__init__(self, s)
@@ -94,6 +104,19 @@ class MjpgClient(IOStream):
         self._last_access = time()
         return self._last_jpg
 
+    def get_last_jpg_seq(self):
+        return self._last_jpg_seq
+
+    def get_recent_frames(self, since=None):
+        self._last_access = time()
+        if since is None:
+            return list(self._recent_frames)
+
+        return [f for f in self._recent_frames if f[0] > since]
+
+    def get_recent_size(self):
+        return len(self._recent_frames), self._recent_size
+
     def get_last_access(self):
         return self._last_access
 
@@ -204,7 +227,7 @@ class MjpgClient(IOStream):
             self._seek_www_authenticate()
 
         else:  # no authorization required, skip to content length
-            self._seek_content_length()
+            self._seek_frames()
 
     def _seek_www_authenticate(self) -> None:
         future = utils.cast_future(self.read_until(b'WWW-Authenticate:'))
@@ -256,7 +279,78 @@ class MjpgClient(IOStream):
             return
 
         logging.error(f'mjpg client unknown authentication header: {data}')
-        self._seek_content_length()
+        self._seek_frames()
+
+    def _seek_frames(self):
+        if settings.MJPG_CLIENT_PARSER == 'buffered':
+            IOLoop.current().spawn_callback(self._read_frames)
+
+        else:
+            self._seek_content_length()
+
+    async def _read_frames(self):
+        # parses the multipart stream in place, in a buffer that is reused for
+        # all the frames; the data that hasn't been parsed yet is buf[start:end]
+        buf = bytearray(self._BUFFER_SIZE)
+        view = memoryview(buf)
+        start = end = 0
+
+        while True:
+            needed = 0  # bytes needed, starting at start, to complete the frame
+            header_start = buf.find(b'Content-Length:', start, end)
+            if header_start < 0:
+                # only keep what could be the beginning of the header
+                start = max(start, end - 15)
+
+            else:
+                header_end = buf.find(b'\r\n\r\n', header_start, end)
+                if header_end >= 0:
+                    line_end = buf.find(b'\r\n', header_start, header_end + 2)
+                    try:
+                        length = int(buf[header_start + 15 : line_end])
+
+                    except ValueError:
+                        line = bytes(buf[header_start:line_end])
+                        return self._error(
+                            f'could not find content length in mjpg header line "{line}"'
+                        )
+
+                    frame_start = header_end + 4
+                    if frame_start + length <= end:
+                        self._set_jpg(bytes(view[frame_start : frame_start + length]))
+                        start = frame_start + length
+                        continue
+
+                    needed = frame_start + length - start
+
+            # make room for the rest of the frame
+            if start == end:
+                start = end = 0
+
+            elif start > 0 and (end == len(buf) or start + needed > len(buf)):
+                view[: end - start] = view[start:end]
+                end -= start
+                start = 0
+
+            if end == len(buf) or needed > len(buf):
+                size = max(needed, 2 * len(buf))
+                if size > self._MAX_BUFFER_SIZE:
+                    return self._error(
+                        f'mjpg frame for camera {self._camera_id} is too large'
+                    )
+
+                view.release()
+                buf = buf[:end] + bytes(size - end)
+                view = memoryview(buf)
+
+            try:
+                end += await self.read_into(view[end:], partial=True)
+
+            except StreamClosedError:
+                return
+
+            except Exception as e:
+                return self._error(e)
 
     def _seek_content_length(self):
         if self._check_error():
@@ -294,12 +388,43 @@ class MjpgClient(IOStream):
         if not result:
             return
 
+        self._set_jpg(data)
+        self._seek_content_length()
+
+    def _set_jpg(self, data):
+        now = time()
         self._last_jpg = data
-        self._last_jpg_times.append(time())
+        self._last_jpg_seq = next(MjpgClient._frame_seq)
+        self._last_jpg_times.append(now)
         while len(self._last_jpg_times) > self._FPS_LEN:
             self._last_jpg_times.pop(0)
 
-        self._seek_content_length()
+        if settings.MJPG_CLIENT_RECENT_FRAMES:
+            self._add_recent_frame(self._last_jpg_seq, now, data)
+
+        listeners = MjpgClient.listeners.get(self._camera_id)
+        if listeners:
+            self._last_access = time()  # streaming counts as access
+            for callback in list(listeners):
+                try:
+                    callback(data, self._last_jpg_seq)
+
+                except Exception as e:
+                    logging.error(
+                        f'mjpg client frame listener failed: {e}', exc_info=True
+                    )
+
+    def _add_recent_frame(self, seq, frame_time, data):
+        self._recent_frames.append((seq, frame_time, data))
+        self._recent_size += len(data)
+
+        # the latest frame is always kept, even if it exceeds the budget alone
+        max_size = settings.MJPG_CLIENT_RECENT_SIZE * 1024 * 1024
+        while len(self._recent_frames) > 1 and (
+            len(self._recent_frames) > settings.MJPG_CLIENT_RECENT_FRAMES
+            or self._recent_size > max_size
+        ):
+            self._recent_size -= len(self._recent_frames.popleft()[2])
 
 
 def start():
@@ -347,6 +472,120 @@ def get_jpg(camera_id):
     return client.get_last_jpg()
 
 
+def get_frame(camera_id) -> Tuple[Optional[bytes], Optional[int]]:
+    """Returns the last jpg of a camera along with its sequence number, which
+    changes with every received frame."""
+
+    jpg = get_jpg(camera_id)
+    client = MjpgClient.clients.get(camera_id)
+    if jpg is None or client is None:
+        return None, None
+
+    return jpg, client.get_last_jpg_seq()
+
+
+def add_listener(camera_id, callback):
+    """Registers a callback to be called with every frame received for a camera,
+    along with its sequence number. The mjpg client is started by get_jpg(), as usual.
+    """
+
+    MjpgClient.listeners.setdefault(camera_id, set()).add(callback)
+
+
+def remove_listener(camera_id, callback):
+    listeners = MjpgClient.listeners.get(camera_id)
+    if listeners is None:
+        return
+
+    listeners.discard(callback)
+    if not listeners:
+        del MjpgClient.listeners[camera_id]
+
+
+def get_recent_frames(
+    camera_id, since=None
+) -> Optional[List[Tuple[int, float, bytes]]]:
+    """Returns the (seq, time, jpg) tuples of the recent frames of a camera,
+    oldest first, optionally only those that came after a given sequence number.
+    Returns None if the mjpg client of the camera isn't running."""
+
+    client = MjpgClient.clients.get(camera_id)
+    if client is None:
+        get_jpg(camera_id)  # starts the mjpg client, for the next time
+        return None
+
+    return client.get_recent_frames(since)
+
+
+def save_event_frames(camera_id) -> int:
+    """Writes the recent frames of a camera to its event frames directory,
+    replacing those of the previous event, so that the notifications, which run
+    in their own processes, can attach what the camera saw before the event.
+    Returns the number of saved frames."""
+
+    client = MjpgClient.clients.get(camera_id)
+    if client is None:
+        return 0
+
+    dir_path = _event_frames_path(camera_id)
+    frames = client.get_recent_frames()
+    try:
+        os.makedirs(dir_path, exist_ok=True)
+        for name in os.listdir(dir_path):
+            os.remove(os.path.join(dir_path, name))
+
+        for seq, frame_time, jpg in frames:
+            file_path = os.path.join(dir_path, f'pre-event-{seq}.jpg')
+            with open(file_path, 'wb') as f:
+                f.write(jpg)
+
+            os.utime(file_path, (frame_time, frame_time))
+
+    except OSError as e:
+        logging.error(f'could not save event frames of camera {camera_id}: {e}')
+
+        return 0
+
+    logging.debug(f'saved {len(frames)} event frames of camera {camera_id}')
+
+    return len(frames)
+
+
+def get_event_frames(camera_id, since, until) -> List[str]:
+    """Returns the paths of the event frames of a camera taken between two
+    timestamps, oldest first."""
+
+    dir_path = _event_frames_path(camera_id)
+    try:
+        entries = [e for e in os.scandir(dir_path) if e.name.endswith('.jpg')]
+
+    except FileNotFoundError:
+        return []
+
+    entries = [e for e in entries if since <= e.stat().st_mtime <= until]
+    entries.sort(key=lambda e: e.stat().st_mtime)
+
+    return [e.path for e in entries]
+
+
+def _event_frames_path(camera_id):
+    return os.path.join(settings.RUN_PATH, 'event-frames', str(camera_id))
+
+
+def get_recent_stats() -> dict:
+    """Returns the number of recent frames and their total size in bytes, for
+    all the running mjpg clients."""
+
+    stats = {'cameras': {}, 'count': 0, 'size': 0}
+    for camera_id, client in MjpgClient.clients.items():
+        count, size = client.get_recent_size()
+        stats['cameras'][camera_id] = {'count': count, 'size': size}
+        stats['count'] += count
+        stats['size'] += size
+
+    return stats
+
+
 def get_fps(camera_id):
     client = MjpgClient.clients.get(camera_id)
     if client is None:
@@ -371,6 +610,18 @@ def _garbage_collector():
     )
 
     now = time()
+    if settings.MJPG_CLIENT_RECENT_FRAMES and MjpgClient.clients:
+        stats = get_recent_stats()
+        logging.debug(
+            f'mjpg clients hold {stats["count"]} recent frames, {stats["size"]} bytes'
+        )
+
+    # the recent frames are kept whether the cameras are watched or not
+    if settings.MJPG_CLIENT_RECENT_FRAMES and motionctl.started():
+        for camera_config in config.get_enabled_local_motion_cameras():
+            if camera_config['@id'] not in MjpgClient.clients:
+                get_jpg(camera_config['@id'])
+
     for camera_id, client in list(MjpgClient.clients.items()):
         logging.debug(f'_garbage_collector checking camera. id: {camera_id}')
         port = client.get_port()
@@ -396,6 +647,7 @@ def _garbage_collector():
         delta = now - client.get_last_access()
         if (
             settings.MJPG_CLIENT_IDLE_TIMEOUT
+            and not settings.MJPG_CLIENT_RECENT_FRAMES
             and delta > settings.MJPG_CLIENT_IDLE_TIMEOUT
         ):
             logging.debug(
@@ -26,7 +26,7 @@ from shlex import quote
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 from tornado.ioloop import IOLoop
 
-from motioneye import mediafiles, settings, update, utils
+from motioneye import liveview, mediafiles, settings, update, utils
 from motioneye.controls.powerctl import PowerControl
 
 _MOTION_CONTROL_TIMEOUT = 5
@@ -136,8 +136,9 @@ def start(deferred=False):
 
     IOLoop.current().spawn_callback(_disable_initial_motion_detection)
 
-    # if mjpg client idle timeout is disabled, create mjpg clients for all cameras by default
-    if not settings.MJPG_CLIENT_IDLE_TIMEOUT:
+    # if mjpg client idle timeout is disabled, or recent frames are kept,
+    # create mjpg clients for all cameras by default
+    if not settings.MJPG_CLIENT_IDLE_TIMEOUT or settings.MJPG_CLIENT_RECENT_FRAMES:
         logging.debug('creating default mjpg clients for local cameras')
         for camera in enabled_local_motion_cameras:
             mjpgclient.get_jpg(camera['@id'])
@@ -249,6 +250,7 @@ async def set_motion_detection(camera_id, enabled):
 
     if not enabled:
         _motion_detected[camera_id] = False
+        liveview.update_status(camera_id, motion_detected=False)
 
     logging.debug(
         f"{['disabling', 'enabling'][enabled]} motion detection for camera with id {camera_id}"
@@ -315,6 +317,7 @@ def set_motion_detected(camera_id, motion_detected):
         logging.debug(f'clearing motion detected for camera with id {camera_id}')
 
     _motion_detected[camera_id] = motion_detected
+    liveview.update_status(camera_id, motion_detected=motion_detected)
 
 
 def camera_id_to_motion_camera_id(camera_id):
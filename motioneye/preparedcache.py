@@ -0,0 +1,216 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Disk-backed store of prepared files (zip archives, timelapse movies) that
+wait to be downloaded by the user.
+
+Each file is kept for a limited time, while the total size of the store is kept
+under a configurable budget by evicting the least recently used files first.
+"""
+
+import datetime
+import logging
+import os
+import re
+import shutil
+from collections import OrderedDict
+from hashlib import sha1
+from time import time
+from typing import BinaryIO, Iterator, Optional
+
+from tornado.ioloop import IOLoop
+
+from motioneye import settings
+
+CHUNK_SIZE = 256 * 1024
+
+_EXPIRE_TIMEOUT = 3600  # the user has 1 hour to download the file after creation
+_ENTRY_REGEX = re.compile(r'^(\.tmp-.*|[0-9a-f]{40})$')  # temp files and keys
+
+_entries: OrderedDict = OrderedDict()  # key -> (path, size), least recently used first
+_total_size = 0
+_initialized = False
+
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+
+def get_dir() -> str:
+    return settings.PREPARED_CACHE_PATH or os.path.join(
+        settings.MEDIA_PATH, '.prepared'
+    )
+
+
+def get_stats() -> dict:
+    stats = dict(_stats)
+    stats['count'] = len(_entries)
+    stats['size'] = _total_size
+
+    return stats
+
+
+def make_temp_path(suffix: str = '') -> str:
+    """Returns a path inside the store directory where a file can be prepared
+    before being added with add_file()."""
+
+    _init()
+
+    return os.path.join(get_dir(), f'.tmp-{os.getpid()}-{time()}{suffix}')
+
+
+def add_data(data: bytes) -> str:
+    path = make_temp_path()
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    return add_file(path)
+
+
+def add_file(path: str) -> str:
+    """Moves a file into the store and returns the key it can be retrieved with."""
+
+    global _total_size
+
+    _init()
+
+    key = sha1(f'{time()}{path}'.encode()).hexdigest()  # nosec B303, B324
+    if key in _entries:
+        logging.warning(f'key "{key}" already present in prepared cache')
+        _remove(key)
+
+    cache_path = os.path.join(get_dir(), key)
+    shutil.move(path, cache_path)
+    size = os.path.getsize(cache_path)
+
+    _entries[key] = (cache_path, size)
+    _total_size += size
+    _evict(keep=key)
+
+    def expire():
+        if _remove(key):
+            _stats['expirations'] += 1
+            logging.debug(f'prepared cache file for key "{key}" has expired')
+
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(datetime.timedelta(seconds=_EXPIRE_TIMEOUT), expire)
+
+    logging.debug(
+        f'added {size} bytes to prepared cache with key "{key}": {get_stats()}'
+    )
+
+    return key
+
+
+def get_path(key: str) -> Optional[str]:
+    entry = _entries.get(key)
+    if entry is None:
+        _stats['misses'] += 1
+        return None
+
+    _stats['hits'] += 1
+    _entries.move_to_end(key)
+
+    return entry[0]
+
+
+def open_file(key: str) -> Optional[BinaryIO]:
+    # the file may get evicted meanwhile, but an open file remains readable
+    path = get_path(key)
+    if path is None:
+        return None
+
+    try:
+        return open(path, 'rb')
+
+    except OSError as e:
+        logging.error(f'failed to open prepared cache file {path}: {e}')
+        return None
+
+
+def get_data(key: str) -> Optional[bytes]:
+    f = open_file(key)
+    if f is None:
+        return None
+
+    with f:
+        return f.read()
+
+
+def read_chunks(f: BinaryIO) -> Iterator[bytes]:
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def _init() -> None:
+    global _initialized
+
+    if _initialized:
+        return
+
+    # files left over by a previous run can't be retrieved anymore;
+    # only the entries of the store are removed, as the dir is configurable
+    path = get_dir()
+    os.makedirs(path, exist_ok=True)
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False) and _ENTRY_REGEX.match(entry.name):
+            logging.debug(f'removing stale prepared cache file {entry.path}')
+            try:
+                os.remove(entry.path)
+
+            except OSError as e:
+                logging.error(f'failed to remove prepared cache file {entry.path}: {e}')
+
+    _initialized = True
+
+
+def _evict(keep: str) -> None:
+    budget = settings.PREPARED_CACHE_SIZE * 1024 * 1024
+    for key in list(_entries):
+        if _total_size <= budget:
+            break
+
+        if key == keep:
+            continue
+
+        logging.debug(f'evicting key "{key}" from prepared cache')
+        _remove(key)
+        _stats['evictions'] += 1
+
+    if _total_size > budget:
+        logging.warning(
+            f'prepared cache file for key "{keep}" exceeds the cache size budget'
+        )
+
+
+def _remove(key: str) -> bool:
+    global _total_size
+
+    entry = _entries.pop(key, None)
+    if entry is None:
+        return False
+
+    path, size = entry
+    _total_size -= size
+    try:
+        os.remove(path)
+
+    except OSError as e:
+        logging.error(f'failed to remove prepared cache file {path}: {e}')
+
+    return True
@@ -14,20 +14,88 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import datetime
+import functools
 import json
 import logging
 import re
 from time import time
 from typing import Optional
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 
+from tornado import gen
+from tornado.concurrent import Future
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
 
 from motioneye import settings, utils
 from motioneye.utils.authstate import generate_hmac_signature, generate_nonce
 
 _DOUBLE_SLASH_REGEX = re.compile('//+')
 
+_LATENCY_WEIGHT = 0.3  # weight of the latest sample in the average latency
+
+_PICTURE_BATCH_WINDOW = 0.02  # seconds to wait for the pictures of other cameras
+_PICTURE_BATCH_CAMERA_LIFE_TIME = 10  # seconds
+_PICTURE_BATCH_RETRY_INTERVAL = 300  # seconds
+
+_client = None
+_hosts = {}  # _Host objects indexed by (scheme, netloc)
+_in_flight = {}  # futures of the pending GET responses indexed by url and conditions
+_response_cache = {}  # (time, etag, response) of the cached responses indexed by url
+_picture_batches = {}  # pending current picture requests indexed by server and size
+_picture_cameras = {}  # last current picture request times, by server and camera id
+_picture_batch_failures = {}  # last failed batch time indexed by server
+
+
+class _Host:
+    """Limits the number of concurrent requests to a remote motionEye server
+    and keeps track of its average latency; slow servers are only allowed one
+    request at a time, so they can't use up the connections of the client."""
+
+    def __init__(self, name):
+        self.name = name
+        self.running = 0
+        self.waiters = collections.deque()
+        self.latency = None  # seconds
+
+    def is_slow(self):
+        return self.latency is not None and self.latency > settings.REMOTE_SLOW_LATENCY
+
+    def get_limit(self):
+        return 1 if self.is_slow() else max(1, settings.REMOTE_HOST_CONCURRENCY)
+
+    async def acquire(self):
+        if self.running < self.get_limit():
+            self.running += 1
+            return
+
+        waiter = Future()
+        self.waiters.append(waiter)
+        await waiter  # the slot is handed over by release()
+
+    def release(self):
+        self.running -= 1
+        while self.waiters and self.running < self.get_limit():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.running += 1
+                waiter.set_result(None)
+
+    def add_latency(self, latency):
+        was_slow = self.is_slow()
+        if self.latency is None:
+            self.latency = latency
+
+        else:
+            self.latency += _LATENCY_WEIGHT * (latency - self.latency)
+
+        if self.is_slow() != was_slow:
+            state = 'slow' if not was_slow else 'no longer slow'
+            logging.debug(f'remote server {self.name} is {state} ({self.latency:.2f}s)')
+
 
 def _make_request(
     scheme,
@@ -79,13 +147,61 @@ def _make_request(
     )
 
 
+def _get_client():
+    # a client of our own, so that the remote requests don't queue up behind
+    # other requests; the curl client keeps the connections alive
+    global _client
+
+    if _client is None or _client.io_loop is not IOLoop.current():
+        _client = AsyncHTTPClient(
+            force_instance=True, max_clients=settings.REMOTE_MAX_CLIENTS
+        )
+
+    return _client
+
+
 async def _send_request(request: HTTPRequest) -> HTTPResponse:
+    if request.method != 'GET':
+        return await _fetch(request)
+
+    # identical GET requests that are already in flight share their response;
+    # a conditional request may get a 304 that is of no use to the others
+    key = (
+        request.url,
+        request.headers.get('If-None-Match'),
+        request.headers.get('If-Modified-Since'),
+    )
+    future = _in_flight.get(key)
+    if future is not None:
+        return await future
+
+    future = _in_flight[key] = Future()
+    try:
+        response = await _fetch(request)
+        future.set_result(response)
+
+        return response
+
+    finally:
+        del _in_flight[key]
+        if not future.done():
+            future.cancel()
+
+
+async def _fetch(request: HTTPRequest) -> HTTPResponse:
+    url = urlsplit(request.url)
+    host = _hosts.get((url.scheme, url.netloc))
+    if host is None:
+        host = _hosts[(url.scheme, url.netloc)] = _Host(url.netloc)
+
+    await host.acquire()
+    start_time = time()
     try:
         # The raise_error=False argument only affects the HTTPError raised when a non-200 response
         # code is used, instead of suppressing all errors.
-        response = await AsyncHTTPClient().fetch(request, raise_error=False)
+        response = await _get_client().fetch(request, raise_error=False)
 
-        if response.code != 200:
+        if response.code not in (200, 304):
             decoded = json.loads(response.body)
             if decoded['error'] == 'unauthorized':
                 response.error = Exception('Authentication Error')
@@ -97,9 +213,52 @@ async def _send_request(request: HTTPRequest) -> HTTPResponse:
         response = HTTPResponse(request, 599)
         response.error = e
 
+    finally:
+        host.add_latency(time() - start_time)
+        host.release()
+
     return response
 
 
+async def _send_cached_request(request: HTTPRequest) -> HTTPResponse:
+    # responses are reused for a short while and revalidated using their etag afterwards
+    cached = _response_cache.get(request.url)
+    if cached:
+        cache_time, etag, cached_response = cached
+        if time() - cache_time < settings.REMOTE_CONFIG_CACHE_TTL:
+            return cached_response
+
+        request.headers['If-None-Match'] = etag
+
+    response = await _send_request(request)
+    if response.code == 304 and cached:
+        _response_cache[request.url] = (time(), etag, cached_response)
+
+        return cached_response
+
+    etag = response.headers.get('Etag')
+    if not response.error and etag:
+        _response_cache[request.url] = (time(), etag, response)
+
+    else:
+        _response_cache.pop(request.url, None)
+
+    return response
+
+
+def _forget_responses(request: HTTPRequest) -> None:
+    server = urlsplit(request.url)[:2]
+    for url in list(_response_cache):
+        if urlsplit(url)[:2] == server:
+            del _response_cache[url]
+
+
+def get_latencies():
+    """Returns the average latency, in seconds, of each remote server."""
+
+    return {host.name: host.latency for host in _hosts.values()}
+
+
 def pretty_camera_url(local_config, camera=True):
     scheme = local_config.get('@scheme', local_config.get('scheme')) or 'http'
     host = local_config.get('@host', local_config.get('host'))
@@ -216,7 +375,7 @@ async def get_config(local_config) -> utils.GetConfigResponse:
     request = _make_request(
         scheme, host, port, remote_secret, path + f'/config/{camera_id}/get/'
     )
-    response = await _send_request(request)
+    response = await _send_cached_request(request)
 
     if response.error:
         logging.error(
@@ -278,6 +437,7 @@ async def set_config(local_config, ui_config) -> Optional[str]:
         content_type='application/json',
     )
     response = await _send_request(request)
+    _forget_responses(request)
 
     result = None
 
@@ -348,6 +508,141 @@ async def get_current_picture(
         )
     )
 
+    # the pictures of several cameras of the same server are requested together
+    server = (scheme, host, port, remote_secret, path)
+    if _is_picture_batch_worth(server, camera_id):
+        future = Future()
+        key = (server, width, height)
+        batch = _picture_batches.get(key)
+        if batch is None:
+            batch = _picture_batches[key] = {}
+            IOLoop.current().add_timeout(
+                datetime.timedelta(seconds=_PICTURE_BATCH_WINDOW),
+                functools.partial(_send_picture_batch, key),
+            )
+
+        batch.setdefault(camera_id, (local_config, []))[1].append(future)
+
+        return await future
+
+    return await _get_current_picture(local_config, width, height)
+
+
+def _is_picture_batch_worth(server, camera_id):
+    now = time()
+    if now - _picture_batch_failures.get(server, 0) < _PICTURE_BATCH_RETRY_INTERVAL:
+        return False
+
+    cameras = _picture_cameras.setdefault(server, {})
+    cameras[camera_id] = now
+    for i, t in list(cameras.items()):
+        if now - t > _PICTURE_BATCH_CAMERA_LIFE_TIME:
+            del cameras[i]
+
+    return len(cameras) > 1
+
+
+async def _send_picture_batch(key):
+    batch = _picture_batches.pop(key)
+    try:
+        await _get_picture_batch(key, batch)
+
+    except Exception as e:
+        logging.error(f'failed to get current pictures: {e}', exc_info=True)
+
+        for local_config, futures in batch.values():
+            for future in futures:
+                if not future.done():
+                    future.set_result(utils.GetCurrentPictureResponse(error=str(e)))
+
+
+async def _get_picture_batch(key, batch):
+    server, width, height = key
+    scheme, host, port, remote_secret, path = server
+
+    url = pretty_camera_url(batch[next(iter(batch))][0], camera=False)
+    logging.debug(f'getting {len(batch)} current pictures on {url}')
+
+    query = {'ids': ','.join(batch)}
+
+    if width:
+        query['width'] = str(width)
+
+    if height:
+        query['height'] = str(height)
+
+    p = path + '/picture/batch/current/'
+
+    request = _make_request(scheme, host, port, remote_secret, p, query=query)
+    response = await _send_request(request)
+
+    content_type = response.headers.get('Content-Type', '')
+    if response.error or not content_type.startswith('multipart/'):
+        # servers that don't know about batches are asked for each picture
+        logging.debug(
+            f'failed to get current pictures on {url}: '
+            f'{utils.pretty_http_error(response)}, requesting them separately'
+        )
+        _picture_batch_failures[server] = time()
+        responses = await gen.multi(
+            {
+                camera_id: _get_current_picture(local_config, width, height)
+                for camera_id, (local_config, futures) in batch.items()
+            }
+        )
+        for camera_id, (local_config, futures) in batch.items():
+            for future in futures:
+                future.set_result(responses[camera_id])
+
+        return
+
+    boundary = content_type.split('boundary=')[-1]
+    responses = {}
+    for headers, picture in _parse_multipart(response.body, boundary):
+        responses[headers.get('X-Camera-Id')] = utils.GetCurrentPictureResponse(
+            motion_detected=headers.get('X-Motion-Detected') == 'true',
+            capture_fps=float(headers.get('X-Capture-Fps') or 0),
+            monitor_info=headers.get('X-Monitor-Info'),
+            picture=picture or None,
+        )
+
+    for camera_id, (local_config, futures) in batch.items():
+        resp = responses.get(camera_id)
+        if resp is None:
+            logging.error(
+                'failed to get current picture for remote camera {id} on {url}: '
+                'no such camera'.format(id=camera_id, url=url)
+            )
+
+            resp = utils.GetCurrentPictureResponse(error='no such camera')
+
+        for future in futures:
+            future.set_result(resp)
+
+
+def _parse_multipart(body, boundary):
+    delimiter = b'--' + boundary.encode()
+    parts = []
+    pos = body.find(delimiter)
+    while pos >= 0 and not body.startswith(b'--', pos + len(delimiter)):
+        headers_end = body.find(b'\r\n\r\n', pos)
+        if headers_end < 0:
+            break
+
+        headers = HTTPHeaders.parse(body[pos + len(delimiter) : headers_end].decode())
+        start = headers_end + 4
+        end = start + int(headers.get('Content-Length', 0))
+        parts.append((headers, body[start:end]))
+        pos = body.find(delimiter, end)
+
+    return parts
+
+
+async def _get_current_picture(
+    local_config, width, height
+) -> utils.GetCurrentPictureResponse:
+    scheme, host, port, remote_secret, path, camera_id = _remote_params(local_config)
+
     query = {}
 
     if width:
@@ -387,7 +682,13 @@ async def get_current_picture(
 
 
 async def list_media(
-    local_config, media_type, prefix: Optional[str] = None
+    local_config,
+    media_type,
+    prefix: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order: Optional[str] = None,
+    since: Optional[float] = None,
 ) -> utils.ListMediaResponse:
     utils.validate_paths(prefix)
 
@@ -403,6 +704,10 @@ async def list_media(
     if prefix is not None:
         query['prefix'] = prefix
 
+    # let the remote side do the paging, so that only the requested page is transferred
+    paging = {'limit': limit, 'cursor': cursor, 'order': order, 'since': since}
+    query.update({k: str(v) for k, v in paging.items() if v is not None})
+
     # timeout here is 10 times larger than usual - we expect a big delay when fetching the media list
     p = path + f'/{media_type}/{camera_id}/list/'
     request = _make_request(
@@ -441,6 +746,51 @@ async def list_media(
     return utils.ListMediaResponse(media_list=response)
 
 
+async def get_media_groups(local_config, media_type) -> utils.CommonExternalResponse:
+    scheme, host, port, remote_secret, path, camera_id = _remote_params(local_config)
+
+    logging.debug(
+        'getting media groups for remote camera {id} on {url}'.format(
+            id=camera_id, url=pretty_camera_url(local_config)
+        )
+    )
+
+    p = path + f'/{media_type}/{camera_id}/groups/'
+    request = _make_request(
+        scheme,
+        host,
+        port,
+        remote_secret,
+        p,
+        timeout=10 * settings.REMOTE_REQUEST_TIMEOUT,
+    )
+    response = await _send_request(request)
+    if response.error:
+        logging.error(
+            'failed to get media groups for remote camera {id} on {url}: {msg}'.format(
+                id=camera_id,
+                url=pretty_camera_url(local_config),
+                msg=utils.pretty_http_error(response),
+            )
+        )
+
+        return utils.CommonExternalResponse(error=utils.pretty_http_error(response))
+
+    try:
+        response = json.loads(response.body)
+
+    except Exception as e:
+        logging.error(
+            'failed to decode json answer from {url}: {msg}'.format(
+                url=pretty_camera_url(local_config), msg=str(e)
+            )
+        )
+
+        return utils.CommonExternalResponse(error=str(e))
+
+    return utils.CommonExternalResponse(result=response)
+
+
 async def get_media_content(
     local_config, filename: str, media_type
 ) -> utils.CommonExternalResponse:
@@ -660,7 +1010,7 @@ async def make_timelapse_movie(
 
 
 async def check_timelapse_movie(
-    local_config, group: str
+    local_config, group: str, job_id=None
 ) -> utils.CommonExternalResponse:
     utils.validate_paths(group)
 
@@ -675,6 +1025,8 @@ async def check_timelapse_movie(
     p = path + '/picture/{id}/timelapse/{group}/?check=true'.format(
         id=camera_id, group=group
     )
+    if job_id:
+        p += f'&job={job_id}'
     request = _make_request(scheme, host, port, remote_secret, p)
     response = await _send_request(request)
 
@@ -30,7 +30,7 @@ from email.utils import formatdate, make_msgid
 
 from tornado.ioloop import IOLoop
 
-from motioneye import config, mediafiles, motionctl, settings, utils
+from motioneye import config, mediafiles, mjpgclient, motionctl, settings, utils
 from motioneye.controls import tzctl
 
 messages = {
@@ -101,6 +101,13 @@ def make_message(subject, message, camera_id, moment, timespan, callback):
                 for m in media_files
             ]
 
+            # along with the frames received before the event
+            media_files += reversed(
+                mjpgclient.get_event_frames(
+                    camera_id, timestamp - timespan, timestamp + timespan
+                )
+            )
+
             logging.debug('selected %d pictures' % len(media_files))
 
         format_dict = {
@@ -34,6 +34,7 @@ from motioneye.controls import smbctl, v4l2ctl
 from motioneye.handlers.action import ActionHandler
 from motioneye.handlers.base import ManifestHandler, NotFoundHandler
 from motioneye.handlers.config import ConfigHandler
+from motioneye.handlers.live import LiveHandler
 from motioneye.handlers.log import LogHandler
 from motioneye.handlers.login import LoginHandler
 from motioneye.handlers.logout import LogoutHandler
@@ -44,11 +45,12 @@ from motioneye.handlers.picture import PictureHandler
 from motioneye.handlers.power import PowerHandler
 from motioneye.handlers.prefs import PrefsHandler
 from motioneye.handlers.relay_event import RelayEventHandler
+from motioneye.handlers.tasks import TasksHandler
 from motioneye.handlers.update import UpdateHandler
 from motioneye.handlers.version import VersionHandler
 
 _PID_FILE = 'motioneye.pid'
-_CURRENT_PICTURE_REGEX = re.compile(r'^/picture/\d+/current')
+_CURRENT_PICTURE_REGEX = re.compile(r'^/picture/(\d+|batch)/current')
 
 
 class Daemon:
@@ -193,7 +195,11 @@ handler_mapping: Sequence[Tuple] = [
         ConfigHandler,
     ),
     (r'^/config/(?P<op>add|list|backup|restore)/?$', ConfigHandler),
-    (r'^/picture/(?P<camera_id>\d+)/(?P<op>current|list|frame)/?$', PictureHandler),
+    (
+        r'^/picture/(?P<camera_id>\d+)/(?P<op>current|list|groups|frame|stream|recent)/?$',
+        PictureHandler,
+    ),
+    (r'^/picture/(?P<camera_id>batch)/(?P<op>current)/?$', PictureHandler),
     (
         r'^/picture/(?P<camera_id>\d+)/(?P<op>download|preview|delete)/(?P<filename>.+?)/?$',
         PictureHandler,
@@ -202,7 +208,7 @@ handler_mapping: Sequence[Tuple] = [
         r'^/picture/(?P<camera_id>\d+)/(?P<op>zipped|timelapse|delete_all)/(?P<group>.*?)/?$',
         PictureHandler,
     ),
-    (r'^/movie/(?P<camera_id>\d+)/(?P<op>list)/?$', MovieHandler),
+    (r'^/movie/(?P<camera_id>\d+)/(?P<op>list|groups)/?$', MovieHandler),
     (
         r'^/movie/(?P<camera_id>\d+)/(?P<op>preview|delete)/(?P<filename>.+?)/?$',
         MovieHandler,
@@ -218,9 +224,11 @@ handler_mapping: Sequence[Tuple] = [
         MovieDownloadHandler,
         {'path': r''},
     ),
+    (r'^/live/?$', LiveHandler),
     (r'^/action/(?P<camera_id>\d+)/(?P<action>\w+)/?$', ActionHandler),
     (r'^/prefs/(?P<key>\w+)?/?$', PrefsHandler),
     (r'^/_relay_event/?$', RelayEventHandler),
+    (r'^/tasks/(?P<op>status|dead|replay)/?$', TasksHandler),
     (r'^/log/(?P<name>\w+)/?$', LogHandler),
     (r'^/update/?$', UpdateHandler),
     (r'^/power/(?P<op>shutdown|reboot)/?$', PowerHandler),
@@ -420,7 +428,18 @@ def make_app(debug: bool = False) -> Application:
 
 def run():
     import motioneye
-    from motioneye import cleanup, mjpgclient, motionctl, tasks, wsswitch
+    from motioneye import (
+        cleanup,
+        mediafiles,
+        mediaindex,
+        mediawatcher,
+        mjpgclient,
+        motionctl,
+        tasks,
+        timelapse,
+        uploadservices,
+        wsswitch,
+    )
     from motioneye.controls import smbctl
 
     configure_signals()
@@ -446,6 +465,14 @@ def run():
     tasks.start()
     logging.info(_('taskoj komenciĝis'))
 
+    if settings.ENABLE_MEDIA_WATCHER:
+        mediawatcher.start()
+        logging.info('media watcher started')
+
+    if settings.ENABLE_MEDIA_INDEX:
+        mediaindex.start()
+        logging.info('media index started')
+
     if settings.MJPG_CLIENT_TIMEOUT:
         mjpgclient.start()
         logging.info(_('mjpg klienta rubo-kolektanto komenciĝis'))
@@ -468,6 +495,7 @@ def run():
     io_loop.start()
 
     logging.info(_('servilo haltis'))
+    uploadservices.flush_batches()
     tasks.stop()
     logging.info(_('taskoj haltis'))
 
@@ -475,6 +503,11 @@ def run():
         cleanup.stop()
         logging.info('cleanup stopped')
 
+    mediaindex.stop()
+    mediawatcher.stop()
+    timelapse.stop()
+    mediafiles.stop_workers()
+
     if motionctl.running():
         motionctl.stop()
         logging.info(_('motion haltis'))
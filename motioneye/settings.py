@@ -75,6 +75,10 @@ MOTION_CHECK_INTERVAL = 10
 # whether to restart the motion daemon when an error occurs while communicating with it
 MOTION_RESTART_ON_ERRORS = False
 
+# interval in seconds at which motionEye checks whether the config files
+# were changed by others (0 checks them each time they are used)
+CONFIG_CHECK_INTERVAL = 10
+
 # interval in seconds at which motionEye checks the SMB mounts
 MOUNT_CHECK_INTERVAL = 300
 
@@ -85,13 +89,44 @@ CLEANUP_INTERVAL = 43200
 # timeout in seconds to wait for response from a remote motionEye server
 REMOTE_REQUEST_TIMEOUT = 10
 
+# the maximum number of concurrent requests to all remote motionEye servers
+REMOTE_MAX_CLIENTS = 32
+
+# the maximum number of concurrent requests to each remote motionEye server
+REMOTE_HOST_CONCURRENCY = 4
+
+# the average latency in seconds above which a remote motionEye server
+# is considered slow and only gets one request at a time
+REMOTE_SLOW_LATENCY = 2.0
+
+# the time in seconds during which the configs of the remote cameras are reused
+# before they are revalidated with the remote motionEye server
+REMOTE_CONFIG_CACHE_TTL = 5
+
 # timeout in seconds to wait for mjpg data from the motion daemon
 MJPG_CLIENT_TIMEOUT = 10
 
+# the number of recent frames kept in memory for each camera (0 disables
+# keeping them); the mjpg clients then stay connected to all the cameras, and
+# the frames preceding a motion event are attached to its email notification
+MJPG_CLIENT_RECENT_FRAMES = 0
+
+# the maximum size, in megabytes, of the recent frames kept for each camera
+MJPG_CLIENT_RECENT_SIZE = 4
+
+# the parser used by the mjpg clients: buffered (parses the stream in place,
+# in a reusable buffer) or callbacks (reads each header and frame separately)
+MJPG_CLIENT_PARSER = 'buffered'
+
 # timeout in seconds after which an idle mjpg client is removed
 # (set to 0 to disable)
 MJPG_CLIENT_IDLE_TIMEOUT = 10
 
+# push camera frames and status to the browser over a WebSocket (or a multipart
+# stream per camera, if not supported), instead of having the browser request
+# each frame separately
+ENABLE_FRAME_STREAMING = False
+
 # enable SMB shares (requires motionEye to run as root)
 SMB_SHARES = False
 
@@ -119,6 +154,40 @@ SMTP_TIMEOUT = 60
 # timeout in seconds to wait for media files list
 LIST_MEDIA_TIMEOUT = 120
 
+# the number of worker processes that list and zip media files
+MEDIA_WORKERS = 2
+
+# the number of worker processes that create movie previews
+PREVIEW_TASK_WORKERS = 1
+
+# the number of worker processes that upload media files
+UPLOAD_TASK_WORKERS = 2
+
+# the number of times a failed upload is retried before giving up
+UPLOAD_RETRIES = 8
+
+# the delay in seconds before retrying a failed upload, doubled with each retry
+UPLOAD_RETRY_DELAY = 30
+
+# the time in seconds during which the pictures of a camera are collected
+# to be uploaded together (0 uploads each picture separately)
+UPLOAD_BATCH_WINDOW = 2
+
+# the maximum number of pictures uploaded together
+UPLOAD_BATCH_SIZE = 20
+
+# keep a persistent index of the media files of each local camera,
+# used to answer media listings without scanning the target dir
+ENABLE_MEDIA_INDEX = True
+
+# interval in seconds at which the media index is reconciled
+# with the contents of the camera target dirs
+MEDIA_INDEX_RESCAN_INTERVAL = 3600
+
+# watch the camera target dirs using inotify and keep a live catalogue
+# of their files, instead of walking them over and over again
+ENABLE_MEDIA_WATCHER = True
+
 # timeout in seconds to wait for media files list, when sending emails
 LIST_MEDIA_TIMEOUT_EMAIL = 10
 
@@ -131,6 +200,21 @@ ZIP_TIMEOUT = 500
 # timeout in seconds to wait for timelapse creation
 TIMELAPSE_TIMEOUT = 500
 
+# the maximum number of timelapse movies that are created at the same time
+TIMELAPSE_WORKERS = 2
+
+# keep the timelapse movies encoded in segments of one hour inside the media path,
+# so that only the hours whose pictures have changed are encoded again
+TIMELAPSE_SEGMENTS = True
+
+# path to the directory where prepared files (zip archives, timelapse movies)
+# are kept until downloaded (defaults to a hidden dir inside the media path)
+PREPARED_CACHE_PATH = None
+
+# the maximum total size in megabytes of the prepared files;
+# the least recently used ones are removed when exceeded
+PREPARED_CACHE_SIZE = 1024
+
 # enable adding and removing cameras from UI
 ADD_REMOVE_CAMERAS = True
 
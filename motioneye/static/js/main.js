@@ -32,6 +32,9 @@ var cameraFramesTime = 0;
 var qualifyURLElement;
 var cameraFrameRatios = [];
 var forcePasswordChange = false; /* flag to track if user needs to set password */
+var liveSocket = null;
+var liveSocketTime = 0;
+var liveSubscription = null;
 
 
     /* Object utilities */
@@ -1871,6 +1874,8 @@ function cameraUi2Dict() {
         'upload_secret_key': $('#uploadSecretKeyEntry').val(),
         'upload_bucket': $('#uploadBucketEntry').val(),
         'upload_sse_c_key': $('#uploadSseCKeyEntry').val(),
+        'upload_concurrency': $('#uploadConcurrencyEntry').val(),
+        'upload_bandwidth': $('#uploadBandwidthEntry').val(),
         'clean_cloud_enabled': $('#cleanCloudEnabledSwitch')[0].checked,
         'web_hook_storage_enabled': $('#webHookStorageEnabledSwitch')[0].checked,
         'web_hook_storage_url': $('#webHookStorageUrlEntry').val(),
@@ -2215,6 +2220,8 @@ function dict2CameraUi(dict) {
     $('#uploadSecretKeyEntry').val(dict['upload_secret_key']); markHideIfNull('upload_secret_key', 'uploadSecretKeyEntry');
     $('#uploadBucketEntry').val(dict['upload_bucket']); markHideIfNull('upload_bucket', 'uploadBucketEntry');
     $('#uploadSseCKeyEntry').val(dict['upload_sse_c_key']); markHideIfNull('upload_sse_c_key', 'uploadSseCKeyEntry');
+    $('#uploadConcurrencyEntry').val(dict['upload_concurrency']); markHideIfNull('upload_concurrency', 'uploadConcurrencyEntry');
+    $('#uploadBandwidthEntry').val(dict['upload_bandwidth']); markHideIfNull('upload_bandwidth', 'uploadBandwidthEntry');
     $('#cleanCloudEnabledSwitch')[0].checked = dict['clean_cloud_enabled']; markHideIfNull('clean_cloud_enabled', 'cleanCloudEnabledSwitch');
 
     $('#webHookStorageEnabledSwitch')[0].checked = dict['web_hook_storage_enabled']; markHideIfNull('web_hook_storage_enabled', 'webHookStorageEnabledSwitch');
@@ -3098,17 +3105,8 @@ function doTestNetworkShare() {
 }
 
 function doDownloadZipped(cameraId, groupKey) {
-    showModalDialog('<div class="modal-progress"></div>', null, null, true);
-    ajax('GET', basePath + 'picture/' + cameraId + '/zipped/' + groupKey + '/', null, function (data) {
-        if (data.error) {
-            hideModalDialog(); /* progress */
-            showErrorMessage(data.error);
-        }
-        else {
-            hideModalDialog(); /* progress */
-            downloadFile('picture/' + cameraId + '/zipped/' + groupKey + '/?key=' + data.key);
-        }
-    });
+    /* the zip file is generated while being downloaded */
+    downloadFile('picture/' + cameraId + '/zipped/' + groupKey + '/?stream=true');
 }
 
 function doDeleteFile(path, callback) {
@@ -4302,7 +4300,7 @@ function runTimelapseDialog(cameraId, groupKey, group) {
             });
 
             var url = basePath + 'picture/' + cameraId + '/timelapse/' + groupKey + '/';
-            var data = {interval: intervalSelect.val(), framerate: framerateSlider.val()};
+            var params = {interval: intervalSelect.val(), framerate: framerateSlider.val()};
             var first = true;
 
             function checkTimelapse() {
@@ -4311,7 +4309,7 @@ function runTimelapseDialog(cameraId, groupKey, group) {
                     actualUrl += '?check=true';
                 }
 
-                ajax('GET', actualUrl, data, function (data) {
+                ajax('GET', actualUrl, params, function (data) {
                     if (data == null || data.error) {
                         hideModalDialog(); /* progress */
                         hideModalDialog(); /* timelapse dialog */
@@ -4323,6 +4321,10 @@ function runTimelapseDialog(cameraId, groupKey, group) {
                         showPopupMessage('A timelapse movie is already being created.');
                     }
 
+                    if (data.jobId) {
+                        params.job = data.jobId;
+                    }
+
                     if (data.progress == -1 && !first && !data.key) {
                         hideModalDialog(); /* progress */
                         hideModalDialog(); /* timelapse dialog */
@@ -5069,64 +5071,87 @@ function addCameraFrameUi(cameraConfig) {
 
         /* there's no point in looking for a cookie update more often than once every second */
         var now = new Date().getTime();
-        if ((!this.lastCookieTime || now - this.lastCookieTime > 1000) && (cameraFrameDiv[0].config['proto'] != 'mjpeg')) {
-            if (getCookie('motion_detected_' + cameraId) == 'true') {
-                cameraFrameDiv.addClass('motion-detected');
-            }
-            else {
-                cameraFrameDiv.removeClass('motion-detected');
-            }
+        if ((!this.lastCookieTime || now - this.lastCookieTime > 1000) && (cameraFrameDiv[0].config['proto'] != 'mjpeg') && !this.streaming) {
+            this.updateStatus();
+        }
 
-            if (getCookie('record_active_' + cameraId) == 'true') {
-                recordButton.removeClass('record-start').addClass('record-stop');
-            }
-            else {
-                recordButton.removeClass('record-stop').addClass('record-start');
+        /* compute the actual framerate */
+        if (cameraFrameDiv[0].config['proto'] != 'mjpeg' && !this.streaming) {
+            this.fpsTimes.push(now);
+            while (this.fpsTimes.length > FPS_LEN) {
+                this.fpsTimes.shift();
             }
+        }
 
-            var captureFps = getCookie('capture_fps_' + cameraId);
-            var monitorInfo = getCookie('monitor_info_' + cameraId);
+        if (singleViewCameraId) {
+            /* update the modal dialog position when image is loaded */
+            updateModalDialogPosition();
+        }
+    };
 
-            this.lastCookieTime = now;
+    cameraImg[0].updateStatus = function (status) {
+        /* the status is either pushed through the live view socket
+         * or read from the cookies set by the server along with the frames */
+        if (!status) {
+            status = {
+                motion_detected: getCookie('motion_detected_' + cameraId) == 'true',
+                capture_fps: getCookie('capture_fps_' + cameraId),
+                monitor_info: getCookie('monitor_info_' + cameraId)
+            };
+        }
 
-            if (this.fpsTimes.length == FPS_LEN) {
-                var streamingFps = this.fpsTimes.length * 1000 / (this.fpsTimes[this.fpsTimes.length - 1] - this.fpsTimes[0]);
-                streamingFps = streamingFps.toFixed(1);
+        var now = new Date().getTime();
+        if (status.motion_detected) {
+            cameraFrameDiv.addClass('motion-detected');
+        }
+        else {
+            cameraFrameDiv.removeClass('motion-detected');
+        }
+
+        if (getCookie('record_active_' + cameraId) == 'true') {
+            recordButton.removeClass('record-start').addClass('record-stop');
+        }
+        else {
+            recordButton.removeClass('record-stop').addClass('record-start');
+        }
+
+        var captureFps = status.capture_fps;
+        var monitorInfo = status.monitor_info;
+        if (typeof captureFps == 'number') {
+            captureFps = captureFps.toFixed(1);
+        }
+
+        this.lastCookieTime = now;
 
-                var fps = streamingFps;
+        if (this.streaming || this.fpsTimes.length == FPS_LEN) {
+            var fps;
+            if (this.streaming) {
+                /* frames are pushed by the server as they are captured */
+                fps = captureFps || '';
+            }
+            else {
+                var streamingFps = this.fpsTimes.length * 1000 / (this.fpsTimes[this.fpsTimes.length - 1] - this.fpsTimes[0]);
+                fps = streamingFps.toFixed(1);
                 if (captureFps) {
                     fps += '/' + captureFps;
                 }
-                fps += 'fps';
-                cameraFpsSpan.html(fps);
-
-                if (monitorInfo && monitorInfo != "\"\"") {
-                    monitorInfo = decodeURIComponent(monitorInfo);
-                    if (monitorInfo.charAt(0) == monitorInfo.charAt(monitorInfo.length - 1) && monitorInfo.charAt(0) == '"') {
-                        monitorInfo = monitorInfo.substring(1, monitorInfo.length - 1);
-                    }
-                    cameraMonitoringDiv.removeClass('hide-monitoring');
-                    cameraMonitoringSpan.html(monitorInfo);
+            }
+            fps += 'fps';
+            cameraFpsSpan.html(fps);
 
+            if (monitorInfo && monitorInfo != "\"\"") {
+                monitorInfo = decodeURIComponent(monitorInfo);
+                if (monitorInfo.charAt(0) == monitorInfo.charAt(monitorInfo.length - 1) && monitorInfo.charAt(0) == '"') {
+                    monitorInfo = monitorInfo.substring(1, monitorInfo.length - 1);
                 }
-                else {
-                    cameraMonitoringDiv.addClass('hide-monitoring');
-                }
+                cameraMonitoringDiv.removeClass('hide-monitoring');
+                cameraMonitoringSpan.html(monitorInfo);
 
             }
-        }
-
-        /* compute the actual framerate */
-        if (cameraFrameDiv[0].config['proto'] != 'mjpeg') {
-            this.fpsTimes.push(now);
-            while (this.fpsTimes.length > FPS_LEN) {
-                this.fpsTimes.shift();
+            else {
+                cameraMonitoringDiv.addClass('hide-monitoring');
             }
-        }
 
-        if (singleViewCameraId) {
-            /* update the modal dialog position when image is loaded */
-            updateModalDialogPosition();
         }
     };
 
@@ -5401,8 +5426,67 @@ function isSingleView() {
     return singleViewCameraId !== null;
 }
 
+function refreshLiveSocket(cameras) {
+    /* (re)connects the live view socket, at most once every two seconds,
+     * and updates the camera subscriptions whenever they change */
+    var now = new Date().getTime();
+    if (!liveSocket && now - liveSocketTime > 2000) {
+        var protocol = window.location.protocol == 'https:' ? 'wss://' : 'ws://';
+        liveSocketTime = now;
+        liveSubscription = null;
+        liveSocket = new WebSocket(protocol + window.location.host + basePath + 'live/');
+        liveSocket.binaryType = 'arraybuffer';
+        liveSocket.onmessage = onLiveSocketMessage;
+        liveSocket.onclose = function () {
+            liveSocket = null;
+        };
+    }
+
+    if (!liveSocket || liveSocket.readyState != WebSocket.OPEN) {
+        return;
+    }
+
+    var subscription = JSON.stringify({cameras: cameras});
+    if (subscription != liveSubscription) {
+        liveSocket.send(subscription);
+        liveSubscription = subscription;
+    }
+}
+
+function onLiveSocketMessage(event) {
+    if (typeof event.data == 'string') {
+        var status = JSON.parse(event.data).status || {};
+        Object.keys(status).forEach(function (cameraId) {
+            var img = getCameraFrame(cameraId).find('img.camera')[0];
+            if (!img || !img.updateStatus) {
+                return;
+            }
+
+            img.liveStatus = $.extend(img.liveStatus || {}, status[cameraId]);
+            img.updateStatus(img.liveStatus);
+        });
+
+        return;
+    }
+
+    /* binary messages are frames, prefixed by the camera id */
+    var cameraId = new DataView(event.data).getUint32(0);
+    var img = getCameraFrame(cameraId).find('img.camera')[0];
+    if (!img) {
+        return;
+    }
+
+    var oldUrl = img.liveUrl;
+    img.liveUrl = URL.createObjectURL(new Blob([event.data.slice(4)], {type: 'image/jpeg'}));
+    img.src = img.liveUrl;
+    if (oldUrl) {
+        URL.revokeObjectURL(oldUrl);
+    }
+}
+
 function refreshCameraFrames() {
     var timestamp = new Date().getTime();
+    var liveCameras = {};
 
     if (modalContainer.css('display') != 'none') {
         /* pause camera refresh if hidden by a dialog */
@@ -5439,6 +5523,38 @@ function refreshCameraFrames() {
         img.loading_count = 1;
     }
 
+    function refreshCameraStream(cameraId, img, serverSideResize) {
+        if (refreshDisabled[cameraId]) {
+            return;
+        }
+
+        /* (re)open the stream, at most once every two seconds in case of error */
+        if (!img.streaming || (img.error && timestamp - img.streamTime > 2000)) {
+            var path = basePath + 'picture/' + cameraId + '/stream/?_=' + timestamp;
+            if (resolutionFactor != 1) {
+                path += '&width=' + resolutionFactor;
+            }
+            else if (serverSideResize) {
+                path += '&width=' + img.width;
+            }
+
+            img.src = path;
+            img.streaming = true;
+            img.streamTime = timestamp;
+        }
+
+        /* frames come without the status cookies, so they are polled separately */
+        if (!img.statusTime || timestamp - img.statusTime > 1000) {
+            img.statusTime = timestamp;
+            $.ajax({
+                url: basePath + 'picture/' + cameraId + '/current/?status=true&_=' + timestamp,
+                complete: function () {
+                    img.updateStatus();
+                }
+            });
+        }
+    }
+
     var cameraFrames;
     if (singleViewCameraId != null && singleViewCameraId >= 0) {
         cameraFrames = getCameraFrame(singleViewCameraId);
@@ -5470,6 +5586,29 @@ function refreshCameraFrames() {
         var serverSideResize = this.config['streaming_server_resize'];
         var cameraId = this.id.substring(6);
 
+        if (frameStreaming && this.config['proto'] != 'motioneye') {
+            /* frames of local cameras are pushed by the server */
+            if (window.WebSocket) {
+                if (!refreshDisabled[cameraId]) {
+                    liveCameras[cameraId] = {};
+                    if (resolutionFactor != 1) {
+                        liveCameras[cameraId].width = resolutionFactor;
+                    }
+                    else if (serverSideResize) {
+                        liveCameras[cameraId].width = this.img.width;
+                    }
+                }
+
+                this.img.streaming = true;
+            }
+            else {
+                refreshCameraStream(cameraId, this.img, serverSideResize);
+            }
+
+            cameraFrameRatios[cameraId] = this.img.naturalWidth > 0 ? this.img.naturalHeight / this.img.naturalWidth : 1;
+            return;
+        }
+
         count /= framerateFactor;
 
         /* if frameFactor is 0, we only want one camera refresh at the beginning,
@@ -5495,6 +5634,10 @@ function refreshCameraFrames() {
         cameraFrameRatios[cameraId] = this.img.naturalWidth > 0 ? this.img.naturalHeight / this.img.naturalWidth : 1;
     });
 
+    if (frameStreaming && window.WebSocket) {
+        refreshLiveSocket(liveCameras);
+    }
+
     setTimeout(refreshCameraFrames, refreshInterval);
 }
 
@@ -14,55 +14,220 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+"""Scheduler of background tasks, such as movie previews and uploads.
+
+Tasks wait in a heap ordered by their due time; a timer is set for the earliest
+one. Due tasks are run in the process pool of their lane, each lane having its
+own concurrency limit, so that slow uploads don't hold back the previews.
+
+Tasks without a callback survive restarts: they are appended to a journal when
+added, and a removal record is appended when they are finished. Tasks added with
+retries are rescheduled with an exponential backoff when they fail, and are moved
+to a dead-letter list, from which they can be replayed, once they run out of
+retries. A task key prevents the same work from being queued twice, and a task
+group limits the number of tasks of that group running at the same time.
+
+A task that is still running past its timeout, or whose worker died, fails like
+any other task; the process pool of its lane is replaced in both cases.
+"""
+
 import calendar
 import datetime
+import heapq
+import itertools
 import logging
-import multiprocessing
 import os
 import pickle
 import time
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
 
 from tornado.ioloop import IOLoop
 
 from motioneye import settings
 
-_INTERVAL = 2
-_STATE_FILE_NAME = 'tasks.pickle'
-_MAX_TASKS = 100
-
-# we must be sure there's only one extra process that handles all tasks
-# TODO replace the pool with one simple thread
-_POOL_SIZE = 1
-
-_tasks: List[tuple] = []
-_pool = None
+_JOURNAL_FILE_NAME = 'tasks.journal'
+_OLD_STATE_FILE_NAME = 'tasks.pickle'
+_MAX_TASKS = 1000
+_MAX_RETRY_DELAY = 3600  # seconds
+_STOP_TIMEOUT = 10  # seconds
+_TASK_TIMEOUT = 3600  # seconds
+_WATCHDOG_INTERVAL = 10  # seconds
+_DEFAULT_LANE = 'default'
+
+
+class RetryWith(Exception):
+    """Raised by a task function that partially failed, to be retried with
+    some of its parameters replaced (e.g. with only the remaining items)."""
+
+    def __init__(self, message, params):
+        Exception.__init__(self, message, params)
+
+        self.params = params
+
+    def __str__(self):
+        return self.args[0]
+
+
+class _Task:
+    def __init__(
+        self,
+        id,
+        when,
+        func,
+        tag,
+        callback,
+        lane,
+        params,
+        retries=0,
+        retry_delay=0,
+        attempt=0,
+        key=None,
+        group=None,
+        group_limit=1,
+        timeout=_TASK_TIMEOUT,
+    ):
+        self.id = id
+        self.when = when
+        self.func = func
+        self.tag = tag or func.__name__
+        self.callback = callback
+        self.lane = lane
+        self.params = params
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.attempt = attempt
+        self.key = key
+        self.group = group
+        self.group_limit = group_limit
+        self.timeout = timeout
+        self.deadline = None
+        self.error = None
+        self.failed = None
+
+    def __lt__(self, other):
+        return (self.when, self.id) < (other.when, other.id)
+
+
+class _Lane:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.pool = None
+        self.ready: deque = deque()  # due tasks, waiting for a free worker
+        self.running = 0
+        self.groups: dict = {}  # number of running tasks indexed by group
+        self.runs = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def status(self) -> dict:
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'ready': len(self.ready),
+            'runs': self.runs,
+            'failures': self.failures,
+            'avgRunTime': self.runs and round(self.total_time / self.runs, 3),
+            'maxRunTime': round(self.max_time, 3),
+            'lastRunTime': round(self.last_time, 3),
+        }
+
+
+_tasks: List[_Task] = []  # heap of scheduled tasks
+_running: dict = {}  # running tasks indexed by id
+_dead: dict = {}  # tasks that ran out of retries indexed by id
+_keys: dict = {}  # queued and running tasks indexed by key
+_lanes: dict = {}
+_ids = itertools.count(1)
+_timeout = None
+_timeout_when: Optional[float] = None
+_watchdog = None
+_journal_records = 0
+_started = False
 
 
 def _init_pool_process():
     import signal
 
+    # workers are terminated by stop(), once they had the time to finish
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
 def start():
-    global _pool
+    global _started
 
-    io_loop = IOLoop.current()
-    io_loop.add_timeout(datetime.timedelta(seconds=_INTERVAL), _check_tasks)
+    _started = True
+
+    for name, workers in [
+        (_DEFAULT_LANE, 1),
+        ('preview', settings.PREVIEW_TASK_WORKERS),
+        ('upload', settings.UPLOAD_TASK_WORKERS),
+    ]:
+        _lanes[name] = _Lane(name, max(1, workers))
 
     _load()
-    _pool = multiprocessing.Pool(_POOL_SIZE, initializer=_init_pool_process)
+    _schedule_wakeup()
 
 
 def stop():
-    global _pool
-
-    _pool = None
+    global _started, _timeout, _timeout_when, _watchdog
+
+    _started = False
+
+    if _timeout is not None:
+        IOLoop.current().remove_timeout(_timeout)
+        _timeout = _timeout_when = None
+
+    if _watchdog is not None:
+        IOLoop.current().remove_timeout(_watchdog)
+        _watchdog = None
+
+    deadline = time.time() + _STOP_TIMEOUT
+    for lane in _lanes.values():
+        if lane.pool is None:
+            continue
+
+        # give the workers some time to finish their tasks; the ones that are
+        # interrupted are still in the journal and will run again when started
+        if lane.running:
+            logging.debug(f'waiting for {lane.running} tasks in lane {lane.name}')
+
+        pool, lane.pool = lane.pool, None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False)
+        for process in processes:
+            process.join(max(0, deadline - time.time()))
+
+        hung = [p for p in processes if p.is_alive()]
+        if hung:
+            logging.warning(f'killing {len(hung)} workers of lane {lane.name}')
+            for process in hung:
+                process.kill()
+
+
+def add(
+    when,
+    func,
+    tag=None,
+    callback=None,
+    lane=_DEFAULT_LANE,
+    retries=0,
+    retry_delay=30,
+    key=None,
+    group=None,
+    group_limit=1,
+    timeout=_TASK_TIMEOUT,
+    **params,
+):
+    if key is not None and key in _keys:
+        return logging.debug(f'task "{_keys[key].tag}" is already queued')
 
-
-def add(when, func, tag=None, callback=None, **params):
     if len(_tasks) >= _MAX_TASKS:
         return logging.error(
             f'the maximum number of tasks ({_MAX_TASKS}) has been reached'
@@ -79,84 +244,473 @@ def add(when, func, tag=None, callback=None, **params):
     elif isinstance(when, datetime.datetime):
         when = calendar.timegm(when.timetuple())
 
-    i = 0
-    while i < len(_tasks) and _tasks[i][0] <= when:
-        i += 1
+    task = _Task(
+        next(_ids),
+        when,
+        func,
+        tag,
+        callback,
+        lane,
+        params,
+        retries=retries,
+        retry_delay=retry_delay,
+        key=key,
+        group=group,
+        group_limit=group_limit,
+        timeout=timeout,
+    )
+
+    logging.debug(
+        f'adding task "{task.tag}" to lane {lane} in {when - now:.1f} seconds'
+    )
+
+    # a new attempt supersedes a dead one
+    if key is not None:
+        for dead_task in [t for t in _dead.values() if t.key == key]:
+            del _dead[dead_task.id]
+            _append_journal(('done', dead_task.id))
+
+    _enqueue(task)
+
+
+def count_group(group) -> int:
+    """Returns the number of queued and running tasks of the given group."""
+
+    pending = itertools.chain(
+        _tasks, _running.values(), *(lane.ready for lane in _lanes.values())
+    )
+
+    return sum(1 for task in pending if task.group == group)
+
+
+def get_dead() -> list:
+    return [
+        {
+            'id': task.id,
+            'tag': task.tag,
+            'lane': task.lane,
+            'attempts': task.attempt + 1,
+            'error': task.error,
+            'failed': task.failed,
+        }
+        for task in sorted(_dead.values(), key=lambda t: t.failed or 0)
+    ]
+
+
+def replay(ids=None) -> int:
+    """Queues the given dead tasks (or all of them) again, with their retries
+    reset, and returns the number of replayed tasks."""
+
+    now = time.time()
+    count = 0
+    for task in list(_dead.values()):
+        if ids is not None and task.id not in ids:
+            continue
+
+        logging.debug(f'replaying task "{task.tag}"')
+
+        del _dead[task.id]
+        task.when = now
+        task.attempt = 0
+        task.error = task.failed = None
+        _enqueue(task)
+        count += 1
+
+    return count
+
+
+def _enqueue(task):
+    heapq.heappush(_tasks, task)
+    if task.key is not None:
+        _keys[task.key] = task
 
-    logging.debug(f'adding task "{tag or func.__name__}" in {when - now} seconds')
-    _tasks.insert(i, (when, func, tag, callback, params))
+    if not task.callback:
+        _append_journal(_task_record(task))
 
-    _save()
+    if _started:
+        _schedule_wakeup()
+
+
+def get_status() -> dict:
+    return {
+        'scheduled': len(_tasks),
+        'dead': len(_dead),
+        'nextRunIn': round(max(0, _tasks[0].when - time.time()), 1) if _tasks else None,
+        'lanes': {name: lane.status() for name, lane in _lanes.items()},
+    }
+
+
+def _schedule_wakeup():
+    global _timeout, _timeout_when
+
+    if not _tasks:
+        return
+
+    when = _tasks[0].when
+    if _timeout is not None:
+        if _timeout_when <= when:
+            return  # already waking up in time
+
+        IOLoop.current().remove_timeout(_timeout)
+
+    _timeout_when = when
+    _timeout = IOLoop.current().add_timeout(
+        datetime.timedelta(seconds=max(0, when - time.time())), _check_tasks
+    )
 
 
 def _check_tasks():
+    global _timeout, _timeout_when
+
+    _timeout = _timeout_when = None
+
+    now = time.time()
+    lanes = set()
+    while _tasks and _tasks[0].when <= now:
+        task = heapq.heappop(_tasks)
+        lane = _lanes.get(task.lane)
+        if lane is None:
+            logging.warning(f'unknown lane {task.lane} for task "{task.tag}"')
+            lane = _lanes[_DEFAULT_LANE]
+
+        lane.ready.append(task)
+        lanes.add(lane)
+
+    for lane in lanes:
+        _dispatch(lane)
+
+    _schedule_wakeup()
+
+
+def _dispatch(lane):
+    global _watchdog
+
     io_loop = IOLoop.current()
-    io_loop.add_timeout(datetime.timedelta(seconds=_INTERVAL), _check_tasks)
 
+    while lane.running < lane.workers:
+        task = _pop_ready(lane)
+        if task is None:
+            break
+
+        if lane.pool is None:
+            lane.pool = ProcessPoolExecutor(
+                lane.workers, initializer=_init_pool_process
+            )
+
+        logging.debug(f'executing task "{task.tag}" in lane {lane.name}')
+
+        lane.running += 1
+        if task.group is not None:
+            lane.groups[task.group] = lane.groups.get(task.group, 0) + 1
+
+        _running[task.id] = task
+        started = time.time()
+        task.deadline = started + task.timeout
+
+        # the future calls back from the thread of the pool
+        def on_done(future, pool=lane.pool, task=task, started=started):
+            error = future.exception()
+            result = future.result() if error is None else None
+            io_loop.add_callback(
+                _on_pool_task_done, lane, pool, task, started, result, error
+            )
+
+        lane.pool.submit(task.func, **task.params).add_done_callback(on_done)
+
+    if _running and _watchdog is None:
+        _watchdog = io_loop.add_timeout(
+            datetime.timedelta(seconds=_WATCHDOG_INTERVAL), _check_deadlines
+        )
+
+
+def _check_deadlines():
+    global _watchdog
+
+    _watchdog = None
     now = time.time()
-    changed = False
-    while _tasks and _tasks[0][0] <= now:
-        when, func, tag, callback, params = _tasks.pop(0)  # @UnusedVariable
 
-        logging.debug(f'executing task "{tag or func.__name__}"')
-        _pool.apply_async(
-            func, kwds=params, callback=callback if callable(callback) else None
+    expired = set()
+    for task in _running.values():
+        if task.deadline is not None and task.deadline <= now:
+            logging.error(f'task "{task.tag}" did not finish in {task.timeout} seconds')
+
+            task.deadline = None
+            expired.add(_lanes.get(task.lane) or _lanes[_DEFAULT_LANE])
+
+    # the running tasks of the lane fail with a broken pool error
+    for lane in expired:
+        _kill_pool(lane)
+
+    if _running:
+        _watchdog = IOLoop.current().add_timeout(
+            datetime.timedelta(seconds=_WATCHDOG_INTERVAL), _check_deadlines
         )
 
-        changed = True
 
-    if changed:
-        _save()
+def _kill_pool(lane):
+    if lane.pool is None:
+        return
 
+    logging.warning(f'restarting the workers of lane {lane.name}')
 
-def _load():
-    global _tasks
+    pool, lane.pool = lane.pool, None
+    for process in list((pool._processes or {}).values()):
+        process.kill()
 
-    _tasks = []
+    pool.shutdown(wait=False)
 
-    file_path = os.path.join(settings.CONF_PATH, _STATE_FILE_NAME)
 
-    if os.path.exists(file_path):
-        logging.debug(f'loading tasks from "{file_path}"...')
+def _pop_ready(lane):
+    # the first ready task whose group is not at its limit
+    for i, task in enumerate(lane.ready):
+        if task.group is None or lane.groups.get(task.group, 0) < task.group_limit:
+            del lane.ready[i]
+            return task
 
-        try:
-            f = open(file_path, 'rb')
+    return None
 
-        except Exception as e:
-            logging.error(f'could not open tasks file "{file_path}": {e}')
 
-            return
+def _on_pool_task_done(lane, pool, task, started, result, error):
+    # tasks interrupted by stop() are still in the journal
+    if not _started or _running.get(task.id) is not task:
+        return
 
-        try:
-            _tasks = pickle.load(f)
+    # a worker died (e.g. killed when running out of memory)
+    if isinstance(error, BrokenProcessPool) and lane.pool is pool:
+        _kill_pool(lane)
 
-        except Exception as e:
-            logging.error(f'could not read tasks from file "{file_path}": {e}')
+    _on_task_done(lane, task, started, result, error)
+
+
+def _on_task_done(lane, task, started, result, error):
+    run_time = time.time() - started
+    lane.running -= 1
+    if task.group is not None:
+        lane.groups[task.group] -= 1
+        if not lane.groups[task.group]:
+            del lane.groups[task.group]
+
+    lane.runs += 1
+    lane.total_time += run_time
+    lane.max_time = max(lane.max_time, run_time)
+    lane.last_time = run_time
+    _running.pop(task.id, None)
+
+    if error is not None:
+        lane.failures += 1
+        _on_task_failed(task, error)
 
-        finally:
-            f.close()
+    else:
+        logging.debug(f'task "{task.tag}" done in {run_time:.2f} seconds')
+        _finish(task)
+        if callable(task.callback):
+            task.callback(result)
 
+    _dispatch(lane)
 
-def _save():
-    file_path = os.path.join(settings.CONF_PATH, _STATE_FILE_NAME)
 
-    logging.debug(f'saving tasks to "{file_path}"...')
+def _on_task_failed(task, error):
+    if isinstance(error, RetryWith):
+        task.params.update(error.params)
+
+    if task.attempt < task.retries:
+        task.attempt += 1
+        delay = min(task.retry_delay * 2 ** (task.attempt - 1), _MAX_RETRY_DELAY)
+
+        logging.warning(
+            f'task "{task.tag}" failed: {error}; '
+            f'retrying in {delay} seconds ({task.attempt}/{task.retries})'
+        )
+
+        task.when = time.time() + delay
+        if task.key is not None:
+            _keys.pop(task.key, None)
+
+        _enqueue(task)
+
+    elif task.retries:
+        logging.error(
+            f'task "{task.tag}" failed after {task.attempt + 1} attempts: {error}'
+        )
+
+        task.error = str(error)
+        task.failed = time.time()
+        _dead[task.id] = task
+        if task.key is not None:
+            _keys.pop(task.key, None)
+
+        if not task.callback:
+            _append_journal(('dead', task.id, task.error, task.failed))
+
+    else:
+        logging.error(f'task "{task.tag}" failed: {error}')
+        _finish(task)
+
+
+def _finish(task):
+    if task.key is not None:
+        _keys.pop(task.key, None)
+
+    if not task.callback:
+        _append_journal(('done', task.id))
+
+
+def _journal_path():
+    return os.path.join(settings.CONF_PATH, _JOURNAL_FILE_NAME)
+
+
+def _append_journal(record):
+    global _journal_records
+
+    file_path = _journal_path()
 
     try:
-        f = open(file_path, 'wb')
+        with open(file_path, 'ab') as f:
+            pickle.dump(record, f)
 
     except Exception as e:
-        logging.error(f'could not open tasks file "{file_path}": {e}')
+        logging.error(f'could not save task to file "{file_path}": {e}')
 
         return
 
+    _journal_records += 1
+
+    # rewrite the journal once it is mostly made of finished tasks
+    if _journal_records > 100 and _journal_records > 4 * (len(_tasks) + len(_dead)):
+        _compact_journal()
+
+
+def _task_record(task):
+    return (
+        'add',
+        task.id,
+        task.when,
+        task.func,
+        task.tag,
+        task.lane,
+        task.params,
+        task.retries,
+        task.retry_delay,
+        task.attempt,
+        task.key,
+        task.group,
+        task.group_limit,
+        task.timeout,
+    )
+
+
+def _compact_journal():
+    global _journal_records
+
+    file_path = _journal_path()
+
+    logging.debug(f'compacting tasks journal "{file_path}"...')
+
+    pending = list(_tasks) + list(_running.values())
+    pending += [t for lane in _lanes.values() for t in lane.ready]
+    pending = [t for t in pending if not t.callback]
+    dead = [t for t in _dead.values() if not t.callback]
+
     try:
-        # don't save tasks that have a callback
-        tasks = [t for t in _tasks if not t[3]]
-        pickle.dump(tasks, f)
+        with open(file_path + '.tmp', 'wb') as f:
+            for t in pending + dead:
+                pickle.dump(_task_record(t), f)
+
+            for t in dead:
+                pickle.dump(('dead', t.id, t.error, t.failed), f)
+
+        os.replace(file_path + '.tmp', file_path)
 
     except Exception as e:
-        logging.error(f'could not save tasks to file "{file_path}": {e}')
+        logging.error(f'could not compact tasks journal "{file_path}": {e}')
+
+        return
+
+    _journal_records = len(pending) + 2 * len(dead)
+
+
+def _read_journal(file_path):
+    """Returns the pending tasks and the dead tasks found in the journal, as
+    lists of _Task objects."""
+
+    tasks = {}
+    dead = {}
+    with open(file_path, 'rb') as f:
+        while True:
+            try:
+                record = pickle.load(f)
+
+            except EOFError:
+                break
+
+            except Exception as e:
+                # most likely a record that was being written when stopped
+                logging.error(f'could not read task from file "{file_path}": {e}')
+                break
+
+            if record[0] == 'add':
+                tasks[record[1]] = _Task(*record[1:5], None, *record[5:])
+                dead.pop(record[1], None)
+
+            elif record[0] == 'dead':
+                task = tasks.pop(record[1], None)
+                if task:
+                    task.error, task.failed = record[2:]
+                    dead[record[1]] = task
+
+            elif record[0] == 'done':
+                tasks.pop(record[1], None)
+                dead.pop(record[1], None)
+
+    return list(tasks.values()), list(dead.values())
+
+
+def _load():
+    global _tasks
+
+    _tasks = []
+    _running.clear()
+    _dead.clear()
+    _keys.clear()
+
+    file_path = _journal_path()
+    tasks, dead = [], []
+    if os.path.exists(file_path):
+        logging.debug(f'loading tasks from "{file_path}"...')
+
+        try:
+            tasks, dead = _read_journal(file_path)
+
+        except Exception as e:
+            logging.error(f'could not open tasks file "{file_path}": {e}')
+
+    # tasks saved by previous versions, as a whole list
+    old_file_path = os.path.join(settings.CONF_PATH, _OLD_STATE_FILE_NAME)
+    if os.path.exists(old_file_path):
+        logging.debug(f'loading tasks from "{old_file_path}"...')
+
+        try:
+            with open(old_file_path, 'rb') as f:
+                for when, func, tag, callback, params in pickle.load(f):
+                    tasks.append(_Task(0, when, func, tag, None, _DEFAULT_LANE, params))
+
+            os.remove(old_file_path)
+
+        except Exception as e:
+            logging.error(f'could not read tasks from file "{old_file_path}": {e}')
+
+    # tasks interrupted while running are started over
+    for task in tasks:
+        task.id = next(_ids)
+        _tasks.append(task)
+        if task.key is not None:
+            _keys[task.key] = task
+
+    for task in dead:
+        task.id = next(_ids)
+        _dead[task.id] = task
+
+    heapq.heapify(_tasks)
 
-    finally:
-        f.close()
+    # the ids of the loaded tasks are not the ones in the journal anymore
+    _compact_journal()
@@ -0,0 +1,488 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timelapse movie jobs.
+
+Each job selects the pictures of a media group and feeds them to ffmpeg through
+its standard input, one file at a time. The resulting movie is added to the
+prepared cache. A limited number of jobs run at the same time, the others wait
+in a queue.
+
+Pictures are encoded in segments of one hour that are kept on disk and joined
+with the concat demuxer, so that only the hours whose pictures have changed
+need to be encoded again.
+"""
+
+import datetime
+import itertools
+import logging
+import os
+import subprocess
+from hashlib import sha1
+from time import time
+from typing import Callable, List, Optional
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.process import Subprocess
+
+from motioneye import mediafiles, preparedcache, settings
+
+_JOB_EXPIRE_TIMEOUT = 3600  # finished jobs can be checked for 1 hour
+_SEGMENT_DURATION = 3600  # pictures are encoded in segments of one hour
+_SEGMENT_EXPIRE_TIMEOUT = 7 * 86400  # unused segments are removed after a week
+
+_job_ids = itertools.count(1)
+_jobs: dict = {}  # jobs indexed by id, in order of creation
+_queue: list = []
+_processes: set = set()  # running ffmpeg processes
+_segment_users: dict = {}  # number of running jobs indexed by segment path prefix
+_running_count = 0
+
+
+class TimelapseJob:
+    def __init__(
+        self, camera_config: dict, group: str, framerate: int, interval: int
+    ) -> None:
+        self.id = str(next(_job_ids))
+        self.camera_config = camera_config
+        self.camera_id = camera_config['@id']
+        self.group = group
+        self.framerate = framerate
+        self.interval = interval
+
+        self.state = 'queued'  # queued, running, done or failed
+        self.progress = 0.0
+        self.key: Optional[str] = None  # prepared cache key of the movie
+
+    def active(self) -> bool:
+        return self.state in ('queued', 'running')
+
+    def status(self) -> dict:
+        return {
+            'jobId': self.id,
+            'progress': self.progress if self.active() else -1,
+            'key': self.key,
+        }
+
+    def __str__(self) -> str:
+        return f'timelapse job {self.id} for group "{self.group or "ungrouped"}" of camera {self.camera_id}'
+
+
+def start_job(
+    camera_config: dict, framerate: int, interval: int, group: str
+) -> TimelapseJob:
+    job = TimelapseJob(camera_config, group, framerate, interval)
+    _jobs[job.id] = job
+    _queue.append(job)
+
+    logging.debug(f'{job} queued')
+
+    _schedule()
+
+    return job
+
+
+def find_job(
+    camera_id: int, group: str, job_id: Optional[str] = None
+) -> Optional[TimelapseJob]:
+    """Returns the job with the given id or, when no id is given,
+    the most recent job for a camera and group."""
+
+    if job_id is not None:
+        job = _jobs.get(job_id)
+        if job and job.camera_id == camera_id:
+            return job
+
+        return None
+
+    for job in reversed(list(_jobs.values())):
+        if job.camera_id == camera_id and job.group == group:
+            return job
+
+    return None
+
+
+def stop() -> None:
+    _queue.clear()
+    for process in list(_processes):
+        logging.debug(f'terminating ffmpeg process {process.pid}')
+        try:
+            process.proc.terminate()
+
+        except OSError:
+            pass
+
+
+def select_pictures(
+    media_list: List[dict], interval: int, start: Optional[float] = None
+) -> List[dict]:
+    """Picks, for each interval, the picture closest to its middle. Intervals
+    begin at start, which defaults to the timestamp of the first picture."""
+
+    if not media_list:
+        return []
+
+    media_list = sorted(media_list, key=lambda e: e['timestamp'])
+    if start is None:
+        start = media_list[0]['timestamp']
+
+    slices: dict = {}
+    for m in media_list:
+        offs = m['timestamp'] - start
+        pos = float(offs) / interval - 0.5
+        idx = int(round(pos))
+        slices.setdefault(idx, []).append((abs(pos - idx), m))
+
+    selected = [min(s, key=lambda e: e[0])[1] for i, s in sorted(slices.items())]
+
+    logging.debug(f'selected {len(selected)}/{len(media_list)} media files')
+
+    return selected
+
+
+def _schedule() -> None:
+    global _running_count
+
+    io_loop = IOLoop.current()
+    while _queue and _running_count < settings.TIMELAPSE_WORKERS:
+        job = _queue.pop(0)
+        job.state = 'running'
+        _running_count += 1
+        io_loop.spawn_callback(_run, job)
+
+
+async def _run(job: TimelapseJob) -> None:
+    global _running_count
+
+    logging.debug(f'{job} started')
+
+    try:
+        job.key = await _render(job)
+        job.state = 'done'
+        logging.debug(f'{job} done, movie ready with key "{job.key}"')
+
+    except Exception as e:
+        job.state = 'failed'
+        logging.error(f'{job} failed: {e}')
+
+    finally:
+        _running_count -= 1
+
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(
+        datetime.timedelta(seconds=_JOB_EXPIRE_TIMEOUT), _jobs.pop, job.id, None
+    )
+
+    _schedule()
+
+
+async def _render(job: TimelapseJob) -> str:
+    media_list = await gen.with_timeout(
+        datetime.timedelta(seconds=settings.TIMELAPSE_TIMEOUT),
+        mediafiles.list_media(job.camera_config, 'picture', prefix=job.group),
+    )
+    if not media_list:
+        raise Exception('no pictures found')
+
+    # intervals are aligned to the epoch, so that the pictures selected
+    # for a given hour don't depend on the first picture of the group
+    pictures = select_pictures(media_list, job.interval, start=0)
+
+    output = preparedcache.make_temp_path(f'.{_file_format(job)}')
+    try:
+        if settings.TIMELAPSE_SEGMENTS:
+            try:
+                await _render_segments(job, pictures, output)
+
+            except Exception as e:
+                # e.g. segments that can't be joined due to a resolution change
+                logging.warning(
+                    f'{job}: failed to use segments, encoding all pictures: {e}'
+                )
+                await _encode(job, _picture_paths(job, pictures), output)
+
+        else:
+            await _encode(job, _picture_paths(job, pictures), output)
+
+        return preparedcache.add_file(output)
+
+    except Exception:
+        _remove_file(output)
+        raise
+
+
+async def _render_segments(
+    job: TimelapseJob, pictures: List[dict], output: str
+) -> None:
+    segments_dir = os.path.join(_get_segments_dir(), str(job.camera_id))
+    os.makedirs(segments_dir, exist_ok=True)
+    _prune_segments()
+
+    segments: dict = {}
+    for p in pictures:
+        idx = int(round(float(p['timestamp']) / job.interval - 0.5))
+        segments.setdefault(idx * job.interval // _SEGMENT_DURATION, []).append(p)
+
+    prefixes = [
+        os.path.join(segments_dir, _segment_prefix(job, hour)) for hour in segments
+    ]
+    for prefix in prefixes:
+        _segment_users[prefix] = _segment_users.get(prefix, 0) + 1
+
+    try:
+        await _join_segments(job, segments_dir, segments, output)
+
+    finally:
+        for prefix in prefixes:
+            _segment_users[prefix] -= 1
+            if not _segment_users[prefix]:
+                del _segment_users[prefix]
+
+
+async def _join_segments(
+    job: TimelapseJob, segments_dir: str, segments: dict, output: str
+) -> None:
+    segment_paths = []
+    missing = []
+    for hour, hour_pictures in sorted(segments.items()):
+        prefix = _segment_prefix(job, hour)
+        path = os.path.join(
+            segments_dir,
+            f'{prefix}{_segment_signature(hour_pictures)}.{_file_format(job)}',
+        )
+        segment_paths.append(path)
+
+        if os.path.exists(path):
+            os.utime(path)  # keeps it from being pruned
+
+        else:
+            missing.append((prefix, path, hour_pictures))
+
+    logging.debug(
+        f'{job}: {len(segment_paths) - len(missing)}/{len(segment_paths)} segments already encoded'
+    )
+
+    total = sum(len(m[2]) for m in missing)
+    done = 0
+    for prefix, path, hour_pictures in missing:
+        # segments of the same hour with other pictures are no longer of any use,
+        # unless another job is joining them
+        if _segment_users[os.path.join(segments_dir, prefix)] == 1:
+            for name in os.listdir(segments_dir):
+                if name.startswith(prefix):
+                    _remove_file(os.path.join(segments_dir, name))
+
+        # other jobs may be encoding the same segment meanwhile
+        tmp_path = os.path.join(segments_dir, f'.tmp-{job.id}-{os.path.basename(path)}')
+        try:
+            await _encode(
+                job, _picture_paths(job, hour_pictures), tmp_path, done, total
+            )
+            os.replace(tmp_path, path)
+
+        except Exception:
+            _remove_file(tmp_path)
+            raise
+
+        done += len(hour_pictures)
+
+    list_path = output + '.txt'
+    try:
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                f.write("file '%s'\n" % path.replace("'", "'\\''"))
+
+        await _run_ffmpeg(_concat_command(list_path, output))
+
+    finally:
+        _remove_file(list_path)
+
+
+def _get_segments_dir() -> str:
+    return os.path.join(settings.MEDIA_PATH, '.timelapse')
+
+
+def _segment_prefix(job: TimelapseJob, hour: int) -> str:
+    group = sha1(job.group.encode()).hexdigest()[:8]  # nosec B303, B324
+    codec = job.camera_config.get('movie_codec', '').replace(':', '_')
+
+    return f'{group}-{codec}-{job.framerate}-{job.interval}-{hour}-'
+
+
+def _segment_signature(pictures: List[dict]) -> str:
+    # changes whenever a picture of the segment is added, removed or modified
+    h = sha1()  # nosec B303, B324
+    for p in pictures:
+        h.update(f'{p["path"]}:{p["timestamp"]}:{p.get("size")}\n'.encode())
+
+    return h.hexdigest()[:16]
+
+
+def _prune_segments() -> None:
+    oldest = time() - _SEGMENT_EXPIRE_TIMEOUT
+    for dir_path, dir_names, file_names in os.walk(_get_segments_dir()):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    logging.debug(f'removing unused timelapse segment {path}')
+                    os.remove(path)
+
+            except OSError:
+                pass
+
+
+def _file_format(job: TimelapseJob) -> str:
+    # use correct extension for the movie_codec
+    movie_codec = job.camera_config.get('movie_codec')
+    return mediafiles.FFMPEG_EXT_MAPPING.get(movie_codec, movie_codec)
+
+
+def _picture_paths(job: TimelapseJob, pictures: List[dict]) -> List[str]:
+    target_dir = job.camera_config['target_dir']
+    return [os.path.join(target_dir, p['path'].lstrip('/')) for p in pictures]
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+
+    except OSError:
+        pass
+
+
+def _ffmpeg_command(job: TimelapseJob, output: str) -> List[str]:
+    movie_codec = job.camera_config.get('movie_codec')
+    codec = mediafiles.FFMPEG_CODEC_MAPPING.get(movie_codec, movie_codec)
+    fmt = mediafiles.FFMPEG_FORMAT_MAPPING.get(movie_codec, movie_codec)
+
+    # don't specify file format with -f, let ffmpeg work it out from the extension
+    return [
+        'ffmpeg',
+        '-loglevel',
+        'error',
+        '-framerate',
+        str(job.framerate),
+        '-f',
+        'image2pipe',
+        '-vcodec',
+        'mjpeg',
+        '-i',
+        '-',
+        '-vcodec',
+        codec,
+        '-format',
+        fmt,
+        '-b:v',
+        '9999999',
+        '-qscale:v',
+        '0.1',
+        output,
+    ]
+
+
+def _concat_command(list_path: str, output: str) -> List[str]:
+    # segments are joined as they are, without being encoded again
+    return [
+        'ffmpeg',
+        '-loglevel',
+        'error',
+        '-f',
+        'concat',
+        '-safe',
+        '0',
+        '-i',
+        list_path,
+        '-c',
+        'copy',
+        output,
+    ]
+
+
+def _read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    except OSError as e:
+        logging.error(f'failed to read picture {path}: {e}')
+        return None
+
+
+async def _encode(
+    job: TimelapseJob, paths: List[str], output: str, done: int = 0, total: int = 0
+) -> None:
+    """Encodes pictures into a movie; done and total tell the progress
+    of the job before and after this encoding, in pictures."""
+
+    total = total or len(paths)
+
+    def on_progress(count):
+        job.progress = max(0.01, min(0.99, float(done + count) / total))
+
+    await _run_ffmpeg(_ffmpeg_command(job, output), paths, on_progress)
+
+
+async def _run_ffmpeg(
+    cmd: List[str],
+    paths: Optional[List[str]] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Runs ffmpeg, feeding the contents of the given files to its stdin."""
+
+    if paths is None:
+        logging.debug(f'executing "{" ".join(cmd)}"')
+
+    else:
+        logging.debug(f'executing "{" ".join(cmd)}" for {len(paths)} pictures')
+
+    process = Subprocess(
+        cmd,
+        stdin=subprocess.DEVNULL if paths is None else Subprocess.STREAM,
+        stdout=subprocess.DEVNULL,
+        stderr=Subprocess.STREAM,
+    )
+    _processes.add(process)
+    errors = process.stderr.read_until_close()
+
+    io_loop = IOLoop.current()
+    try:
+        try:
+            for i, path in enumerate(paths or []):
+                data = await io_loop.run_in_executor(None, _read_file, path)
+                if data:
+                    # waits until the data is taken by ffmpeg
+                    await process.stdin.write(data)
+
+                if on_progress:
+                    on_progress(i + 1)
+
+            if paths is not None:
+                process.stdin.close()
+
+        except StreamClosedError:
+            pass  # ffmpeg has exited prematurely
+
+        output_lines = (await errors).decode(errors='replace').strip().split('\n')
+        exit_code = await io_loop.run_in_executor(None, process.proc.wait)
+
+    finally:
+        _processes.discard(process)
+
+    if exit_code != 0:
+        raise Exception(f'ffmpeg exited with code {exit_code}: {output_lines[-1]}')
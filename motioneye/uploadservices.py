@@ -16,6 +16,7 @@
 
 import datetime
 import ftplib
+import http.client
 import io
 import json
 import logging
@@ -27,24 +28,89 @@ from base64 import b64decode, b64encode
 from hashlib import md5
 from urllib.error import HTTPError
 from urllib.parse import quote, urlencode
-from urllib.request import Request
+from urllib.request import Request, getproxies
 
 import boto3
 import pycurl
+from boto3.s3.transfer import TransferConfig
+from tornado.ioloop import IOLoop
 
-from motioneye import settings, utils
+from motioneye import settings, tasks, utils
 
 _STATE_FILE_NAME = 'uploadservices.json'
 _services = None
+_services_mtime = None
+_batches = {}  # pictures waiting to be uploaded together, by (camera id, service)
+
+
+class _ThrottledReader:
+    """A file-like reader that doesn't let the data of the given file object
+    be read faster than the given rate, in bytes per second."""
+
+    def __init__(self, f, rate):
+        self._f = f
+        self._rate = rate
+        self._count = 0
+        self._start = None
+
+    def read(self, size=-1):
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+
+        delay = self._count / self._rate - (now - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+        chunk = self._f.read(size)
+        self._count += len(chunk)
+
+        return chunk
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        self._count = 0
+        self._start = None
+
+        return self._f.seek(pos, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+
+class _HTTPResponse(io.BytesIO):
+    """The body of an HTTP response, along with its status and headers."""
+
+    def __init__(self, status, headers, data):
+        io.BytesIO.__init__(self, data)
+
+        self.status = self.code = status
+        self.headers = headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class _NotFoundError(Exception):
+    pass
 
 
 class UploadService:
     MAX_FILE_SIZE = 1024 * 1024 * 1024  # 1GB
+    CHUNK_SIZE = 8 * 1024 * 1024  # 8MB, a multiple of 256kB as Google Drive requires
+    HTTP_TIMEOUT = 60
+    HTTP_CONN_LIFE_TIME = 60  # don't reuse an idle HTTP connection after 1 minute
 
     NAME = 'base'
 
     def __init__(self, camera_id, **kwargs):
         self.camera_id = camera_id
+        self.bandwidth = 0  # bytes per second, 0 means unlimited
+
+        self._http_conns = {}  # (connection, last used time) indexed by host
+
+        # the state needed to resume interrupted uploads,
+        # indexed by (filename, size, ctime)
+        self._interrupted = {}
 
     def __str__(self):
         return self.NAME
@@ -89,6 +155,11 @@ class UploadService:
             self.error(msg)
             raise Exception(msg)
 
+        # a previous attempt may have uploaded it without being recorded as done
+        if self.is_uploaded(rel_filename, st.st_size):
+            self.debug(f'file "{filename}" is already uploaded, skipping it')
+            return
+
         try:
             f = open(filename, 'rb')
 
@@ -97,19 +168,177 @@ class UploadService:
             self.error(msg)
             raise Exception(msg)
 
-        data = f.read()
-        self.debug(f'size of "{filename}" is {len(data) / 1024.0 / 1024:.3f}MB')
+        self.debug(f'size of "{filename}" is {st.st_size / 1024.0 / 1024:.3f}MB')
 
         mime_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
         self.debug(f'mime type of "{filename}" is "{mime_type}"')
 
-        self.upload_data(rel_filename, mime_type, data, ctime, camera_name)
+        with f:
+            self.upload_stream(
+                rel_filename, mime_type, f, st.st_size, ctime, camera_name
+            )
 
         self.debug(f'file "{filename}" successfully uploaded')
 
+    def upload_files(self, target_dir, filenames, camera_name):
+        """Uploads a batch of files, returning the ones that failed."""
+
+        failed = []
+        for filename in filenames:
+            try:
+                self.upload_file(target_dir, filename, camera_name)
+
+            except Exception as e:
+                self.error(f'failed to upload file "{filename}": {e}')
+                failed.append(filename)
+
+        return failed
+
+    def is_uploaded(self, filename, size):
+        """Tells whether a file of the given size is already at the destination.
+        Services whose uploads would not replace an existing file override this,
+        so that retried uploads don't create a second copy."""
+
+        return False
+
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
         pass
 
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        """Uploads the size bytes read from the file object f. Services that
+        can transfer the data as it is read (and resume interrupted transfers)
+        override this; by default, the whole data is read and passed to
+        upload_data()."""
+
+        self.upload_data(filename, mime_type, f.read(), ctime, camera_name)
+
+    def throttle(self, f):
+        if not self.bandwidth:
+            return f
+
+        return _ThrottledReader(f, self.bandwidth)
+
+    def urlopen(self, request):
+        """Performs a urllib request over a connection that is kept alive for
+        the next requests to the same host; returns a file-like response and
+        raises HTTPError just like urlopen() does."""
+
+        if request.type not in ('http', 'https') or getproxies().get(request.type):
+            try:
+                return utils.urlopen(request)
+
+            except HTTPError as e:
+                if e.code == 308 and not e.headers.get('Location'):
+                    return e  # Google's "resume incomplete", not a redirect
+
+                raise
+
+        headers = {k.title(): v for k, v in request.header_items()}
+        headers['Connection'] = 'keep-alive'
+
+        # file objects are sent as they are read, their length must be given
+        body = request.data
+        if isinstance(body, str):
+            body = body.encode('iso-8859-1')  # as http.client does
+
+        if body is not None and not hasattr(body, 'read'):
+            headers['Content-Length'] = str(len(body))
+            body = io.BytesIO(body)
+
+        if body is not None:
+            body = self.throttle(body)
+            body_pos = body.tell()
+
+        key = (request.type, request.host)
+        conn, last_used = self._http_conns.pop(key, (None, 0))
+        if conn and time.time() - last_used > self.HTTP_CONN_LIFE_TIME:
+            conn.close()
+            conn = None
+
+        while True:
+            reused = conn is not None
+            if not reused:
+                conn = self._make_http_conn(request)
+
+            try:
+                conn.request(
+                    request.get_method(), request.selector, body=body, headers=headers
+                )
+                response = conn.getresponse()
+                break
+
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ):
+                conn.close()
+                conn = None
+                if not reused:
+                    raise
+
+                # the server has probably closed the idle connection, before
+                # receiving the request; any other error may have happened
+                # after the request was processed, so it is not repeated
+                self.debug(f'connection to {request.host} lost, reconnecting')
+                if body is not None:
+                    body.seek(body_pos)
+
+            except Exception:
+                conn.close()
+                raise
+
+        try:
+            data = response.read()
+
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+
+        else:
+            self._http_conns[key] = (conn, time.time())
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader(
+            'Location'
+        ):
+            # let urllib follow redirects
+            if body is not None:
+                body.seek(body_pos)
+
+            return utils.urlopen(request)
+
+        if response.status >= 400:
+            raise HTTPError(
+                request.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(data),
+            )
+
+        return _HTTPResponse(response.status, response.headers, data)
+
+    def _make_http_conn(self, request):
+        self.debug(f'creating connection to {request.host}')
+
+        if request.type == 'http':
+            return http.client.HTTPConnection(request.host, timeout=self.HTTP_TIMEOUT)
+
+        context = None
+        if not settings.VALIDATE_CERTS:
+            import ssl
+
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+
+        return http.client.HTTPSConnection(
+            request.host, timeout=self.HTTP_TIMEOUT, context=context
+        )
+
     def dump(self):
         return {}
 
@@ -158,8 +387,9 @@ class GoogleBase:
         self._location = None
         self._authorization_key = None
         self._credentials = None
+        # the resolved folder (or album) ids, persisted along with the state
         self._folder_ids = {}
-        self._folder_id_times = {}
+        self._folder_ids_changed = False
 
     @classmethod
     def _get_authorize_url(cls):
@@ -187,19 +417,49 @@ class GoogleBase:
             'location': self._location,
             'credentials': self._credentials,
             'authorization_key': self._authorization_key,
+            'folder_ids': self._folder_ids,
         }
 
     def _load(self, data):
         if data.get('location'):
+            if data['location'] != self._location:
+                self._folder_ids = {}
             self._location = data['location']
-            self._folder_ids = {}
         if data.get('authorization_key'):
             self._authorization_key = data['authorization_key']
             self._credentials = None
         if data.get('credentials'):
             self._credentials = data['credentials']
+        if data.get('folder_ids'):
+            self._folder_ids = data['folder_ids']
+
+    def _with_folder_id(self, path, func):
+        """Returns func(folder_id) for the folder at the given path. The cached
+        ids are trusted until the API reports one of them as not found; they
+        are then all resolved again, once."""
+
+        try:
+            result = func(self._get_folder_id(path))
+
+        except _NotFoundError:
+            if not self._folder_ids:
+                raise
+
+            self.debug('a cached folder id no longer exists, resolving them again')
+            self._folder_ids = {}
+            self._folder_ids_changed = True
+            result = func(self._get_folder_id(path))
+
+        if self._folder_ids_changed:
+            self._folder_ids_changed = False
+            self.save()
+
+        return result
 
     def _request(self, url, body=None, headers=None, retry_auth=True, method=None):
+        return self._open(url, body, headers, retry_auth, method).read()
+
+    def _open(self, url, body=None, headers=None, retry_auth=True, method=None):
         if not self._credentials:
             if not self._authorization_key:
                 msg = 'missing authorization key'
@@ -223,7 +483,7 @@ class GoogleBase:
         if method:
             request.get_method = lambda: method
         try:
-            response = utils.urlopen(request)
+            response = self.urlopen(request)
 
         except HTTPError as e:
             if (
@@ -237,13 +497,14 @@ class GoogleBase:
                     self.save()
 
                     # retry the request with refreshed credentials
-                    return self._request(url, body, headers, retry_auth=False)
+                    return self._open(url, body, headers, False, method)
 
                 except Exception:
                     self.error('refreshing credentials failed')
                     raise
 
             else:
+                code = e.code
                 try:
                     e = json.load(e)
                     msg = e['error']['message']
@@ -252,13 +513,16 @@ class GoogleBase:
                     msg = str(e)
 
                 self.error(f'request failed: {msg}')
+                if code == 404:
+                    raise _NotFoundError(msg)
+
                 raise Exception(msg)
 
         except Exception as e:
             self.error(f'request failed: {e}')
             raise
 
-        return response.read()
+        return response
 
     def _request_json(self, url, body=None, headers=None, retry_auth=True, method=None):
         response = self._request(url, body, headers, retry_auth, method)
@@ -342,12 +606,14 @@ class GoogleDrive(UploadService, GoogleBase):
         "'%(parent_id)s' in parents and title = '%(child_name)s' and trashed = false"
     )
     UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v2/files?uploadType=multipart'
+    RESUMABLE_UPLOAD_URL = (
+        'https://www.googleapis.com/upload/drive/v2/files?uploadType=resumable'
+    )
     CREATE_FOLDER_URL = 'https://www.googleapis.com/drive/v2/files'
+    FILES_URL = 'https://www.googleapis.com/drive/v2/files?q=%(query)s'
 
     BOUNDARY = 'motioneye_multipart_boundary'
 
-    FOLDER_ID_LIFE_TIME = 300  # 5 minutes
-
     def __init__(self, camera_id):
         self._init()
 
@@ -360,11 +626,35 @@ class GoogleDrive(UploadService, GoogleBase):
     def test_access(self):
         return self._test_access()
 
+    def is_uploaded(self, filename, size):
+        path = os.path.dirname(filename)
+        filename = os.path.basename(filename)
+
+        def find(folder_id):
+            query = self.CHILDREN_QUERY % {
+                'parent_id': folder_id,
+                'child_name': filename.replace("'", "\\'"),
+            }
+
+            return self._request_json(self.FILES_URL % {'query': quote(query)})
+
+        items = self._with_folder_id(path, find).get('items') or []
+
+        return any(int(item.get('fileSize', -1)) == size for item in items)
+
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
         path = os.path.dirname(filename)
         filename = os.path.basename(filename)
 
-        metadata = {'title': filename, 'parents': [{'id': self._get_folder_id(path)}]}
+        self._with_folder_id(
+            path,
+            lambda folder_id: self._upload_multipart(
+                filename, folder_id, mime_type, data
+            ),
+        )
+
+    def _upload_multipart(self, filename, folder_id, mime_type, data):
+        metadata = {'title': filename, 'parents': [{'id': folder_id}]}
 
         body = [
             '--' + self.BOUNDARY,
@@ -389,6 +679,78 @@ class GoogleDrive(UploadService, GoogleBase):
 
         self._request(self.UPLOAD_URL, body, headers)
 
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        if size <= self.CHUNK_SIZE:
+            return self.upload_data(filename, mime_type, f.read(), ctime, camera_name)
+
+        # resumable upload, in chunks
+        key = (filename, size, ctime)
+        session_url = self._interrupted.pop(key, None)
+        offset = 0
+        if session_url:
+            try:
+                offset = self._get_upload_offset(session_url, size)
+                self.debug(f'resuming upload of {filename} at {offset} bytes')
+
+            except Exception as e:
+                self.debug(f'cannot resume upload of {filename}: {e}')
+                session_url = None
+
+        if not session_url:
+            session_url = self._create_upload_session(filename, mime_type, size)
+
+        try:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.CHUNK_SIZE)
+                headers = {
+                    'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{size}'
+                }
+
+                response = self._open(session_url, chunk, headers, method='PUT')
+                offset = self._get_next_offset(response, size)
+
+        except Exception:
+            self._interrupted[key] = session_url
+            raise
+
+    def _create_upload_session(self, filename, mime_type, size):
+        path = os.path.dirname(filename)
+        filename = os.path.basename(filename)
+
+        headers = {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Type': mime_type,
+            'X-Upload-Content-Length': str(size),
+        }
+
+        def create(folder_id):
+            metadata = {'title': filename, 'parents': [{'id': folder_id}]}
+            body = json.dumps(metadata).encode()
+
+            return self._open(self.RESUMABLE_UPLOAD_URL, body, headers)
+
+        return self._with_folder_id(path, create).headers['Location']
+
+    def _get_upload_offset(self, session_url, size):
+        headers = {'Content-Range': f'bytes */{size}'}
+        response = self._open(session_url, b'', headers, method='PUT')
+
+        return self._get_next_offset(response, size)
+
+    @staticmethod
+    def _get_next_offset(response, size):
+        # "308 Resume Incomplete" tells the range received so far; the response
+        # may also be an HTTPError, which has no status before Python 3.9
+        if response.code != 308:
+            return size
+
+        received = response.headers.get('Range')  # e.g. bytes=0-1048575
+        if not received:
+            return 0
+
+        return int(received.rsplit('-', 1)[1]) + 1
+
     def dump(self):
         return self._dump()
 
@@ -396,37 +758,41 @@ class GoogleDrive(UploadService, GoogleBase):
         self._load(data)
 
     def _get_folder_id(self, path=''):
-        now = time.time()
-
-        folder_id = self._folder_ids.get(path)
-        folder_id_time = self._folder_id_times.get(path, 0)
-
         location = self._location
         if not location.endswith('/'):
             location += '/'
 
         location += path
 
-        if not folder_id or (now - folder_id_time > self.FOLDER_ID_LIFE_TIME):
+        names = [p.strip() for p in location.split('/') if p.strip()]
+        folder_id = self._folder_ids.get('/' + '/'.join(names))
+        if not folder_id:
             self.debug(f'finding folder id for location "{location}"')
-            folder_id = self._get_folder_id_by_path(location)
-
-            self._folder_ids[path] = folder_id
-            self._folder_id_times[path] = now
+            folder_id = self._get_folder_id_by_path(names)
 
         return folder_id
 
-    def _get_folder_id_by_path(self, path):
-        if path and path != '/':
-            path = [p.strip() for p in path.split('/') if p.strip()]
-            parent_id = 'root'
-            for name in path:
-                parent_id = self._get_folder_id_by_name(parent_id, name)
+    def _get_folder_id_by_path(self, names):
+        if not names:  # root folder
+            parent_id = self._get_folder_id_by_name(None, 'root')
+
+        else:
+            # start from the deepest parent folder whose id is known
+            start = len(names)
+            while start and '/' + '/'.join(names[:start]) not in self._folder_ids:
+                start -= 1
+
+            parent_id = (
+                self._folder_ids['/' + '/'.join(names[:start])] if start else 'root'
+            )
+            for i in range(start, len(names)):
+                parent_id = self._get_folder_id_by_name(parent_id, names[i])
+                self._folder_ids['/' + '/'.join(names[: i + 1])] = parent_id
 
-            return parent_id
+        self._folder_ids['/' + '/'.join(names)] = parent_id
+        self._folder_ids_changed = True
 
-        else:  # root folder
-            return self._get_folder_id_by_name(None, 'root')
+        return parent_id
 
     def _get_folder_id_by_name(self, parent_id, child_name, create=True):
         if parent_id:
@@ -548,9 +914,14 @@ class GooglePhoto(UploadService, GoogleBase):
 
     SCOPE = 'https://www.googleapis.com/auth/photoslibrary'
     GOOGLE_PHOTO_API = 'https://photoslibrary.googleapis.com/v1/'
+    MAX_BATCH_CREATE = 50  # media items per batchCreate request
+    MAX_UPLOADED = 1000
 
     def __init__(self, camera_id):
         self._init()
+        # the [name, size] of the recently created media items, persisted along
+        # with the state, as the API offers no way of looking them up by name
+        self._uploaded = []
 
         UploadService.__init__(self, camera_id)
 
@@ -561,28 +932,85 @@ class GooglePhoto(UploadService, GoogleBase):
     def test_access(self):
         return self._test_access()
 
+    def is_uploaded(self, filename, size):
+        return [os.path.basename(filename), size] in self._uploaded
+
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
-        filename = os.path.basename(filename)
-        dayinfo = datetime.datetime.fromtimestamp(ctime).strftime('%Y-%m-%d')
-        uploadname = dayinfo + '-' + filename
+        uploadToken = self._upload_bytes(filename, data, ctime)
+        response = self._create_media([uploadToken], camera_name)[0]
+        self.debug(f'response {response["mediaItem"]}')
+        self._add_uploaded([(filename, len(data))])
+
+    def upload_files(self, target_dir, filenames, camera_name):
+        # the bytes are uploaded one by one, but the media items
+        # are then created with a single request per batch
+        failed = []
+        tokens = []
+        sizes = {}
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+                if st.st_size > self.MAX_FILE_SIZE:
+                    raise Exception(f'file is too large ({st.st_size} bytes)')
 
-        body = data
+                if self.is_uploaded(filename, st.st_size):
+                    self.debug(f'file "{filename}" is already uploaded, skipping it')
+                    continue
 
-        headers = {
-            'Content-Type': 'application/octet-stream',
-            'X-Goog-Upload-File-Name': uploadname,
-            'X-Goog-Upload-Protocol': 'raw',
-        }
+                sizes[filename] = st.st_size
 
-        uploadToken = self._request(self.GOOGLE_PHOTO_API + 'uploads', body, headers)
-        response = self._create_media(uploadToken, camera_name)
-        self.debug(f'response {response["mediaItem"]}')
+                with open(filename, 'rb') as f:
+                    data = f.read()
+
+                token = self._upload_bytes(filename, data, os.path.getctime(filename))
+                tokens.append((filename, token))
+
+            except Exception as e:
+                self.error(f'failed to upload file "{filename}": {e}')
+                failed.append(filename)
+
+        for i in range(0, len(tokens), self.MAX_BATCH_CREATE):
+            batch = tokens[i : i + self.MAX_BATCH_CREATE]
+            try:
+                results = self._create_media([t for f, t in batch], camera_name)
+
+            except Exception as e:
+                self.error(f'failed to create {len(batch)} media items: {e}')
+                failed += [f for f, t in batch]
+                continue
+
+            created = []
+            for (filename, token), result in zip(batch, results):
+                status = result.get('status') or {}
+                if status.get('code'):  # 0 (or missing) means OK
+                    self.error(
+                        f'failed to create media item for "{filename}": '
+                        f'{status.get("message")}'
+                    )
+                    failed.append(filename)
+
+                else:
+                    created.append((filename, sizes[filename]))
+
+            self._add_uploaded(created)
+
+        return failed
+
+    def _add_uploaded(self, files):
+        if not files:
+            return
+
+        self._uploaded += [[os.path.basename(f), size] for f, size in files]
+        del self._uploaded[: -self.MAX_UPLOADED]
+        self.save()
 
     def dump(self):
-        return self._dump()
+        return dict(self._dump(), uploaded=self._uploaded)
 
     def load(self, data):
         self._load(data)
+        if data.get('uploaded') is not None:
+            self._uploaded = data['uploaded']
 
     def _get_folder_id(self, path=''):
         location = self._location
@@ -596,6 +1024,7 @@ class GooglePhoto(UploadService, GoogleBase):
             folder_id = self._get_folder_id_by_name(location)
 
             self._folder_ids[location] = folder_id
+            self._folder_ids_changed = True
 
         return folder_id
 
@@ -633,29 +1062,46 @@ class GooglePhoto(UploadService, GoogleBase):
         response = self._request_json(self.GOOGLE_PHOTO_API + 'albums', body, headers)
         return response
 
-    def _create_media(self, uploadToken, camera_name):
+    def _upload_bytes(self, filename, data, ctime):
+        filename = os.path.basename(filename)
+        dayinfo = datetime.datetime.fromtimestamp(ctime).strftime('%Y-%m-%d')
+        uploadname = dayinfo + '-' + filename
+
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Goog-Upload-File-Name': uploadname,
+            'X-Goog-Upload-Protocol': 'raw',
+        }
+
+        return self._request(self.GOOGLE_PHOTO_API + 'uploads', data, headers)
+
+    def _create_media(self, uploadTokens, camera_name):
         description = 'captured by motionEye camera' + (
             f' "{camera_name}"' if camera_name else ''
         )
 
-        metadata = {
-            'albumId': self._get_folder_id(),
-            'newMediaItems': [
-                {
-                    'description': description,
-                    'simpleMediaItem': {'uploadToken': uploadToken},
-                }
-            ],
-        }
+        def create(album_id):
+            metadata = {
+                'albumId': album_id,
+                'newMediaItems': [
+                    {
+                        'description': description,
+                        'simpleMediaItem': {'uploadToken': uploadToken.decode()},
+                    }
+                    for uploadToken in uploadTokens
+                ],
+            }
 
-        body = json.dumps(metadata)
+            body = json.dumps(metadata)
 
-        headers = {'Content-Type': 'application/json'}
+            headers = {'Content-Type': 'application/json'}
 
-        response = self._request_json(
-            self.GOOGLE_PHOTO_API + 'mediaItems:batchCreate', body, headers
-        )
-        return response.get('newMediaItemResults')[0]
+            return self._request_json(
+                self.GOOGLE_PHOTO_API + 'mediaItems:batchCreate', body, headers
+            )
+
+        response = self._with_folder_id('', create)
+        return response.get('newMediaItemResults')
 
     def _get_albums(self):
         response = self._request_json(self.GOOGLE_PHOTO_API + 'albums')
@@ -678,7 +1124,9 @@ class Dropbox(UploadService):
     CLIENT_NOT_SO_SECRET = 'dropbox_client_secret_placeholder'
 
     LIST_FOLDER_URL = 'https://api.dropboxapi.com/2/files/list_folder'
+    GET_METADATA_URL = 'https://api.dropboxapi.com/2/files/get_metadata'
     UPLOAD_URL = 'https://content.dropboxapi.com/2/files/upload'
+    UPLOAD_SESSION_URL = 'https://content.dropboxapi.com/2/files/upload_session/'
 
     def __init__(self, camera_id):
         self._location = None
@@ -721,21 +1169,89 @@ class Dropbox(UploadService):
 
             return msg
 
-    def upload_data(self, filename, mime_type, data, ctime, camera_name):
-        metadata = {
-            'path': os.path.join(self._clean_location(), filename),
-            'mode': 'add',
-            'autorename': True,
-            'mute': False,
-        }
+    def is_uploaded(self, filename, size):
+        body = json.dumps({'path': self._get_commit_info(filename)['path']})
+        headers = {'Content-Type': 'application/json'}
+
+        try:
+            response = self._request(
+                self.GET_METADATA_URL, body, headers, quiet_codes=(409,)
+            )
+
+        except HTTPError as e:
+            if e.code == 409:  # path/not_found
+                return False
 
+            raise
+
+        metadata = json.loads(response)
+
+        return metadata.get('.tag') == 'file' and metadata.get('size') == size
+
+    def upload_data(self, filename, mime_type, data, ctime, camera_name):
         headers = {
             'Content-Type': 'application/octet-stream',
-            'Dropbox-API-Arg': json.dumps(metadata),
+            'Dropbox-API-Arg': json.dumps(self._get_commit_info(filename)),
         }
 
         self._request(self.UPLOAD_URL, data, headers)
 
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        if size <= self.CHUNK_SIZE:
+            return self.upload_data(filename, mime_type, f.read(), ctime, camera_name)
+
+        # upload session, in chunks
+        key = (filename, size, ctime)
+        session_id, offset = self._interrupted.pop(key, (None, 0))
+        if session_id:
+            self.debug(f'resuming upload of {filename} at {offset} bytes')
+
+        try:
+            if not session_id:
+                chunk = f.read(self.CHUNK_SIZE)
+                response = self._session_request('start', chunk, {'close': False})
+                session_id = json.loads(response)['session_id']
+                offset = len(chunk)
+
+            while True:
+                f.seek(offset)
+                chunk = f.read(self.CHUNK_SIZE)
+                cursor = {'session_id': session_id, 'offset': offset}
+
+                try:
+                    if offset + len(chunk) >= size:
+                        arg = {
+                            'cursor': cursor,
+                            'commit': self._get_commit_info(filename),
+                        }
+                        self._session_request('finish', chunk, arg)
+                        break
+
+                    arg = {'cursor': cursor, 'close': False}
+                    self._session_request('append_v2', chunk, arg)
+                    offset += len(chunk)
+
+                except HTTPError as e:
+                    # the previous chunk may have been received without the
+                    # response making it back
+                    correct_offset = self._get_correct_offset(e)
+                    if correct_offset is None or correct_offset == offset:
+                        raise
+
+                    offset = correct_offset
+
+        except HTTPError as e:
+            if e.code >= 500 and session_id:
+                self._interrupted[key] = (session_id, offset)
+
+            raise
+
+        except Exception:
+            if session_id:
+                self._interrupted[key] = (session_id, offset)
+
+            raise
+
     def dump(self):
         return {
             'location': self._location,
@@ -752,6 +1268,37 @@ class Dropbox(UploadService):
         if data.get('credentials'):
             self._credentials = data['credentials']
 
+    def _get_commit_info(self, filename):
+        return {
+            'path': os.path.join(self._clean_location(), filename),
+            'mode': 'add',
+            'autorename': True,
+            'mute': False,
+        }
+
+    def _session_request(self, op, chunk, arg):
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Dropbox-API-Arg': json.dumps(arg),
+        }
+
+        return self._request(self.UPLOAD_SESSION_URL + op, chunk, headers)
+
+    @staticmethod
+    def _get_correct_offset(error):
+        # e.g. {"error": {".tag": "incorrect_offset", "correct_offset": 1024}},
+        # nested in {".tag": "lookup_failed", "lookup_failed": ...} by finish
+        try:
+            error = json.load(error)['error']
+            error = error.get('lookup_failed', error)
+            if error['.tag'] == 'incorrect_offset':
+                return error['correct_offset']
+
+        except Exception:
+            pass
+
+        return None
+
     def _clean_location(self):
         location = self._location
         if location == '/':
@@ -762,7 +1309,7 @@ class Dropbox(UploadService):
 
         return location
 
-    def _request(self, url, body=None, headers=None, retry_auth=True):
+    def _request(self, url, body=None, headers=None, retry_auth=True, quiet_codes=()):
         if not self._credentials:
             if not self._authorization_key:
                 msg = 'missing authorization key'
@@ -784,9 +1331,12 @@ class Dropbox(UploadService):
         self.debug(f'requesting {url}')
         request = Request(url, data=body, headers=headers)
         try:
-            response = utils.urlopen(request)
+            response = self.urlopen(request)
 
         except HTTPError as e:
+            if e.code in quiet_codes:  # expected, handled by the caller
+                raise
+
             if (
                 e.code == 401 and retry_auth
             ):  # unauthorized, access token may have expired
@@ -798,7 +1348,9 @@ class Dropbox(UploadService):
                     self.save()
 
                     # retry the request with refreshed credentials
-                    return self._request(url, body, headers, retry_auth=False)
+                    return self._request(
+                        url, body, headers, retry_auth=False, quiet_codes=quiet_codes
+                    )
 
                 except Exception:
                     self.error('refreshing credentials failed')
@@ -887,20 +1439,22 @@ class Webdav(UploadService):
         self._password = None
         self._location = None
 
+        self._dirs = set()  # the directories known to exist
+
         UploadService.__init__(self, camera_id)
 
-    def _request(self, url, method, body=None):
+    def _request(self, url, method, body=None, size=None):
         base64string = b64encode(f'{self._username}:{self._password}'.encode()).decode(
             'ascii'
         )
         headers = {'Authorization': f'Basic {base64string}'}
-        if body is not None:
-            headers.update({'Content-Length': len(body)})
+        if size is not None:
+            headers['Content-Length'] = str(size)
         self.debug(f'request: {method} {url}')
         request = Request(url, data=body, headers=headers)
         request.get_method = lambda: method
         try:
-            utils.urlopen(request)
+            self.urlopen(request)
         except HTTPError as e:
             if method == 'MKCOL' and e.code == 405:
                 self.debug(
@@ -910,30 +1464,44 @@ class Webdav(UploadService):
                 raise e
 
     def _make_dirs(self, path):
+        if path in self._dirs:
+            return
+
         dir_url = self._endpoint_url.rstrip('/') + '/'
         for folder in path.split('/'):
             dir_url = dir_url + folder + '/'
             self._request(dir_url, 'MKCOL')
 
+        self._dirs.add(path)
+
     def test_access(self):
         try:
             path = self._location.strip('/') + '/' + str(time.time())
             self._make_dirs(path)
             self._request(self._endpoint_url.rstrip('/') + '/' + path, 'DELETE')
+            self._dirs.discard(path)
             return True
         except Exception as e:
             self.error(str(e), exc_info=True)
             return str(e)
 
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
+        self.upload_stream(
+            filename, mime_type, io.BytesIO(data), len(data), ctime, camera_name
+        )
+
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        # the file is sent as it is read; WebDAV has no standard way of
+        # resuming a PUT, so interrupted uploads start over
         path = self._location.strip('/') + '/' + os.path.dirname(filename)
         filename = os.path.basename(filename)
         self._make_dirs(path)
-        self.debug(f'uploading {filename} of {len(data)} bytes')
+        self.debug(f'uploading {filename} of {size} bytes')
         self._request(
             self._endpoint_url.rstrip('/') + '/' + path + '/' + filename,
             'PUT',
-            bytearray(data),
+            f,
+            size,
         )
         self.debug('upload done')
 
@@ -955,6 +1523,8 @@ class Webdav(UploadService):
         if data.get('location'):
             self._location = data['location']
 
+        self._dirs.clear()
+
 
 class FTP(UploadService):
     NAME = 'ftp'
@@ -969,6 +1539,7 @@ class FTP(UploadService):
 
         self._conn = None
         self._conn_time = 0
+        self._dirs = set()  # the directories known to exist
 
         UploadService.__init__(self, camera_id)
 
@@ -992,6 +1563,12 @@ class FTP(UploadService):
             return str(e)
 
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
+        self.upload_stream(
+            filename, mime_type, io.BytesIO(data), len(data), ctime, camera_name
+        )
+
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        key = (filename, size, ctime)
         path = os.path.dirname(filename)
         filename = os.path.basename(filename)
 
@@ -999,8 +1576,31 @@ class FTP(UploadService):
         path = self._make_dirs(self._location + '/' + path, conn=conn)
         conn.cwd(path)
 
-        self.debug(f'uploading {filename} of {len(data)} bytes')
-        conn.storbinary(f'STOR {filename}', io.BytesIO(data))
+        # an interrupted upload is continued from the size of the remote file
+        rest = None
+        if self._interrupted.pop(key, None):
+            try:
+                conn.voidcmd('TYPE I')
+                rest = conn.size(filename)
+
+            except ftplib.all_errors as e:
+                self.debug(f'cannot resume upload of {filename}: {e}')
+
+            if rest and rest < size:
+                self.debug(f'resuming upload of {filename} at {rest} bytes')
+                f.seek(rest)
+
+            else:
+                rest = None
+
+        self.debug(f'uploading {filename} of {size} bytes')
+        try:
+            conn.storbinary(f'STOR {filename}', self.throttle(f), rest=rest)
+
+        except Exception:
+            self._interrupted[key] = True
+            self._conn = None  # the connection is probably broken
+            raise
 
         self.debug('upload done')
 
@@ -1038,6 +1638,7 @@ class FTP(UploadService):
             self._conn.connect(self._server, port=self._port)
             self._conn.login(self._username or 'anonymous', self._password)
             self._conn_time = now
+            self._dirs.clear()
 
         return self._conn
 
@@ -1046,8 +1647,11 @@ class FTP(UploadService):
 
         path = path.split('/')
         path = [p for p in path if p]
+        full_path = '/' + '/'.join(path)
+        if full_path in self._dirs:
+            return full_path
 
-        self.debug(f'ensuring path /{"/".join(path)}')
+        self.debug(f'ensuring path {full_path}')
 
         conn.cwd('/')
         for p in path:
@@ -1057,7 +1661,9 @@ class FTP(UploadService):
 
             conn.cwd(p)
 
-        return '/' + '/'.join(path)
+        self._dirs.add(full_path)
+
+        return full_path
 
 
 class SFTP(UploadService):
@@ -1070,6 +1676,9 @@ class SFTP(UploadService):
         self._password = None
         self._location = None
 
+        # the cURL handle is reused, so that its SSH connection is kept alive
+        self._conn = None
+
         UploadService.__init__(self, camera_id)
 
     def curl_perform_filetransfer(self, conn):
@@ -1082,14 +1691,17 @@ class SFTP(UploadService):
             curl_error = conn.errstr()
             msg = f'cURL upload failed on {curl_url}: {curl_error}'
             self.error(msg)
+
+            # don't reuse a handle whose connection may be broken
+            conn.close()
+            if conn is self._conn:
+                self._conn = None
+
             raise
 
         else:
             self.debug(f'upload done: {curl_url}')
 
-        finally:
-            conn.close()
-
     def test_access(self):
         filename = time.time()
         test_folder = "motioneye_test"
@@ -1115,10 +1727,34 @@ class SFTP(UploadService):
             return str(e)
 
     def upload_data(self, filename, mime_type, data, ctime, camera_name):
+        self.upload_stream(
+            filename, mime_type, io.BytesIO(data), len(data), ctime, camera_name
+        )
+
+    def upload_stream(self, filename, mime_type, f, size, ctime, camera_name):
+        def seek(offset, origin):
+            f.seek(offset, origin)
+            return pycurl.SEEKFUNC_OK
+
+        key = (filename, size, ctime)
         conn = self._get_conn(filename)
-        conn.setopt(pycurl.READFUNCTION, io.BytesIO(data).read)
+        conn.setopt(pycurl.READFUNCTION, f.read)
+        conn.setopt(pycurl.SEEKFUNCTION, seek)
+        conn.setopt(pycurl.INFILESIZE_LARGE, size)
+        if self.bandwidth:
+            conn.setopt(pycurl.MAX_SEND_SPEED_LARGE, self.bandwidth)
+
+        if self._interrupted.pop(key, None):
+            # continues from the size of the remote file
+            self.debug(f'resuming upload of {filename}')
+            conn.setopt(pycurl.RESUME_FROM_LARGE, -1)
+
+        try:
+            self.curl_perform_filetransfer(conn)
 
-        self.curl_perform_filetransfer(conn)
+        except Exception:
+            self._interrupted[key] = True
+            raise
 
     def dump(self):
         return {
@@ -1130,6 +1766,8 @@ class SFTP(UploadService):
         }
 
     def load(self, data):
+        previous = self.dump()
+
         if data.get('server') is not None:
             self._server = data['server']
         if data.get('port') is not None:
@@ -1141,18 +1779,28 @@ class SFTP(UploadService):
         if data.get('location'):
             self._location = data['location']
 
+        if self._conn is not None and self.dump() != previous:
+            self._conn.close()
+            self._conn = None
+
     def _get_conn(self, filename, auth_type='password'):
         sftp_url = 'sftp://{}:{}/{}/{}'.format(
             self._server, self._port, self._location, filename
         )
 
-        self.debug(
-            'creating sftp connection to {}@{}:{}'.format(
-                self._username, self._server, self._port
+        if self._conn is None:
+            self.debug(
+                'creating sftp connection to {}@{}:{}'.format(
+                    self._username, self._server, self._port
+                )
             )
-        )
 
-        self._conn = pycurl.Curl()
+            self._conn = pycurl.Curl()
+
+        else:
+            # keeps the connection cache, but forgets the previous transfer options
+            self._conn.reset()
+
         self._conn.setopt(self._conn.URL, sftp_url)
         self._conn.setopt(pycurl.CONNECTTIMEOUT, 10)
         self._conn.setopt(
@@ -1190,6 +1838,10 @@ class S3(UploadService):
         self._secret_key = None
         self._bucket = None
         self._sse_c_key = None
+
+        # boto3 clients keep a pool of connections to the endpoint
+        self._client = None
+
         UploadService.__init__(self, camera_id)
 
     def dump(self):
@@ -1202,6 +1854,8 @@ class S3(UploadService):
         }
 
     def load(self, data):
+        previous = self.dump()
+
         if data.get('endpoint_url'):
             self._endpoint_url = data['endpoint_url']
         if data.get('access_key') is not None:
@@ -1213,14 +1867,23 @@ class S3(UploadService):
         if data.get('sse_c_key') is not None:
             self._sse_c_key = data['sse_c_key']
 
+        if self.dump() != previous:
+            self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self.debug(f'creating S3 client for {self._endpoint_url or "AWS"}')
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self._endpoint_url,
+                aws_access_key_id=self._access_key,
+                aws_secret_access_key=self._secret_key,
+            )
+
+        return self._client
+
     def upload_file(self, target_dir, filename, camera_name):
-        # Create an S3 client
-        s3 = boto3.client(
-            's3',
-            endpoint_url=self._endpoint_url,
-            aws_access_key_id=self._access_key,
-            aws_secret_access_key=self._secret_key,
-        )
+        s3 = self._get_client()
 
         if target_dir:
             target_dir = os.path.realpath(target_dir)
@@ -1247,18 +1910,21 @@ class S3(UploadService):
         self.debug(
             f'uploading file "{filename}" to S3 bucket "{self._bucket}" path "{rel_filename}"'
         )
-        s3.upload_file(filename, self._bucket, rel_filename, ExtraArgs=extra_args)
+        transfer_config = None
+        if self.bandwidth:
+            transfer_config = TransferConfig(max_bandwidth=self.bandwidth)
+
+        s3.upload_file(
+            filename,
+            self._bucket,
+            rel_filename,
+            ExtraArgs=extra_args,
+            Config=transfer_config,
+        )
 
     def test_access(self):
         try:
-            # Create an S3 client
-            s3 = boto3.client(
-                's3',
-                endpoint_url=self._endpoint_url,
-                aws_access_key_id=self._access_key,
-                aws_secret_access_key=self._secret_key,
-            )
-            response = s3.list_buckets()
+            response = self._get_client().list_buckets()
             logging.debug('Existing buckets:')
             for bucket in response['Buckets']:
                 logging.debug(f'  {bucket["Name"]}')
@@ -1279,10 +1945,20 @@ def get_authorize_url(service_name):
 
 
 def get(camera_id, service_name):
-    global _services
+    global _services, _services_mtime
 
-    if _services is None:
-        _services = _load()
+    # the services are cached by each (task worker) process, along with their
+    # connections, and refreshed when the state file is changed
+    file_path = os.path.join(settings.CONF_PATH, _STATE_FILE_NAME)
+    try:
+        mtime = os.path.getmtime(file_path)
+
+    except OSError:
+        mtime = None
+
+    if _services is None or mtime != _services_mtime:
+        _services = _load(_services)
+        _services_mtime = mtime
 
     camera_id = str(camera_id)
 
@@ -1319,13 +1995,116 @@ def update(camera_id, service_name, settings):
     service.save()
 
 
-def upload_media_file(camera_id, camera_name, target_dir, service_name, filename):
+def schedule_upload(camera_id, camera_config, filename, batch=False):
+    """Adds a task that uploads a media file. With batch, the file is rather
+    collected along with the next ones of the same camera for up to
+    UPLOAD_BATCH_WINDOW seconds (or UPLOAD_BATCH_SIZE files), and all of them
+    are uploaded by a single task."""
+
+    if not batch or not settings.UPLOAD_BATCH_WINDOW:
+        return _add_upload_task(camera_id, camera_config, [filename])
+
+    key = (camera_id, camera_config['@upload_service'])
+    pending = _batches.get(key)
+    if pending is None:
+        io_loop = IOLoop.current()
+        timeout = io_loop.add_timeout(
+            datetime.timedelta(seconds=settings.UPLOAD_BATCH_WINDOW),
+            _flush_batch,
+            key,
+        )
+        pending = _batches[key] = {'filenames': [], 'timeout': timeout}
+
+    pending['filenames'].append(filename)
+    pending['camera_config'] = camera_config
+
+    if len(pending['filenames']) >= settings.UPLOAD_BATCH_SIZE:
+        IOLoop.current().remove_timeout(pending['timeout'])
+        _flush_batch(key)
+
+
+def flush_batches():
+    for key in list(_batches):
+        IOLoop.current().remove_timeout(_batches[key]['timeout'])
+        _flush_batch(key)
+
+
+def _flush_batch(key):
+    pending = _batches.pop(key)
+    _add_upload_task(key[0], pending['camera_config'], pending['filenames'])
+
+
+def _add_upload_task(camera_id, camera_config, filenames):
+    service_name = camera_config['@upload_service']
+
+    # no more uploads run at once than there are workers in the upload lane
+    concurrency = max(1, camera_config['@upload_concurrency'])
+    concurrency = min(concurrency, max(1, settings.UPLOAD_TASK_WORKERS))
+
+    # the bandwidth limit (in kB/s) is shared among the uploads that will run
+    # in parallel with this one, if any
+    group = f'upload:{camera_id}:{service_name}'
+    parallel = min(concurrency, tasks.count_group(group) + 1)
+    bandwidth = camera_config['@upload_bandwidth'] * 1024 // parallel
+
+    params = dict(
+        camera_id=camera_id,
+        service_name=service_name,
+        camera_name=camera_config['camera_name'],
+        target_dir=camera_config['@upload_subfolders'] and camera_config['target_dir'],
+        bandwidth=bandwidth,
+    )
+
+    if len(filenames) == 1:
+        func = upload_media_file
+        tag = f'upload_media_file({filenames[0]})'
+        params['filename'] = filenames[0]
+
+    else:
+        func = upload_media_files
+        tag = f'upload_media_files({filenames[0]} and {len(filenames) - 1} more)'
+        params['filenames'] = filenames
+
+    tasks.add(
+        5,
+        func,
+        tag=tag,
+        lane='upload',
+        retries=settings.UPLOAD_RETRIES,
+        retry_delay=settings.UPLOAD_RETRY_DELAY,
+        key=f'upload:{camera_id}:{service_name}:{filenames[0]}',
+        group=group,
+        group_limit=concurrency,
+        **params,
+    )
+
+
+def upload_media_file(
+    camera_id,
+    camera_name,
+    target_dir,
+    service_name,
+    filename,
+    bandwidth=0,
+    resume=None,
+):
+    # errors are raised again, as plain exceptions that can be passed on
+    # from the worker process, so that the upload task is retried; the state
+    # of the interrupted transfers goes with the retried task, which may well
+    # run in another worker
+
     service = get(camera_id, service_name)
     if not service:
         return logging.error(
             f'service "{service_name}" not initialized for camera with id {camera_id}'
         )
 
+    service.bandwidth = bandwidth
+    service._interrupted = dict(resume or {})
+
+    if not os.path.exists(filename):
+        return logging.warning(f'file "{filename}" no longer exists, not uploading')
+
     try:
         service.upload_file(target_dir, filename, camera_name)
 
@@ -1335,9 +2114,53 @@ def upload_media_file(camera_id, camera_name, target_dir, service_name, filename
             exc_info=True,
         )
 
+        msg = f'failed to upload file "{filename}": {e}'
+        if service._interrupted:
+            raise tasks.RetryWith(msg, {'resume': service._interrupted})
+
+        raise Exception(msg)
+
 
-def _load():
-    services = {}
+def upload_media_files(
+    camera_id,
+    camera_name,
+    target_dir,
+    service_name,
+    filenames,
+    bandwidth=0,
+    resume=None,
+):
+    # a batch that partially failed is retried with the remaining files only
+
+    service = get(camera_id, service_name)
+    if not service:
+        return logging.error(
+            f'service "{service_name}" not initialized for camera with id {camera_id}'
+        )
+
+    service.bandwidth = bandwidth
+    service._interrupted = dict(resume or {})
+
+    existing = [f for f in filenames if os.path.exists(f)]
+    if len(existing) < len(filenames):
+        logging.warning(
+            f'{len(filenames) - len(existing)} files no longer exist, not uploading'
+        )
+
+    service.debug(f'uploading a batch of {len(existing)} files to {service}')
+    failed = service.upload_files(target_dir, existing, camera_name)
+    if failed:
+        raise tasks.RetryWith(
+            f'failed to upload {len(failed)} of {len(existing)} files',
+            {'filenames': failed, 'resume': service._interrupted},
+        )
+
+
+def _load(services=None):
+    # the state is loaded into the given services that exist already, so that
+    # they keep their connections and the state of their interrupted transfers
+    if services is None:
+        services = {}
 
     file_path = os.path.join(settings.CONF_PATH, _STATE_FILE_NAME)
 
@@ -1373,10 +2196,11 @@ def _load():
                 cls = UploadService.get_service_classes().get(name)
 
                 if cls:
-                    service = cls(camera_id=camera_id)
-                    service.load(state)
+                    service = camera_services.get(name)
+                    if service is None:
+                        service = camera_services[name] = cls(camera_id=camera_id)
 
-                    camera_services[name] = service
+                    service.load(state)
 
                     logging.debug(
                         f'loaded upload service "{name}" for camera with id "{camera_id}"'
@@ -41,6 +41,8 @@ _SPECIAL_COOKIE_NAMES = {'expires', 'domain', 'path', 'secure', 'httponly'}
 
 MASK_WIDTH = 32
 
+_mask_lines_cache: dict = {}  # (key, mask lines) indexed by mask file name
+
 DEV_NULL = open(os.devnull, 'w')
 
 COMMON_RESOLUTIONS = [
@@ -478,6 +480,17 @@ def parse_editable_mask_file(
 
     file_name = build_mask_file_name(camera_id, mask_class)
 
+    # the parsed mask is reused for as long as the file stays the same
+    try:
+        key = (os.stat(file_name).st_mtime_ns, capture_width, capture_height)
+
+    except OSError:
+        key = None
+
+    cached = _mask_lines_cache.get(file_name)
+    if key and cached and cached[0] == key:
+        return list(cached[1])
+
     logging.debug(
         f'parsing editable mask {mask_class} for camera with id {camera_id}: {file_name}'
     )
@@ -579,6 +592,9 @@ def parse_editable_mask_file(
 
         mask_lines.append(line)
 
+    if key:
+        _mask_lines_cache[file_name] = (key, list(mask_lines))
+
     return mask_lines
 
 
@@ -0,0 +1,286 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Zip archives generated on the fly, one chunk at a time.
+
+Entries are stored (not compressed), which makes the size of the archive known
+before reading any file, so that it can be announced as Content-Length. The CRC
+of each entry is computed while its data is being streamed and written in a data
+descriptor right after it. Zip64 records are used whenever sizes, offsets or the
+number of entries exceed the limits of the classic format.
+"""
+
+import logging
+import struct
+import time
+import zlib
+from typing import Iterator, List, NamedTuple
+
+CHUNK_SIZE = 256 * 1024
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+_DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+_DATA_DESCRIPTOR64 = struct.Struct('<4sLQQ')
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+_END_RECORD = struct.Struct('<4sHHHHLLH')
+_END_RECORD64 = struct.Struct('<4sQHHLLQQQQ')
+_END_LOCATOR64 = struct.Struct('<4sLQL')
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+_SYSTEM_UNIX = 3
+_FILE_ATTRS = 0o100644 << 16
+
+
+class ZipEntry(NamedTuple):
+    path: str  # full path of the file on disk
+    name: str  # name of the entry inside the archive
+    size: int
+    mtime: float
+
+
+class _Member:
+    def __init__(self, entry: ZipEntry, offset: int) -> None:
+        self.entry = entry
+        self.offset = offset
+        self.name = entry.name.encode('utf-8')
+        self.flags = _FLAG_DATA_DESCRIPTOR
+        if not entry.name.isascii():
+            self.flags |= _FLAG_UTF8
+
+        self.zip64 = entry.size >= _ZIP64_LIMIT
+        self.crc = 0
+
+        t = time.localtime(entry.mtime)
+        year = min(max(t.tm_year, 1980), 2107)
+        self.dos_date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+        self.dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+
+    def local_header(self) -> bytes:
+        extra = b''
+        size = self.entry.size
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, size, size)
+            size = _ZIP64_LIMIT
+
+        return (
+            _LOCAL_HEADER.pack(
+                b'PK\x03\x04',
+                _VERSION_ZIP64 if self.zip64 else _VERSION_DEFAULT,
+                self.flags,
+                0,  # stored
+                self.dos_time,
+                self.dos_date,
+                0,  # the CRC comes in the data descriptor
+                size,
+                size,
+                len(self.name),
+                len(extra),
+            )
+            + self.name
+            + extra
+        )
+
+    def data_descriptor(self) -> bytes:
+        if self.zip64:
+            return _DATA_DESCRIPTOR64.pack(
+                b'PK\x07\x08', self.crc, self.entry.size, self.entry.size
+            )
+
+        return _DATA_DESCRIPTOR.pack(
+            b'PK\x07\x08', self.crc, self.entry.size, self.entry.size
+        )
+
+    def central_header(self) -> bytes:
+        size = self.entry.size
+        offset = self.offset
+        values = []
+        if size >= _ZIP64_LIMIT:
+            values += [size, size]
+            size = _ZIP64_LIMIT
+
+        if offset >= _ZIP64_LIMIT:
+            values.append(offset)
+            offset = _ZIP64_LIMIT
+
+        extra = b''
+        if values:
+            extra = struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values)
+
+        version = _VERSION_ZIP64 if values else _VERSION_DEFAULT
+
+        return (
+            _CENTRAL_HEADER.pack(
+                b'PK\x01\x02',
+                _SYSTEM_UNIX << 8 | version,
+                version,
+                self.flags,
+                0,  # stored
+                self.dos_time,
+                self.dos_date,
+                self.crc,
+                size,
+                size,
+                len(self.name),
+                len(extra),
+                0,  # comment length
+                0,  # disk number
+                0,  # internal attributes
+                _FILE_ATTRS,
+                offset,
+            )
+            + self.name
+            + extra
+        )
+
+    def local_size(self) -> int:
+        descriptor = _DATA_DESCRIPTOR64 if self.zip64 else _DATA_DESCRIPTOR
+        return (
+            _LOCAL_HEADER.size
+            + len(self.name)
+            + (20 if self.zip64 else 0)
+            + self.entry.size
+            + descriptor.size
+        )
+
+    def central_size(self) -> int:
+        count = 0
+        if self.entry.size >= _ZIP64_LIMIT:
+            count += 2
+
+        if self.offset >= _ZIP64_LIMIT:
+            count += 1
+
+        return _CENTRAL_HEADER.size + len(self.name) + (4 + 8 * count if count else 0)
+
+
+class ZipStream:
+    def __init__(self, entries: List[ZipEntry]) -> None:
+        self._members = []
+        offset = 0
+        for entry in entries:
+            member = _Member(entry, offset)
+            self._members.append(member)
+            offset += member.local_size()
+
+        self._cd_offset = offset
+        self._cd_size = sum(m.central_size() for m in self._members)
+
+    def size(self) -> int:
+        """Returns the exact length of the archive, in bytes."""
+
+        size = self._cd_offset + self._cd_size + _END_RECORD.size
+        if self._needs_zip64_end():
+            size += _END_RECORD64.size + _END_LOCATOR64.size
+
+        return size
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yields the archive contents in chunks of roughly CHUNK_SIZE bytes;
+        files are read lazily, as chunks are requested."""
+
+        buf = bytearray()
+        for piece in self._pieces():
+            buf += piece
+            if len(buf) >= CHUNK_SIZE:
+                yield bytes(buf)
+                buf.clear()
+
+        if buf:
+            yield bytes(buf)
+
+    def _pieces(self) -> Iterator[bytes]:
+        for member in self._members:
+            yield member.local_header()
+            yield from self._file_chunks(member)
+            yield member.data_descriptor()
+
+        for member in self._members:
+            yield member.central_header()
+
+        yield self._end_records()
+
+    def _file_chunks(self, member: _Member) -> Iterator[bytes]:
+        # the announced size must be honored even if the file has changed
+        # in the meantime, so it's truncated or padded with zeroes as needed
+        remaining = member.entry.size
+        crc = 0
+        try:
+            with open(member.entry.path, 'rb') as f:
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+
+                    remaining -= len(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    yield chunk
+
+        except OSError as e:
+            logging.error(f'failed to read file {member.entry.path}: {e}')
+
+        if remaining > 0:
+            logging.warning(
+                f'file {member.entry.path} is shorter than expected, padding zip entry'
+            )
+
+        while remaining > 0:
+            chunk = bytes(min(CHUNK_SIZE, remaining))
+            remaining -= len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+
+        member.crc = crc
+
+    def _needs_zip64_end(self) -> bool:
+        return (
+            len(self._members) >= _ZIP64_COUNT_LIMIT
+            or self._cd_offset >= _ZIP64_LIMIT
+            or self._cd_size >= _ZIP64_LIMIT
+        )
+
+    def _end_records(self) -> bytes:
+        count = len(self._members)
+        cd_offset = self._cd_offset
+        cd_size = self._cd_size
+        records = b''
+        if self._needs_zip64_end():
+            end64_offset = cd_offset + cd_size
+            records += _END_RECORD64.pack(
+                b'PK\x06\x06',
+                _END_RECORD64.size - 12,
+                _SYSTEM_UNIX << 8 | _VERSION_ZIP64,
+                _VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                cd_size,
+                cd_offset,
+            )
+            records += _END_LOCATOR64.pack(b'PK\x06\x07', 0, end64_offset, 1)
+            count = min(count, _ZIP64_COUNT_LIMIT)
+            cd_offset = min(cd_offset, _ZIP64_LIMIT)
+            cd_size = min(cd_size, _ZIP64_LIMIT)
+
+        return records + _END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, count, count, cd_size, cd_offset, 0
+        )
@@ -21,6 +21,7 @@ from io import BytesIO
 from shutil import rmtree
 from tempfile import mkdtemp
 from typing import Optional
+from unittest import mock
 
 from motioneye import config, settings
 
@@ -243,3 +244,136 @@ class TestRestore(unittest.TestCase):
     def test_restore_invalid_data_returns_none(self):
         result = config.restore(b'not a tarball')
         self.assertIsNone(result)
+
+
+class TestUiConfigCache(unittest.TestCase):
+    """Tests for the ui config cache of config.motion_camera_dict_to_ui()."""
+
+    def setUp(self):
+        self.conf_dir = mkdtemp()
+        self._patches = [
+            mock.patch.object(settings, 'CONF_PATH', self.conf_dir),
+            mock.patch.object(settings, 'CONFIG_CHECK_INTERVAL', 0),
+            mock.patch.object(
+                config,
+                '_motion_camera_dict_to_ui',
+                side_effect=lambda data: {'name': data['camera_name']},
+            ),
+            mock.patch.object(
+                config,
+                '_motion_camera_system_to_ui',
+                side_effect=lambda data, ui: ui.update(available_disks=[]),
+            ),
+        ]
+        for p in self._patches:
+            p.start()
+
+        self.to_ui = config._motion_camera_dict_to_ui
+        self.system_to_ui = config._motion_camera_system_to_ui
+        self.data = {'@id': 1, 'camera_name': 'cam', 'target_dir': self.conf_dir}
+        self._write_config()
+        config.invalidate()
+        config.get_camera(1)
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        config.invalidate()
+        rmtree(self.conf_dir)
+
+    def _write_config(self, mtime=1000):
+        path = os.path.join(self.conf_dir, 'camera-1.conf')
+        with open(path, 'w') as f:
+            f.write('@proto motioneye\n@host 127.0.0.1\n')
+
+        os.utime(path, (mtime, mtime))
+
+    def test_reused(self):
+        ui = config.motion_camera_dict_to_ui(self.data)
+        self.assertEqual('cam', ui['name'])
+        self.assertEqual([], ui['available_disks'])
+
+        ui['name'] = 'modified by the caller'
+        ui = config.motion_camera_dict_to_ui(dict(self.data))
+        self.assertEqual('cam', ui['name'])
+        self.assertEqual(1, self.to_ui.call_count)
+
+        # the disks, devices and mounts are looked up each time
+        self.assertEqual(2, self.system_to_ui.call_count)
+
+    def test_refreshed(self):
+        config.motion_camera_dict_to_ui(self.data)
+
+        # the camera config changed in memory
+        self.data['camera_name'] = 'other'
+        self.assertEqual('other', config.motion_camera_dict_to_ui(self.data)['name'])
+        self.assertEqual(2, self.to_ui.call_count)
+
+        # the camera config file changed
+        self._write_config(mtime=2000)
+        config.motion_camera_dict_to_ui(self.data)
+        self.assertEqual(3, self.to_ui.call_count)
+
+        # the additional config structure may have changed
+        config.invalidate()
+        config.motion_camera_dict_to_ui(self.data)
+        self.assertEqual(4, self.to_ui.call_count)
+
+
+class TestConfigFileCheck(unittest.TestCase):
+    """Tests for picking up the config files changed by others."""
+
+    def setUp(self):
+        self.conf_dir = mkdtemp()
+        self._patches = [
+            mock.patch.object(settings, 'CONF_PATH', self.conf_dir),
+            mock.patch.object(settings, 'CONFIG_CHECK_INTERVAL', 0),
+        ]
+        for p in self._patches:
+            p.start()
+
+        self._write_config(1, 'a')
+        self._write_config(2, 'b')
+        config.invalidate()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        config.invalidate()
+        rmtree(self.conf_dir)
+
+    def _write_config(self, camera_id, host):
+        with open(os.path.join(self.conf_dir, f'camera-{camera_id}.conf'), 'w') as f:
+            f.write(f'@proto motioneye\n@host {host}\n')
+
+    def test_changed_file(self):
+        self.assertEqual([1, 2], config.get_camera_ids())
+        generations = config.get_generation(1), config.get_generation(2)
+        self.assertEqual('a', config.get_camera(1)['@host'])
+
+        self._write_config(1, 'changed')
+        with mock.patch.object(
+            config, '_conf_to_dict', wraps=config._conf_to_dict
+        ) as p:
+            self.assertEqual('changed', config.get_camera(1)['@host'])
+            self.assertEqual('b', config.get_camera(2)['@host'])
+
+        # only the changed file is read again
+        self.assertEqual(1, p.call_count)
+        self.assertNotEqual(generations[0], config.get_generation(1))
+        self.assertEqual(generations[1], config.get_generation(2))
+
+    def test_check_interval(self):
+        config.get_camera(1)
+        self._write_config(1, 'changed')
+
+        with mock.patch.object(settings, 'CONFIG_CHECK_INTERVAL', 3600):
+            self.assertEqual('a', config.get_camera(1)['@host'])
+
+    def test_added_file(self):
+        self.assertEqual([1, 2], config.get_camera_ids())
+
+        self._write_config(3, 'c')
+        self.assertEqual([1, 2, 3], config.get_camera_ids())
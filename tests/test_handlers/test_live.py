@@ -0,0 +1,86 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from unittest.mock import patch
+
+from tornado.httpclient import HTTPClientError, HTTPRequest
+from tornado.testing import gen_test
+from tornado.websocket import websocket_connect
+
+from motioneye import liveview, mjpgclient
+from motioneye.handlers.live import LiveHandler
+from tests.test_handlers import HandlerTestCase
+
+_STATUS = {'motion_detected': False, 'capture_fps': 5.0, 'monitor_info': ''}
+
+
+class LiveTest(HandlerTestCase[LiveHandler]):
+    handler_cls = LiveHandler
+
+    def setUp(self):
+        super().setUp()
+        self._live_patches = [
+            patch('motioneye.mjpgclient.get_jpg'),
+            patch('motioneye.liveview._read_status', return_value=dict(_STATUS)),
+        ]
+        for p in self._live_patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._live_patches:
+            p.stop()
+
+        liveview._status.clear()
+        liveview._sample_timeout = None
+        super().tearDown()
+
+    def _connect(self, cookie=None):
+        headers = {'Cookie': cookie} if cookie else {}
+        url = self.get_url('/live/').replace('http', 'ws', 1)
+        return websocket_connect(HTTPRequest(url, headers=headers))
+
+    @gen_test
+    async def test_unauthorized(self):
+        with self.assertRaises(HTTPClientError) as cm:
+            await self._connect()
+
+        self.assertEqual(403, cm.exception.code)
+
+    @gen_test
+    async def test_frames_and_status(self):
+        conn = await self._connect(self.make_session_cookie('normal'))
+        conn.write_message(json.dumps({'cameras': {'1': {}}}))
+
+        message = json.loads(await conn.read_message())
+        self.assertEqual({'status': {'1': _STATUS}}, message)
+
+        for callback in list(mjpgclient.MjpgClient.listeners[1]):
+            callback(b'jpg', 1)
+
+        self.assertEqual(b'\x00\x00\x00\x01jpg', await conn.read_message())
+
+        # only the changed values are pushed
+        liveview.update_status(1, motion_detected=True, capture_fps=5.0)
+        message = json.loads(await conn.read_message())
+        self.assertEqual({'status': {'1': {'motion_detected': True}}}, message)
+
+        # unsubscribing removes the listeners
+        conn.write_message(json.dumps({'cameras': {}}))
+        conn.close()
+        await conn.read_message()
+        self.assertNotIn(1, mjpgclient.MjpgClient.listeners)
+        self.assertNotIn(1, liveview._subscribers)
@@ -0,0 +1,181 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+from zipfile import ZipFile
+
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import HTTPTimeoutError
+
+from motioneye import mjpgclient, remote
+from motioneye.handlers.picture import PictureHandler
+from tests.test_handlers import _FAKE_TARGET_DIR, HandlerTestCase
+
+
+class PictureZippedTest(HandlerTestCase[PictureHandler]):
+    handler_cls = PictureHandler
+
+    def setUp(self):
+        super().setUp()
+        self.group_dir = os.path.join(_FAKE_TARGET_DIR, '2024-01-01')
+        os.makedirs(self.group_dir)
+        for name in ['a.jpg', 'b.jpg']:
+            with open(os.path.join(self.group_dir, name), 'wb') as f:
+                f.write(name.encode() * 100)
+
+    def tearDown(self):
+        rmtree(self.group_dir)
+        super().tearDown()
+
+    def test_stream(self):
+        with patch('motioneye.settings.ENABLE_MEDIA_INDEX', False):
+            response = self.fetch(
+                '/picture/1/zipped/2024-01-01/?stream=true',
+                headers={'Cookie': self.make_session_cookie('admin')},
+            )
+
+        self.assertEqual(200, response.code)
+        self.assertEqual('application/zip', response.headers['Content-Type'])
+        self.assertEqual(len(response.body), int(response.headers['Content-Length']))
+
+        with ZipFile(BytesIO(response.body)) as f:
+            self.assertEqual(
+                ['2024-01-01/a.jpg', '2024-01-01/b.jpg'], sorted(f.namelist())
+            )
+            self.assertEqual(b'b.jpg' * 100, f.read('2024-01-01/b.jpg'))
+
+    def test_prepared(self):
+        cookie = self.make_session_cookie('admin')
+        cache_dir = mkdtemp()
+        with patch('motioneye.settings.ENABLE_MEDIA_INDEX', False), patch(
+            'motioneye.settings.PREPARED_CACHE_PATH', cache_dir
+        ):
+            response = self.fetch(
+                '/picture/1/zipped/2024-01-01/', headers={'Cookie': cookie}
+            )
+            key = json.loads(response.body)['key']
+
+            response = self.fetch(
+                f'/picture/1/zipped/2024-01-01/?key={key}', headers={'Cookie': cookie}
+            )
+
+        rmtree(cache_dir)
+        self.assertEqual(200, response.code)
+        self.assertEqual(len(response.body), int(response.headers['Content-Length']))
+        with ZipFile(BytesIO(response.body)) as f:
+            self.assertEqual(b'a.jpg' * 100, f.read('2024-01-01/a.jpg'))
+
+
+class PictureStreamTest(HandlerTestCase[PictureHandler]):
+    handler_cls = PictureHandler
+
+    def test_stream(self):
+        def get_jpg(camera_id):
+            def send():
+                for callback in list(mjpgclient.MjpgClient.listeners[camera_id]):
+                    callback(b'frame%d' % len(chunks), len(chunks))
+
+                if len(chunks) < 3:
+                    IOLoop.current().call_later(0.01, send)
+
+            IOLoop.current().add_callback(send)
+
+        chunks = []
+        with patch('motioneye.mjpgclient.get_jpg', side_effect=get_jpg):
+            # the stream never ends by itself
+            with self.assertRaises(HTTPTimeoutError):
+                self.fetch(
+                    '/picture/1/stream/',
+                    headers={'Cookie': self.make_session_cookie('admin')},
+                    streaming_callback=chunks.append,
+                    request_timeout=0.5,
+                )
+
+        body = b''.join(chunks)
+        self.assertTrue(
+            body.startswith(
+                b'--motioneyeframe\r\nContent-Type: image/jpeg\r\n'
+                b'Content-Length: 6\r\n\r\nframe0\r\n'
+            )
+        )
+        self.assertGreaterEqual(body.count(b'--motioneyeframe'), 3)
+
+    def test_status_only(self):
+        with patch('motioneye.mjpgclient.get_fps', return_value=5), patch(
+            'motioneye.monitor.get_monitor_info', return_value=''
+        ), patch('motioneye.mediafiles.get_current_picture') as get_current_picture:
+            response = self.fetch(
+                '/picture/1/current/?status=true',
+                headers={'Cookie': self.make_session_cookie('admin')},
+            )
+
+        self.assertEqual(200, response.code)
+        self.assertEqual(b'', response.body)
+        self.assertIn('capture_fps_1=5.0', response.headers['Set-Cookie'])
+        get_current_picture.assert_not_called()
+
+    def test_recent(self):
+        frames = [(7, 1000.5, b'frame7'), (8, 1001.0, b'frame8')]
+        with patch(
+            'motioneye.mjpgclient.get_recent_frames', return_value=frames
+        ) as get_recent_frames:
+            response = self.fetch(
+                '/picture/1/recent/?since=6',
+                headers={'Cookie': self.make_session_cookie('admin')},
+            )
+
+        get_recent_frames.assert_called_once_with(1, 6)
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            'multipart/mixed; boundary=motioneyeframe', response.headers['Content-Type']
+        )
+        self.assertEqual(
+            b'--motioneyeframe\r\nContent-Type: image/jpeg\r\nContent-Length: 6\r\n'
+            b'X-Frame-Sequence: 8\r\nX-Frame-Time: 1001.000\r\n\r\nframe8\r\n'
+            b'--motioneyeframe--\r\n',
+            response.body[response.body.index(b'--motioneyeframe', 1) :],
+        )
+
+    def test_current_batch(self):
+        get_fps = patch('motioneye.mjpgclient.get_fps', return_value=5)
+        get_info = patch('motioneye.monitor.get_monitor_info', return_value='info')
+        get_motion = patch(
+            'motioneye.motionctl.is_motion_detected', side_effect=lambda i: i == 2
+        )
+        get_picture = patch(
+            'motioneye.mediafiles.get_current_picture', return_value=b'jpg'
+        )
+        with get_fps, get_info, get_motion, get_picture:
+            response = self.fetch(
+                '/picture/batch/current/?ids=1,2&width=320',
+                headers={'Cookie': self.make_session_cookie('admin')},
+            )
+
+        self.assertEqual(200, response.code)
+        parts = remote._parse_multipart(response.body, 'motioneyeframe')
+        self.assertEqual(2, len(parts))
+        headers, picture = parts[1]
+        self.assertEqual(b'jpg', picture)
+        self.assertEqual('2', headers['X-Camera-Id'])
+        self.assertEqual('true', headers['X-Motion-Detected'])
+        self.assertEqual('5.0', headers['X-Capture-Fps'])
+        self.assertEqual('info', headers['X-Monitor-Info'])
+        self.assertEqual('false', parts[0][0]['X-Motion-Detected'])
@@ -14,15 +14,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import os
 import unittest
+from io import BytesIO
 from pathlib import Path
 from shutil import rmtree
 from tempfile import mkdtemp
-from time import time
+from time import sleep, time
+from unittest.mock import ANY, patch
 
-from motioneye import mediafiles
+from PIL import Image, JpegImagePlugin
+from tornado.testing import AsyncTestCase, gen_test
+
+from motioneye import mediafiles, mediawatcher
 from motioneye.mediafiles import _list_media_files
+from motioneye.mediawatcher import MediaStat
 
 
 class TestMediaFiles(unittest.TestCase):
@@ -282,6 +289,235 @@ class TestMediaFiles(unittest.TestCase):
         self.assertEqual(result_paths, expected_files)
 
 
+class TestMediaFilesPaging(unittest.TestCase):
+    def setUp(self):
+        self.target_dir = mkdtemp()
+        self.paths = []
+        for i in range(5):
+            path = os.path.join(self.target_dir, f'{i}.jpg')
+            Path(path).touch()
+            os.utime(path, (1000 + i, 1000 + i))
+            self.paths.append(path)
+
+    def tearDown(self):
+        rmtree(self.target_dir)
+
+    def _page(self, **kwargs):
+        kwargs.setdefault('limit', None)
+        kwargs.setdefault('cursor', None)
+        kwargs.setdefault('order', 'asc')
+        kwargs.setdefault('since', None)
+        kwargs.setdefault('with_stat', True)
+        media_files = _list_media_files(
+            self.target_dir, ['.jpg'], with_stat=kwargs['since'] is not None
+        )
+        page = mediafiles._select_page(media_files, self.target_dir, **kwargs)
+        return [os.path.basename(p) for p, st in page]
+
+    def test_limit_and_cursor(self):
+        self.assertEqual(self._page(limit=2), ['0.jpg', '1.jpg'])
+        self.assertEqual(self._page(limit=2, cursor='/1.jpg'), ['2.jpg', '3.jpg'])
+        self.assertEqual(self._page(limit=2, cursor='/4.jpg'), [])
+
+    def test_descending_order(self):
+        self.assertEqual(self._page(limit=2, order='desc'), ['4.jpg', '3.jpg'])
+        self.assertEqual(
+            self._page(limit=2, order='desc', cursor='/3.jpg'), ['2.jpg', '1.jpg']
+        )
+
+    def test_since(self):
+        self.assertEqual(self._page(since=1002), ['3.jpg', '4.jpg'])
+
+    def test_unpaged_order(self):
+        media_list = mediafiles._do_list_media(
+            self.target_dir, ['.jpg'], None, False, order='desc'
+        )
+        self.assertEqual(
+            ['/4.jpg', '/3.jpg', '/2.jpg', '/1.jpg', '/0.jpg'],
+            [m['path'] for m in media_list],
+        )
+
+    def test_page_is_statted(self):
+        media_files = _list_media_files(self.target_dir, ['.jpg'], with_stat=False)
+        page = mediafiles._select_page(
+            media_files, self.target_dir, 1, None, 'asc', None, True
+        )
+        self.assertEqual(page[0][1].st_mtime, 1000)
+
+
+class TestMediaGroups(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.camera_config = {'@id': 1, 'target_dir': mkdtemp()}
+        self.listings = 0
+        self._patches = [
+            patch('motioneye.settings.ENABLE_MEDIA_INDEX', False),
+            patch('motioneye.mediafiles.list_media', self._list_media),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        mediafiles.invalidate_media_groups()
+        rmtree(self.camera_config['target_dir'])
+        super().tearDown()
+
+    async def _list_media(self, camera_config, media_type):
+        self.listings += 1
+        await asyncio.sleep(0)
+        return [{'path': '/a.jpg', 'size': 4, 'timestamp': 1000}]
+
+    async def _get_counts(self):
+        groups = await mediafiles.get_media_groups(self.camera_config, 'picture')
+        return [(g['path'], g['count'], g['size']) for g in groups]
+
+    @gen_test
+    async def test_file_reported_twice(self):
+        self.assertEqual([('', 1, 4)], await self._get_counts())
+
+        path = os.path.join(self.camera_config['target_dir'], 'a.jpg')
+        Path(path).write_bytes(b'123456')
+        mediafiles.add_media_file(self.camera_config, path)
+        mediafiles.add_media_file(self.camera_config, path)
+
+        self.assertEqual([('', 1, 6)], await self._get_counts())
+        self.assertEqual(1, self.listings)
+
+    @gen_test
+    async def test_invalidated_while_listing(self):
+        future = asyncio.ensure_future(
+            mediafiles.get_media_groups(self.camera_config, 'picture')
+        )
+        await asyncio.sleep(0)  # the listing has started
+        mediafiles.invalidate_media_groups(1)
+        await future
+
+        self.assertEqual({}, mediafiles._media_groups_cache)
+
+    @gen_test
+    async def test_expiry(self):
+        with patch('motioneye.mediafiles._MEDIA_GROUPS_CACHE_TTL', 0):
+            await self._get_counts()
+            await self._get_counts()
+
+        self.assertEqual(2, self.listings)
+
+
+class TestMediaWorkers(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.camera_config = {'@id': 1, 'target_dir': mkdtemp()}
+        for name in ['a.jpg', 'b.jpg']:
+            Path(os.path.join(self.camera_config['target_dir'], name)).touch()
+
+    def tearDown(self):
+        mediafiles.stop_workers()
+        rmtree(self.camera_config['target_dir'])
+        super().tearDown()
+
+    @gen_test
+    async def test_identical_requests_are_shared(self):
+        with patch('motioneye.settings.ENABLE_MEDIA_INDEX', False):
+            fut1 = mediafiles.list_media(self.camera_config, 'picture')
+            fut2 = mediafiles.list_media(self.camera_config, 'picture')
+            fut3 = mediafiles.list_media(self.camera_config, 'picture', limit=1)
+            self.assertIs(fut1, fut2)
+            self.assertIsNot(fut1, fut3)
+
+            media_list = await fut1
+            self.assertEqual(
+                ['/a.jpg', '/b.jpg'], sorted(m['path'] for m in media_list)
+            )
+            self.assertEqual(1, len(await fut3))
+
+            # finished requests are not reused
+            fut4 = mediafiles.list_media(self.camera_config, 'picture')
+            self.assertIsNot(fut1, fut4)
+            await fut4
+
+    @gen_test
+    async def test_catalogue_in_parent(self):
+        # the workers get the files from the catalogue of this process
+        target_dir = self.camera_config['target_dir']
+        media_files = [(os.path.join(target_dir, 'c.jpg'), MediaStat(1000, 4))]
+        with patch('motioneye.settings.ENABLE_MEDIA_INDEX', False), patch(
+            'motioneye.mediawatcher.list_media_files', return_value=media_files
+        ) as list_media_files:
+            media_list = await mediafiles.list_media(self.camera_config, 'picture')
+
+        list_media_files.assert_called_once_with(target_dir, ANY, None, True)
+        self.assertEqual([('/c.jpg', 4)], [(m['path'], m['size']) for m in media_list])
+
+    @gen_test(timeout=20)
+    async def test_timeout(self):
+        result = await mediafiles._run_in_worker(('sleep',), 1, sleep, 30)
+        self.assertIsNone(result)
+
+        # the hung worker was killed and a new pool is used
+        roots = await mediafiles._run_in_worker(('roots',), 10, _get_roots)
+        self.assertEqual({}, roots)
+
+    @gen_test(timeout=20)
+    async def test_timeout_spares_other_tasks(self):
+        with patch('motioneye.settings.MEDIA_WORKERS', 2):
+            hung = mediafiles._run_in_worker(('sleep',), 1, sleep, 30)
+            other = mediafiles._run_in_worker(('echo',), 10, _echo_after, 2, 'ok')
+
+            self.assertIsNone(await hung)
+            self.assertEqual('ok', await other)
+
+
+def _get_roots():
+    return dict(mediawatcher._roots)
+
+
+def _echo_after(seconds, value):
+    sleep(seconds)
+    return value
+
+
+class TestResizeCurrentPicture(unittest.TestCase):
+    def setUp(self):
+        self.camera_config = {'@id': 1, '@webcam_resolution': 100}
+        bio = BytesIO()
+        Image.new('RGB', (640, 480), 'red').save(bio, format='JPEG')
+        self.jpg = bio.getvalue()
+
+    def tearDown(self):
+        mediafiles._resized_frames_cache.clear()
+
+    def _resize(self, width, seq):
+        return mediafiles.resize_current_picture(
+            self.camera_config, self.jpg, width, None, seq=seq
+        )
+
+    def test_resize(self):
+        resized = self._resize(160, seq=1)
+        self.assertEqual((160, 120), Image.open(BytesIO(resized)).size)
+        self.assertEqual((213, 160), Image.open(BytesIO(self._resize(213, 1))).size)
+        self.assertIs(self.jpg, self._resize(1280, seq=1))  # no enlarging
+
+    def test_draft_size(self):
+        # with only the width given, the decoder is asked for the scaled height
+        jpeg_image = JpegImagePlugin.JpegImageFile
+        with patch.object(
+            jpeg_image, 'draft', autospec=True, side_effect=jpeg_image.draft
+        ) as draft:
+            self._resize(160, seq=None)
+
+        draft.assert_called_once_with(ANY, 'RGB', (160, 120))
+
+    def test_cached_per_frame(self):
+        resized = self._resize(160, seq=1)
+        self.assertIs(resized, self._resize(160, seq=1))
+        self.assertIs(resized, self._resize(0.25, seq=1))  # same size, as percent
+        self.assertIsNot(resized, self._resize(160, seq=2))
+        self.assertIsNot(resized, self._resize(160, seq=None))
+
+
 class TestMediaFilesPathValidation(unittest.TestCase):
     """Tests verifying that path validation (traversal, absolute, dir escape) is enforced in mediafiles functions."""
 
@@ -0,0 +1,181 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from motioneye import mediafiles, mediaindex
+
+
+class TestMediaIndex(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.media_path = mkdtemp()
+        self.target_dir = mkdtemp()
+        self.camera_config = {'@id': 1, 'target_dir': self.target_dir}
+
+        os.makedirs(os.path.join(self.target_dir, '2024-01-01'))
+        for name in [
+            'root.jpg',
+            'root.mp4',
+            'lastsnap.jpg',
+            '.hidden.jpg',
+            'notes.txt',
+            '2024-01-01/a.jpg',
+            '2024-01-01/b.jpg',
+            '2024-01-01/c.avi',
+        ]:
+            Path(self.target_dir, name).touch()
+
+        self._patches = [
+            patch('motioneye.settings.MEDIA_PATH', self.media_path),
+            patch('motioneye.settings.ENABLE_MEDIA_INDEX', True),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        mediaindex._initialized_dbs.clear()
+        rmtree(self.media_path)
+        rmtree(self.target_dir)
+
+    def _paths(self, media_type, prefix=None):
+        rows = mediaindex.query(self.camera_config, media_type, prefix)
+        return None if rows is None else [r[0] for r in rows]
+
+    def test_not_ready_before_rescan(self):
+        self.assertFalse(mediaindex.ready(self.camera_config))
+        self.assertIsNone(self._paths('picture'))
+
+    def test_rescan_indexes_media_files(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        self.assertTrue(mediaindex.ready(self.camera_config))
+        self.assertEqual(
+            self._paths('picture'),
+            ['/2024-01-01/a.jpg', '/2024-01-01/b.jpg', '/root.jpg'],
+        )
+        self.assertEqual(self._paths('movie'), ['/2024-01-01/c.avi', '/root.mp4'])
+
+    def test_rescan_keeps_signal_handlers(self):
+        with patch('signal.signal') as signal:
+            mediaindex._do_rescan(1, self.target_dir)
+
+        signal.assert_not_called()
+
+    def test_query_by_group(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        self.assertEqual(
+            self._paths('picture', '2024-01-01'),
+            ['/2024-01-01/a.jpg', '/2024-01-01/b.jpg'],
+        )
+        self.assertEqual(self._paths('picture', 'ungrouped'), ['/root.jpg'])
+
+    def test_query_pages(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        rows = mediaindex.query(self.camera_config, 'picture', limit=2)
+        self.assertEqual(
+            [r[0] for r in rows], ['/2024-01-01/a.jpg', '/2024-01-01/b.jpg']
+        )
+
+        rows = mediaindex.query(
+            self.camera_config, 'picture', limit=2, cursor=rows[-1][0]
+        )
+        self.assertEqual([r[0] for r in rows], ['/root.jpg'])
+
+        rows = mediaindex.query(self.camera_config, 'picture', limit=1, order='desc')
+        self.assertEqual([r[0] for r in rows], ['/root.jpg'])
+
+    def test_not_ready_after_target_dir_change(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        self.assertFalse(
+            mediaindex.ready({'@id': 1, 'target_dir': self.target_dir + '/other'})
+        )
+
+    def test_add_and_remove_files(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        new_file = os.path.join(self.target_dir, '2024-01-01', 'd.jpg')
+        Path(new_file).touch()
+        mediaindex.add_file(self.camera_config, new_file)
+        self.assertIn('/2024-01-01/d.jpg', self._paths('picture'))
+
+        mediaindex.remove_files(1, self.target_dir, [new_file])
+        self.assertNotIn('/2024-01-01/d.jpg', self._paths('picture'))
+
+        mediaindex.remove_group(1, '2024-01-01', 'picture')
+        self.assertEqual(self._paths('picture'), ['/root.jpg'])
+        self.assertEqual(self._paths('movie'), ['/2024-01-01/c.avi', '/root.mp4'])
+
+    def test_rescan_drops_missing_files(self):
+        mediaindex._do_rescan(1, self.target_dir)
+        os.remove(os.path.join(self.target_dir, 'root.jpg'))
+        mediaindex._do_rescan(1, self.target_dir)
+
+        self.assertNotIn('/root.jpg', self._paths('picture'))
+
+    async def test_list_media_answers_from_index(self):
+        mediaindex._do_rescan(1, self.target_dir)
+
+        with patch('multiprocessing.Process') as process:
+            media_list = await mediafiles.list_media(
+                self.camera_config, 'picture', '2024-01-01'
+            )
+
+        process.assert_not_called()
+        self.assertEqual(
+            [m['path'] for m in media_list],
+            ['/2024-01-01/a.jpg', '/2024-01-01/b.jpg'],
+        )
+        self.assertEqual(media_list[0]['mimeType'], 'image/jpeg')
+        self.assertIn('sizeStr', media_list[0])
+
+    async def test_media_groups(self):
+        Path(self.target_dir, '2024-01-01', 'a.jpg').write_bytes(b'1234')
+        mediaindex._do_rescan(1, self.target_dir)
+        mediafiles.invalidate_media_groups()
+
+        groups = await mediafiles.get_media_groups(self.camera_config, 'picture')
+        self.assertEqual(
+            [(g['path'], g['count'], g['size']) for g in groups],
+            [('', 1, 0), ('2024-01-01', 2, 4)],
+        )
+
+        new_file = os.path.join(self.target_dir, '2024-01-02', 'd.jpg')
+        os.makedirs(os.path.dirname(new_file))
+        Path(new_file).write_bytes(b'12')
+        # the file is reported twice, but counted once
+        mediafiles.add_media_file(self.camera_config, new_file)
+        mediafiles.add_media_file(self.camera_config, new_file)
+        groups = await mediafiles.get_media_groups(self.camera_config, 'picture')
+        self.assertEqual(groups[-1]['path'], '2024-01-02')
+        self.assertEqual((groups[-1]['count'], groups[-1]['size']), (1, 2))
+
+        mediafiles.invalidate_media_groups(1)
+        self.assertNotIn((1, 'picture'), mediafiles._media_groups_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
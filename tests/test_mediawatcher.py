@@ -0,0 +1,153 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from motioneye import mediawatcher
+from motioneye.mediafiles import _list_media_files
+
+
+class TestMediaWatcher(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.target_dir = mkdtemp()
+        os.makedirs(os.path.join(self.target_dir, '2024-01-01'))
+        for name in ['root.jpg', 'lastsnap.jpg', '2024-01-01/a.jpg']:
+            Path(self.target_dir, name).touch()
+
+        camera_config = {
+            '@id': 1,
+            'target_dir': self.target_dir,
+            'netcam_url': 'http://localhost/stream',
+        }
+        self._patches = [
+            patch('motioneye.settings.ENABLE_MEDIA_WATCHER', True),
+            patch('motioneye.config.get_camera_ids', return_value=[1]),
+            patch('motioneye.config.get_camera', return_value=camera_config),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        mediawatcher.stop()
+        for p in self._patches:
+            p.stop()
+
+        rmtree(self.target_dir)
+        super().tearDown()
+
+    async def _wait(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+
+            await gen.sleep(0.02)
+
+        self.fail('condition not met in time')
+
+    def _paths(self, sub_path=None):
+        result = mediawatcher.list_media_files(self.target_dir, ['.jpg'], sub_path)
+        return None if result is None else sorted(p for p, st in result)
+
+    def test_not_running(self):
+        self.assertIsNone(self._paths())
+
+    @gen_test
+    async def test_initial_scan(self):
+        mediawatcher.start()
+        await self._wait(lambda: self._paths() is not None)
+
+        self.assertEqual(
+            self._paths(),
+            [
+                os.path.join(self.target_dir, '2024-01-01', 'a.jpg'),
+                os.path.join(self.target_dir, 'root.jpg'),
+            ],
+        )
+        self.assertEqual(
+            self._paths('ungrouped'), [os.path.join(self.target_dir, 'root.jpg')]
+        )
+        self.assertEqual(self._paths('missing'), [])
+
+    @gen_test
+    async def test_tracks_changes(self):
+        mediawatcher.start()
+        await self._wait(lambda: self._paths() is not None)
+
+        new_dir = os.path.join(self.target_dir, '2024-01-02')
+        os.makedirs(new_dir)
+        Path(new_dir, 'b.jpg').write_bytes(b'data')
+        os.remove(os.path.join(self.target_dir, 'root.jpg'))
+
+        expected = [
+            os.path.join(self.target_dir, '2024-01-01', 'a.jpg'),
+            os.path.join(new_dir, 'b.jpg'),
+        ]
+        await self._wait(lambda: self._paths() == expected)
+
+        result = _list_media_files(self.target_dir, ['.jpg'], '2024-01-02')
+        self.assertEqual(result[0][1].st_size, 4)
+
+        rmtree(new_dir)
+        await self._wait(lambda: self._paths() == expected[:1])
+
+    @gen_test
+    async def test_overflow_triggers_rescan(self):
+        mediawatcher.start()
+        await self._wait(lambda: self._paths() is not None)
+
+        Path(self.target_dir, 'unseen.jpg').touch()
+        overflow = [(-1, mediawatcher.IN_Q_OVERFLOW, 0, '')]
+        mediawatcher._handle_events(os.path.normpath(self.target_dir), overflow)
+        self.assertIsNone(self._paths())
+
+        await self._wait(
+            lambda: os.path.join(self.target_dir, 'unseen.jpg') in (self._paths() or [])
+        )
+
+    @gen_test
+    async def test_overflow_only_rescans_its_root(self):
+        other_dir = mkdtemp()
+        Path(other_dir, 'b.jpg').touch()
+        camera_configs = {
+            1: {'@id': 1, 'target_dir': self.target_dir, 'netcam_url': 'http://a'},
+            2: {'@id': 2, 'target_dir': other_dir, 'netcam_url': 'http://b'},
+        }
+        with patch('motioneye.config.get_camera_ids', return_value=[1, 2]), patch(
+            'motioneye.config.get_camera', side_effect=camera_configs.get
+        ):
+            mediawatcher.start()
+
+        def other_paths():
+            return mediawatcher.list_media_files(other_dir, ['.jpg'])
+
+        await self._wait(lambda: self._paths() is not None and other_paths())
+
+        overflow = [(-1, mediawatcher.IN_Q_OVERFLOW, 0, '')]
+        mediawatcher._handle_events(os.path.normpath(other_dir), overflow)
+        self.assertIsNone(other_paths())
+        self.assertIsNotNone(self._paths())
+
+        await self._wait(lambda: other_paths() is not None)
+        mediawatcher.stop()
+        rmtree(other_dir)
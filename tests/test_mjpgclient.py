@@ -0,0 +1,143 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from tornado import gen
+from tornado.tcpserver import TCPServer
+from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
+
+from motioneye import mjpgclient
+from motioneye.mjpgclient import MjpgClient
+
+# frames of various sizes, the last one larger than the initial buffer
+_FRAMES = [b'a' * 10, b'b' * 1000, b'c' * 100000, b'd' * 5, b'e' * 300000]
+
+
+class _MjpgServer(TCPServer):
+    async def handle_stream(self, stream, address):
+        await stream.read_until(b'\r\n\r\n')
+        data = (
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: multipart/x-mixed-replace; boundary=BoundaryString\r\n\r\n'
+        )
+        for frame in _FRAMES:
+            data += (
+                b'--BoundaryString\r\nContent-type: image/jpeg\r\n'
+                b'Content-Length: %d\r\n\r\n%s\r\n' % (len(frame), frame)
+            )
+
+        # written in odd chunks, so that headers and frames are split
+        for i in range(0, len(data), 7919):
+            await stream.write(data[i : i + 7919])
+            await gen.sleep(0)
+
+
+class TestMjpgClient(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        sock, self.port = bind_unused_port()
+        self.server = _MjpgServer()
+        self.server.add_socket(sock)
+
+    def tearDown(self):
+        self.server.stop()
+        MjpgClient.listeners.clear()
+        super().tearDown()
+
+    async def _receive(self):
+        frames = []
+        mjpgclient.add_listener(1, lambda jpg, seq: frames.append(jpg))
+        client = MjpgClient(1, self.port, None, None, None)
+        await client.do_connect()
+        for _ in range(100):
+            if len(frames) == len(_FRAMES):
+                break
+
+            await gen.sleep(0.01)
+
+        client.close()
+
+        return frames
+
+    @gen_test
+    async def test_buffered_parser(self):
+        with patch('motioneye.settings.MJPG_CLIENT_PARSER', 'buffered'), patch.object(
+            MjpgClient, '_BUFFER_SIZE', 4096
+        ):
+            frames = await self._receive()
+
+        self.assertEqual(_FRAMES, frames)
+
+    @gen_test
+    async def test_callbacks_parser(self):
+        with patch('motioneye.settings.MJPG_CLIENT_PARSER', 'callbacks'):
+            frames = await self._receive()
+
+        self.assertEqual(_FRAMES, frames)
+
+    def test_recent_frames(self):
+        client = MjpgClient(1, self.port, None, None, None)
+        with patch('motioneye.settings.MJPG_CLIENT_RECENT_FRAMES', 3), patch(
+            'motioneye.settings.MJPG_CLIENT_RECENT_SIZE', 1
+        ):
+            for frame in _FRAMES:
+                client._set_jpg(frame)
+
+            frames = [f[2] for f in client.get_recent_frames()]
+            self.assertEqual(_FRAMES[-3:], frames)
+            self.assertEqual((3, 400005), client.get_recent_size())
+
+            since = client.get_recent_frames()[0][0]
+            frames = [f[2] for f in client.get_recent_frames(since)]
+            self.assertEqual(_FRAMES[-2:], frames)
+
+            # the byte budget applies as well
+            client._set_jpg(b'f' * 1024 * 1024)
+            client._set_jpg(b'g' * 10)
+            self.assertEqual((1, 10), client.get_recent_size())
+
+        client.close()
+
+    def test_event_frames(self):
+        run_path = mkdtemp()
+        client = MjpgClient(1, self.port, None, None, None)
+        MjpgClient.clients[1] = client
+        with patch('motioneye.settings.MJPG_CLIENT_RECENT_FRAMES', 3), patch(
+            'motioneye.settings.RUN_PATH', run_path
+        ):
+            for frame in _FRAMES[:2]:
+                client._set_jpg(frame)
+
+            self.assertEqual(2, mjpgclient.save_event_frames(1))
+            client._set_jpg(_FRAMES[2])
+            self.assertEqual(3, mjpgclient.save_event_frames(1))
+
+            # the frames of the previous event are replaced
+            [first, _, last] = client.get_recent_frames()
+            paths = mjpgclient.get_event_frames(1, first[1], last[1])
+            self.assertEqual(3, len(paths))
+            with open(paths[-1], 'rb') as f:
+                self.assertEqual(_FRAMES[2], f.read())
+
+            self.assertEqual([], mjpgclient.get_event_frames(1, 0, first[1] - 1))
+            self.assertEqual([], mjpgclient.get_event_frames(2, 0, last[1]))
+
+        del MjpgClient.clients[1]
+        client.close()
+        rmtree(run_path)
@@ -0,0 +1,101 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from tornado.testing import AsyncTestCase
+
+from motioneye import mediafiles, preparedcache
+
+
+class TestPreparedCache(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(mkdtemp(), 'prepared')
+        self._patches = [
+            patch('motioneye.settings.PREPARED_CACHE_PATH', self.cache_dir),
+            patch('motioneye.settings.PREPARED_CACHE_SIZE', 1),  # 1 MB
+            patch('motioneye.preparedcache._initialized', False),
+            patch('motioneye.preparedcache._total_size', 0),
+            patch('motioneye.preparedcache._entries', preparedcache.OrderedDict()),
+            patch(
+                'motioneye.preparedcache._stats', dict.fromkeys(preparedcache._stats, 0)
+            ),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        rmtree(os.path.dirname(self.cache_dir))
+        super().tearDown()
+
+    def test_stale_entries_removed(self):
+        os.makedirs(self.cache_dir)
+        names = ['a' * 40, '.tmp-1-2.zip', 'other.mp4']
+        for name in names:
+            open(os.path.join(self.cache_dir, name), 'w').close()
+
+        key = mediafiles.set_prepared_cache(b'data')
+
+        # files that don't belong to the store are left alone
+        self.assertEqual(sorted([key, 'other.mp4']), sorted(os.listdir(self.cache_dir)))
+
+    def test_set_and_get(self):
+        key = mediafiles.set_prepared_cache(b'data')
+
+        self.assertEqual(os.listdir(self.cache_dir), [key])
+        self.assertEqual(mediafiles.get_prepared_cache(key), b'data')
+        self.assertEqual(mediafiles.get_prepared_cache(key), b'data')
+        self.assertIsNone(mediafiles.get_prepared_cache('missing'))
+
+        stats = preparedcache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertEqual((stats['count'], stats['size']), (1, 4))
+
+    def test_lru_eviction(self):
+        chunk = bytes(400 * 1024)
+        key1 = mediafiles.set_prepared_cache(chunk)
+        key2 = mediafiles.set_prepared_cache(chunk)
+        mediafiles.get_prepared_cache(key1)  # key2 is now the least recently used
+        key3 = mediafiles.set_prepared_cache(chunk)
+
+        self.assertIsNotNone(mediafiles.get_prepared_cache(key1))
+        self.assertIsNone(mediafiles.get_prepared_cache(key2))
+        self.assertIsNotNone(mediafiles.get_prepared_cache(key3))
+        self.assertEqual(preparedcache.get_stats()['evictions'], 1)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted([key1, key3]))
+
+    def test_oversized_file_is_kept(self):
+        key = mediafiles.set_prepared_cache(bytes(2 * 1024 * 1024))
+
+        self.assertIsNotNone(mediafiles.open_prepared_cache(key))
+
+    def test_set_file(self):
+        path = preparedcache.make_temp_path('.zip')
+        with open(path, 'wb') as f:
+            f.write(b'zip')
+
+        key = mediafiles.set_prepared_cache_file(path)
+
+        self.assertFalse(os.path.exists(path))
+        with mediafiles.open_prepared_cache(key) as f:
+            self.assertEqual(b''.join(preparedcache.read_chunks(f)), b'zip')
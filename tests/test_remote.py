@@ -16,9 +16,14 @@
 
 """Tests verifying that path traversal elements are rejected in remote module functions."""
 
+import asyncio
 import unittest
+from unittest import mock
 
-from motioneye import remote
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, HTTPError, RequestHandler
+
+from motioneye import remote, settings
 
 
 class TestRemotePathTraversal(unittest.IsolatedAsyncioTestCase):
@@ -145,5 +150,222 @@ class TestRemotePathTraversal(unittest.IsolatedAsyncioTestCase):
                 self._assert_raises_path_traversal(ctx.exception)
 
 
+class _SlowHandler(RequestHandler):
+    async def get(self, name):
+        app = self.application
+        app.hits.append(name)
+        app.running += 1
+        app.max_running = max(app.max_running, app.running)
+        await asyncio.sleep(0.05)
+        app.running -= 1
+        self.write(name)
+
+
+class _PictureHandler(RequestHandler):
+    def get(self, camera_id):
+        self.application.hits.append(camera_id)
+        if camera_id == 'batch' and not self.application.batch:
+            raise HTTPError(404)
+
+        if camera_id != 'batch':
+            self.set_cookie('capture_fps_' + camera_id, '3.0')
+            return self.write(b'jpg' + camera_id.encode())
+
+        self.set_header('Content-Type', 'multipart/mixed; boundary=frame')
+        for i in self.get_argument('ids').split(','):
+            self.write(
+                b'--frame\r\nContent-Length: 4\r\nX-Camera-Id: %s\r\n'
+                b'X-Motion-Detected: true\r\nX-Capture-Fps: 2.0\r\n\r\njpg%s\r\n'
+                % (i.encode(), i.encode())
+            )
+
+        self.write(b'--frame--\r\n')
+
+
+class TestRemotePictureBatch(AsyncHTTPTestCase):
+    def get_app(self):
+        app = Application([(r'/picture/(\w+)/current/', _PictureHandler)])
+        app.hits = []
+        app.batch = True
+
+        return app
+
+    def setUp(self):
+        super().setUp()
+        remote._picture_cameras.clear()
+        remote._picture_batch_failures.clear()
+
+    def _get(self, camera_id):
+        local_config = {
+            '@host': '127.0.0.1',
+            '@port': self.get_http_port(),
+            '@remote_camera_id': camera_id,
+        }
+
+        return remote.get_current_picture(local_config, 320, None)
+
+    @gen_test
+    async def test_batch(self):
+        resp = await self._get(1)
+        self.assertEqual(b'jpg1', resp.picture)
+        self.assertEqual(3.0, resp.capture_fps)
+
+        # once several cameras of the server are used, their pictures are batched
+        await self._get(2)
+        responses = await asyncio.gather(self._get(1), self._get(2), self._get(2))
+        self.assertEqual([b'jpg1', b'jpg2', b'jpg2'], [r.picture for r in responses])
+        self.assertTrue(responses[0].motion_detected)
+        self.assertEqual(2.0, responses[0].capture_fps)
+        self.assertEqual(['1', 'batch', 'batch'], self._app.hits)
+
+    @gen_test
+    async def test_batch_unsupported(self):
+        self._app.batch = False
+
+        await self._get(1)
+        resp = await self._get(2)
+        self.assertEqual(b'jpg2', resp.picture)
+
+        # the next pictures are requested separately right away
+        responses = await asyncio.gather(self._get(1), self._get(2))
+        self.assertEqual([b'jpg1', b'jpg2'], [r.picture for r in responses])
+        self.assertEqual(['1', 'batch', '2'], self._app.hits[:3])
+        self.assertEqual(['1', '2'], sorted(self._app.hits[3:]))
+
+    @gen_test
+    async def test_batch_fallback(self):
+        get_current_picture = remote._get_current_picture
+        running = []
+        max_running = []
+
+        async def get(local_config, width, height):
+            running.append(local_config)
+            max_running.append(len(running))
+            try:
+                return await get_current_picture(local_config, width, height)
+
+            finally:
+                running.remove(local_config)
+
+        await self._get(1)
+        await self._get(2)
+        self._app.batch = False
+        with mock.patch('motioneye.remote._get_current_picture', get):
+            responses = await asyncio.gather(self._get(1), self._get(2))
+
+        self.assertEqual([b'jpg1', b'jpg2'], [r.picture for r in responses])
+
+        # the pictures of a failed batch are requested in parallel
+        self.assertEqual(['1', 'batch', 'batch'], self._app.hits[:3])
+        self.assertEqual(2, max(max_running))
+
+
+class _ConfigHandler(RequestHandler):
+    def get(self, camera_id):
+        self.application.hits.append(self.request.headers.get('If-None-Match'))
+        self.write({'name': self.application.name, 'enabled': True})
+
+    def post(self, camera_id):
+        self.application.name = 'changed'
+        self.write({})
+
+
+class TestRemoteConfigCache(AsyncHTTPTestCase):
+    _LOCAL_CONFIG = {'@scheme': 'http', '@host': '127.0.0.1', '@remote_camera_id': 1}
+
+    def get_app(self):
+        app = Application([(r'/config/(\d+)/(?:get|set)/', _ConfigHandler)])
+        app.hits = []
+        app.name = 'cam'
+
+        return app
+
+    def setUp(self):
+        super().setUp()
+        remote._response_cache.clear()
+        self.local_config = dict(self._LOCAL_CONFIG, **{'@port': self.get_http_port()})
+
+    @gen_test
+    async def test_cache(self):
+        resp = await remote.get_config(self.local_config)
+        self.assertEqual('cam', resp.remote_ui_config['name'])
+
+        resp = await remote.get_config(self.local_config)
+        self.assertEqual('cam', resp.remote_ui_config['name'])
+        self.assertEqual([None], self._app.hits)
+
+        # an expired config is revalidated using its etag
+        with mock.patch.object(settings, 'REMOTE_CONFIG_CACHE_TTL', 0):
+            resp = await remote.get_config(self.local_config)
+
+        self.assertEqual('cam', resp.remote_ui_config['name'])
+        self.assertEqual(2, len(self._app.hits))
+        self.assertIsNotNone(self._app.hits[1])
+
+        await remote.set_config(self.local_config, {'name': 'changed'})
+        resp = await remote.get_config(self.local_config)
+        self.assertEqual('changed', resp.remote_ui_config['name'])
+        self.assertEqual(3, len(self._app.hits))
+
+
+class TestRemoteClient(AsyncHTTPTestCase):
+    def get_app(self):
+        app = Application([(r'/(\w+)', _SlowHandler)])
+        app.hits = []
+        app.running = app.max_running = 0
+
+        return app
+
+    def setUp(self):
+        super().setUp()
+        remote._hosts.clear()
+
+    def _get(self, name):
+        request = remote._make_request(
+            'http', '127.0.0.1', self.get_http_port(), None, '/' + name
+        )
+
+        return remote._send_request(request)
+
+    @gen_test
+    async def test_coalescing(self):
+        responses = await asyncio.gather(self._get('a'), self._get('a'), self._get('b'))
+
+        self.assertEqual([b'a', b'a', b'b'], [r.body for r in responses])
+        self.assertEqual(['a', 'b'], sorted(self._app.hits))
+        self.assertEqual({}, remote._in_flight)
+
+    @gen_test
+    async def test_conditional_not_coalesced(self):
+        request = remote._make_request(
+            'http', '127.0.0.1', self.get_http_port(), None, '/a'
+        )
+        request.headers['If-None-Match'] = '"etag"'
+
+        await asyncio.gather(self._get('a'), remote._send_request(request))
+
+        # the unconditional request does not get a response to the other one
+        self.assertEqual(['a', 'a'], self._app.hits)
+
+    @gen_test
+    async def test_host_concurrency(self):
+        with mock.patch.object(settings, 'REMOTE_HOST_CONCURRENCY', 2):
+            await asyncio.gather(*[self._get(n) for n in 'abcde'])
+
+        self.assertEqual(5, len(self._app.hits))
+        self.assertEqual(2, self._app.max_running)
+
+        (latency,) = remote.get_latencies().values()
+        self.assertGreater(latency, 0.04)
+
+    @gen_test
+    async def test_slow_host(self):
+        with mock.patch.object(settings, 'REMOTE_SLOW_LATENCY', 0.01):
+            await self._get('a')
+            await asyncio.gather(*[self._get(n) for n in 'bcd'])
+
+        self.assertEqual(1, self._app.max_running)
+
+
 if __name__ == '__main__':
     unittest.main()
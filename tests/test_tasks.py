@@ -0,0 +1,241 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import signal
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import Mock, patch
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from motioneye import tasks
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+
+
+def _die():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestTasks(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conf_path = mkdtemp()
+        self._patch = patch('motioneye.settings.CONF_PATH', self.conf_path)
+        self._patch.start()
+        tasks.start()
+
+    def tearDown(self):
+        tasks.stop()
+        tasks._lanes.clear()
+        self._patch.stop()
+        rmtree(self.conf_path)
+        super().tearDown()
+
+    @gen_test
+    async def test_lanes(self):
+        results = {'preview': Future(), 'upload': Future()}
+        for lane, fut in results.items():
+            tasks.add(0, dict, callback=fut.set_result, lane=lane, name=lane)
+
+        self.assertEqual({'name': 'preview'}, await results['preview'])
+        self.assertEqual({'name': 'upload'}, await results['upload'])
+
+        status = tasks.get_status()
+        self.assertEqual(0, status['scheduled'])
+        self.assertEqual(1, status['lanes']['preview']['runs'])
+        self.assertEqual(1, status['lanes']['upload']['runs'])
+        self.assertEqual(0, status['lanes']['default']['runs'])
+
+    @gen_test
+    async def test_wakes_up_for_earlier_tasks(self):
+        tasks.add(3600, dict, tag='later')
+        fut = Future()
+        tasks.add(0, dict, callback=fut.set_result)
+        await fut
+
+        self.assertEqual(1, tasks.get_status()['scheduled'])
+
+    @gen_test
+    async def test_retries(self):
+        # int() rejects the parameter, so the task always fails
+        tasks.add(0, int, tag='failing', retries=2, retry_delay=0, key='k', bogus=1)
+        for _ in range(100):
+            if tasks._dead:
+                break
+
+            await gen.sleep(0.05)
+
+        [dead] = tasks.get_dead()
+        self.assertEqual('failing', dead['tag'])
+        self.assertEqual(3, dead['attempts'])
+        self.assertEqual(3, tasks.get_status()['lanes']['default']['failures'])
+
+        # dead tasks survive restarts
+        tasks.stop()
+        tasks.start()
+        [dead] = tasks.get_dead()
+        self.assertEqual('failing', dead['tag'])
+        self.assertEqual(0, tasks.get_status()['scheduled'])
+
+        self.assertEqual(1, tasks.replay([dead['id']]))
+        self.assertEqual([], tasks.get_dead())
+        self.assertEqual(['failing'], [t.tag for t in tasks._tasks])
+        self.assertEqual(0, tasks._tasks[0].attempt)
+
+    def test_groups(self):
+        lane = tasks._lanes['upload']
+        lane.pool = Mock()
+        for i in range(3):
+            tasks.add(0, dict, tag=f'a{i}', lane='upload', group='a', group_limit=1)
+
+        tasks.add(0, dict, tag='b', lane='upload', group='b', group_limit=1)
+        tasks._check_tasks()
+
+        # one task of each group is running, the others wait for their group
+        self.assertEqual(2, lane.running)
+        self.assertEqual({'a': 1, 'b': 1}, lane.groups)
+        self.assertEqual(['a1', 'a2'], [t.tag for t in lane.ready])
+
+        task = next(t for t in tasks._running.values() if t.group == 'a')
+        tasks._on_task_done(lane, task, 0, {}, None)
+        self.assertEqual(['a2'], [t.tag for t in lane.ready])
+        self.assertEqual({'a': 1, 'b': 1}, lane.groups)
+
+        self.assertEqual(2, tasks.count_group('a'))
+        self.assertEqual(0, tasks.count_group('c'))
+
+        lane.pool = None
+
+    def test_retry_with(self):
+        tasks.add(0, dict, tag='batch', retries=1, retry_delay=60, items=[1, 2, 3])
+        tasks._check_tasks()
+        [task] = tasks._running.values()
+
+        error = tasks.RetryWith('2 failed', {'items': [2]})
+        tasks._lanes['default'].running += 1
+        tasks._on_task_done(tasks._lanes['default'], task, 0, None, error)
+
+        self.assertEqual([task], tasks._tasks)
+        self.assertEqual({'items': [2]}, task.params)
+
+        # the new params are journaled too
+        tasks.stop()
+        tasks.start()
+        self.assertEqual({'items': [2]}, tasks._tasks[0].params)
+
+    def test_keys(self):
+        tasks.add(3600, dict, tag='first', key='k')
+        tasks.add(3600, dict, tag='second', key='k')
+        self.assertEqual(['first'], [t.tag for t in tasks._tasks])
+
+        tasks.stop()
+        tasks.start()
+        tasks.add(3600, dict, tag='third', key='k')
+        self.assertEqual(['first'], [t.tag for t in tasks._tasks])
+
+    def test_journal(self):
+        tasks.add(3600, dict, tag='first', name='first')
+        tasks.add(7200, dict, tag='second', lane='upload', name='second')
+        tasks.add(3600, dict, callback=print)  # not persisted
+        tasks._check_tasks()
+
+        tasks.stop()
+        tasks.start()
+        self.assertEqual(
+            [('first', 'default'), ('second', 'upload')],
+            sorted((t.tag, t.lane) for t in tasks._tasks),
+        )
+
+        # tasks are removed from the journal once finished
+        first = tasks._tasks[0]
+        tasks._lanes['default'].running += 1
+        tasks._on_task_done(tasks._lanes['default'], first, 0, {}, None)
+        tasks._tasks.remove(first)
+        tasks.stop()
+        tasks.start()
+        self.assertEqual(['second'], [t.tag for t in tasks._tasks])
+
+    @gen_test(timeout=10)
+    async def test_stop_timeout(self):
+        tasks.add(0, _sleep, tag='hung', lane='upload', seconds=60)
+        tasks._check_tasks()
+        await gen.sleep(0.5)  # the task is running
+
+        started = time.time()
+        with patch('motioneye.tasks._STOP_TIMEOUT', 0.5):
+            tasks.stop()
+
+        self.assertLess(time.time() - started, 5)
+
+        # the interrupted task runs again
+        tasks.start()
+        self.assertEqual(['hung'], [t.tag for t in tasks._tasks])
+        tasks._tasks.clear()
+
+    @gen_test(timeout=10)
+    async def test_task_timeout(self):
+        lane = tasks._lanes['upload']
+        with patch('motioneye.tasks._WATCHDOG_INTERVAL', 0.1):
+            tasks.add(0, _sleep, tag='hung', lane='upload', timeout=0.5, seconds=60)
+            tasks._check_tasks()
+            for _ in range(100):
+                if lane.failures:
+                    break
+
+                await gen.sleep(0.05)
+
+        self.assertEqual(1, lane.failures)
+        self.assertEqual(0, lane.running)
+
+        # the lane runs tasks again
+        fut = Future()
+        tasks.add(0, dict, callback=fut.set_result, lane='upload', name='next')
+        self.assertEqual({'name': 'next'}, await fut)
+
+    @gen_test(timeout=10)
+    async def test_dead_worker(self):
+        lane = tasks._lanes['preview']
+        tasks.add(0, _die, tag='dying', lane='preview')
+        tasks._check_tasks()
+        for _ in range(100):
+            if lane.failures:
+                break
+
+            await gen.sleep(0.05)
+
+        self.assertEqual(1, lane.failures)
+        self.assertEqual(0, lane.running)
+
+        fut = Future()
+        tasks.add(0, dict, callback=fut.set_result, lane='preview', name='next')
+        self.assertEqual({'name': 'next'}, await fut)
+
+    def test_old_state_file(self):
+        tasks.stop()
+        with open(os.path.join(self.conf_path, 'tasks.pickle'), 'wb') as f:
+            pickle.dump([(1000, dict, 'old', None, {'name': 'old'})], f)
+
+        tasks.start()
+        self.assertEqual(['old'], [t.tag for t in tasks._tasks])
+        self.assertFalse(os.path.exists(os.path.join(self.conf_path, 'tasks.pickle')))
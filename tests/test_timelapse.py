@@ -0,0 +1,205 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from motioneye import mediafiles, timelapse
+
+
+def _fake_ffmpeg(job, output):
+    # stores the piped pictures as they are
+    return ['sh', '-c', 'cat > "$0"', output]
+
+
+def _fake_concat(list_path, output):
+    return [
+        'sh',
+        '-c',
+        'sed -e "s/^file \'//" -e "s/\'$//" "$0" | xargs cat > "$1"',
+        list_path,
+        output,
+    ]
+
+
+class TestTimelapse(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = mkdtemp()
+        self.camera_configs = []
+        for camera_id in [1, 2]:
+            target_dir = os.path.join(self.tmp_dir, str(camera_id))
+            os.makedirs(os.path.join(target_dir, '2024-01-01'))
+            for i in range(6):
+                path = os.path.join(target_dir, '2024-01-01', f'{i}.jpg')
+                with open(path, 'wb') as f:
+                    f.write(b'%d' % i)
+
+                os.utime(path, (1000 + i * 10, 1000 + i * 10))
+
+            self.camera_configs.append(
+                {'@id': camera_id, 'target_dir': target_dir, 'movie_codec': 'mp4'}
+            )
+
+        self._patches = [
+            patch('motioneye.settings.ENABLE_MEDIA_INDEX', False),
+            patch('motioneye.settings.TIMELAPSE_WORKERS', 1),
+            patch('motioneye.settings.TIMELAPSE_SEGMENTS', False),
+            patch('motioneye.settings.MEDIA_PATH', self.tmp_dir),
+            patch(
+                'motioneye.settings.PREPARED_CACHE_PATH',
+                os.path.join(self.tmp_dir, 'prepared'),
+            ),
+            patch('motioneye.preparedcache._initialized', False),
+            patch('motioneye.timelapse._ffmpeg_command', _fake_ffmpeg),
+            patch('motioneye.timelapse._concat_command', _fake_concat),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        timelapse._jobs.clear()
+        rmtree(self.tmp_dir)
+        super().tearDown()
+
+    async def _wait_done(self, camera_id, job_id):
+        for _ in range(200):
+            status = mediafiles.check_timelapse_movie(camera_id, '2024-01-01', job_id)
+            if status['progress'] == -1:
+                return status
+
+            await gen.sleep(0.02)
+
+        self.fail('timelapse job did not finish in time')
+
+    def test_select_pictures(self):
+        media_list = [{'timestamp': t} for t in [41, 0, 4, 9, 11, 25]]
+
+        selected = timelapse.select_pictures(media_list, 20)
+
+        self.assertEqual([m['timestamp'] for m in selected], [9, 25, 41])
+
+    @gen_test
+    async def test_concurrent_jobs(self):
+        job_ids = [
+            mediafiles.make_timelapse_movie(c, 10, 20, '2024-01-01')
+            for c in self.camera_configs
+        ]
+
+        # only one worker, so the second job waits
+        self.assertEqual(timelapse._jobs[job_ids[1]].state, 'queued')
+
+        for camera_config, job_id in zip(self.camera_configs, job_ids):
+            status = await self._wait_done(camera_config['@id'], job_id)
+            self.assertEqual(status['jobId'], job_id)
+            self.assertEqual(mediafiles.get_prepared_cache(status['key']), b'135')
+
+        # the latest job of a group is reported when no id is given
+        status = mediafiles.check_timelapse_movie(1, '2024-01-01')
+        self.assertEqual(status['jobId'], job_ids[0])
+        self.assertEqual(mediafiles.check_timelapse_movie(1, 'other')['key'], None)
+
+    @gen_test
+    async def test_failed_job(self):
+        with patch(
+            'motioneye.timelapse._ffmpeg_command',
+            lambda job, output: ['sh', '-c', 'echo broken >&2; exit 1'],
+        ):
+            job_id = mediafiles.make_timelapse_movie(
+                self.camera_configs[0], 10, 20, '2024-01-01'
+            )
+            status = await self._wait_done(1, job_id)
+
+        self.assertIsNone(status['key'])
+        self.assertEqual(timelapse._jobs[job_id].state, 'failed')
+
+    @gen_test
+    async def test_segments(self):
+        # one picture every 30 minutes, over 3 hours
+        group_dir = os.path.join(self.camera_configs[0]['target_dir'], '2024-01-01')
+        for i in range(6):
+            os.utime(
+                os.path.join(group_dir, f'{i}.jpg'), (i * 1800 + 900, i * 1800 + 900)
+            )
+
+        encoded = []
+
+        def counting_ffmpeg(job, output):
+            encoded.append(output)
+            return _fake_ffmpeg(job, output)
+
+        with patch('motioneye.settings.TIMELAPSE_SEGMENTS', True), patch(
+            'motioneye.timelapse._ffmpeg_command', counting_ffmpeg
+        ):
+            job_id = mediafiles.make_timelapse_movie(
+                self.camera_configs[0], 10, 1800, '2024-01-01'
+            )
+            status = await self._wait_done(1, job_id)
+            self.assertEqual(mediafiles.get_prepared_cache(status['key']), b'012345')
+            self.assertEqual(len(encoded), 3)
+
+            # only the hour with the modified picture is encoded again
+            with open(os.path.join(group_dir, '3.jpg'), 'wb') as f:
+                f.write(b'xx')
+
+            os.utime(os.path.join(group_dir, '3.jpg'), (3 * 1800 + 900, 3 * 1800 + 900))
+
+            job_id = mediafiles.make_timelapse_movie(
+                self.camera_configs[0], 10, 1800, '2024-01-01'
+            )
+            status = await self._wait_done(1, job_id)
+            self.assertEqual(mediafiles.get_prepared_cache(status['key']), b'012xx45')
+            self.assertEqual(len(encoded), 4)
+
+        segments_dir = os.path.join(self.tmp_dir, '.timelapse', '1')
+        self.assertEqual(len(os.listdir(segments_dir)), 3)
+
+    @gen_test
+    async def test_concurrent_segments(self):
+        encoded = []
+
+        def counting_ffmpeg(job, output):
+            encoded.append(os.path.basename(output))
+            return _fake_ffmpeg(job, output)
+
+        with patch('motioneye.settings.TIMELAPSE_SEGMENTS', True), patch(
+            'motioneye.settings.TIMELAPSE_WORKERS', 2
+        ), patch('motioneye.timelapse._ffmpeg_command', counting_ffmpeg):
+            job_ids = [
+                mediafiles.make_timelapse_movie(
+                    self.camera_configs[0], 10, 20, '2024-01-01'
+                )
+                for _ in range(2)
+            ]
+            for job_id in job_ids:
+                status = await self._wait_done(1, job_id)
+                self.assertEqual(mediafiles.get_prepared_cache(status['key']), b'135')
+
+        # each job encodes the same segment to its own temporary file
+        self.assertEqual(2, len(encoded))
+        self.assertNotEqual(encoded[0], encoded[1])
+
+        segments_dir = os.path.join(self.tmp_dir, '.timelapse', '1')
+        self.assertEqual(1, len(os.listdir(segments_dir)))
+        self.assertEqual({}, timelapse._segment_users)
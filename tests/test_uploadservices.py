@@ -0,0 +1,480 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import http.client
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, call, patch
+from urllib.error import HTTPError
+from urllib.request import Request
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from motioneye import tasks, uploadservices
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        self.server.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.bodies.append(body)
+
+        if self.path == '/missing':
+            response = json.dumps({'error': 'not found'}).encode()
+            self.send_response(404)
+
+        else:
+            response = b'done'
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_MKCOL(self):
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUploadServiceHTTP(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        self.server.bodies = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.service = uploadservices.UploadService(camera_id='1')
+
+    def tearDown(self):
+        for conn, _ in self.service._http_conns.values():
+            conn.close()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _put(self, path, data):
+        request = Request(self.url + path, data=data)
+        request.get_method = lambda: 'PUT'
+
+        return self.service.urlopen(request)
+
+    def test_keep_alive(self):
+        for i in range(3):
+            self.assertEqual(b'done', self._put('/file', b'%d' % i).read())
+
+        self.assertEqual([b'0', b'1', b'2'], self.server.bodies)
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_error(self):
+        with self.assertRaises(HTTPError) as cm:
+            self._put('/missing', b'data')
+
+        self.assertEqual(404, cm.exception.code)
+        self.assertEqual({'error': 'not found'}, json.load(cm.exception))
+
+        # the connection is still usable after an error response
+        self._put('/file', b'data')
+        self.assertEqual(1, len(self.server.connections))
+
+    def _set_idle_conn(self, error):
+        conn = Mock()
+        conn.getresponse.side_effect = error
+        key = ('http', f'127.0.0.1:{self.server.server_port}')
+        self.service._http_conns[key] = (conn, time.time())
+
+        return conn
+
+    def test_reconnect(self):
+        # a kept alive connection closed by the server is replaced
+        conn = self._set_idle_conn(http.client.RemoteDisconnected())
+        self.assertEqual(b'done', self._put('/file', b'data').read())
+
+        conn.close.assert_called_once_with()
+        self.assertEqual([b'data'], self.server.bodies)
+
+    def test_no_retry(self):
+        # the request may have been processed, it is not sent again
+        conn = self._set_idle_conn(socket.timeout())
+        with self.assertRaises(socket.timeout):
+            self._put('/file', b'data')
+
+        conn.close.assert_called_once_with()
+        self.assertEqual([], self.server.bodies)
+
+    def test_bandwidth(self):
+        self.service.bandwidth = 100 * 1024
+        started = time.monotonic()
+        self._put('/file', b'x' * 30 * 1024)
+
+        self.assertEqual(30 * 1024, len(self.server.bodies[0]))
+        self.assertGreater(time.monotonic() - started, 0.2)
+
+    def test_webdav_stream(self):
+        service = uploadservices.Webdav(camera_id='1')
+        service.load({'endpoint_url': self.url, 'location': '/cam'})
+        with open(__file__, 'rb') as f:
+            data = f.read()
+            f.seek(0)
+            service.upload_stream('a/b.jpg', 'image/jpeg', f, len(data), 0, 'cam')
+
+        self.assertEqual([data], self.server.bodies)
+
+        for conn, _ in service._http_conns.values():
+            conn.close()
+
+
+class _Response:
+    def __init__(self, status, headers=None):
+        self.code = status
+        self.headers = headers or {}
+
+
+class TestGoogleDriveResumable(unittest.TestCase):
+    def setUp(self):
+        self.service = uploadservices.GoogleDrive(camera_id='1')
+        self.service.CHUNK_SIZE = 4
+        self.service._get_folder_id = lambda path: 'folder'
+        self.service.is_uploaded = lambda filename, size: False
+        self.received = b''
+        self.fail_at = None
+        self.sessions = 0
+
+    def _open(self, url, body=None, headers=None, retry_auth=True, method=None):
+        if url == self.service.RESUMABLE_UPLOAD_URL:
+            self.sessions += 1
+            return _Response(200, {'Location': 'session'})
+
+        if body and len(self.received) == self.fail_at:
+            self.fail_at = None
+            raise Exception('connection reset')
+
+        self.received += body
+        if len(self.received) == 10:
+            return _Response(200)
+
+        return _Response(308, {'Range': f'bytes=0-{len(self.received) - 1}'})
+
+    def test_resume(self):
+        self.service._open = self._open
+        self.fail_at = 8
+        f = io.BytesIO(b'0123456789')
+
+        with self.assertRaises(Exception):
+            self.service.upload_stream('a.mp4', 'video/mp4', f, 10, 0, 'cam')
+
+        self.assertEqual(b'01234567', self.received)
+
+        # the retry continues the same session from where it was interrupted
+        self.service.upload_stream('a.mp4', 'video/mp4', f, 10, 0, 'cam')
+        self.assertEqual(b'0123456789', self.received)
+        self.assertEqual(1, self.sessions)
+        self.assertEqual({}, self.service._interrupted)
+
+    def test_resume_in_task(self):
+        self.service._open = self._open
+        self.fail_at = 8
+        with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+            f.write(b'0123456789')
+            f.flush()
+
+            with patch('motioneye.uploadservices.get', return_value=self.service):
+                with self.assertRaises(tasks.RetryWith) as cm:
+                    uploadservices.upload_media_file(1, 'cam', None, 'gdrive', f.name)
+
+            # the retried task may get another service instance
+            service = uploadservices.GoogleDrive(camera_id='1')
+            service.CHUNK_SIZE = 4
+            service._get_folder_id = lambda path: 'folder'
+            service._open = self._open
+            service.is_uploaded = lambda filename, size: False
+            with patch('motioneye.uploadservices.get', return_value=service):
+                uploadservices.upload_media_file(
+                    1, 'cam', None, 'gdrive', f.name, **cm.exception.params
+                )
+
+        self.assertEqual(b'0123456789', self.received)
+        self.assertEqual(1, self.sessions)
+
+
+class TestRetriedUploads(unittest.TestCase):
+    def test_gdrive(self):
+        service = uploadservices.GoogleDrive(camera_id='1')
+        service._get_folder_id = lambda path: 'folder'
+        service._request_json = Mock(return_value={'items': [{'fileSize': '10'}]})
+
+        self.assertTrue(service.is_uploaded('day/a.jpg', 10))
+        self.assertFalse(service.is_uploaded('day/a.jpg', 11))
+        self.assertIn(
+            "title%20%3D%20%27a.jpg%27", service._request_json.call_args[0][0]
+        )
+
+    def test_dropbox(self):
+        service = uploadservices.Dropbox(camera_id='1')
+        service._location = '/motioneye'
+        service._request = Mock(return_value=b'{".tag": "file", "size": 10}')
+
+        self.assertTrue(service.is_uploaded('day/a.jpg', 10))
+        self.assertFalse(service.is_uploaded('day/a.jpg', 11))
+        self.assertEqual(
+            '{"path": "/motioneye/day/a.jpg"}', service._request.call_args[0][1]
+        )
+
+        service._request.side_effect = HTTPError('url', 409, 'Conflict', {}, None)
+        self.assertFalse(service.is_uploaded('day/a.jpg', 10))
+
+    def test_skip_uploaded(self):
+        service = uploadservices.Dropbox(camera_id='1')
+        service.is_uploaded = Mock(return_value=True)
+        service.upload_stream = Mock()
+
+        service.upload_file(os.path.dirname(__file__), __file__, 'cam')
+
+        service.is_uploaded.assert_called_once_with(
+            os.path.basename(__file__), os.path.getsize(__file__)
+        )
+        service.upload_stream.assert_not_called()
+
+
+class TestGoogleDriveFolderIds(unittest.TestCase):
+    def setUp(self):
+        self.service = uploadservices.GoogleDrive(camera_id='1')
+        self.service._location = '/motioneye'
+        self.service.save = lambda: self.saves.append(self.service.dump())
+        self.service._get_folder_id_by_name = self._get_folder_id_by_name
+        self.saves = []
+        self.lookups = []
+        self.folders = {}
+
+    def _get_folder_id_by_name(self, parent_id, name, create=True):
+        self.lookups.append(name)
+        return self.folders.setdefault((parent_id, name), f'{name}{len(self.lookups)}')
+
+    def test_cache(self):
+        self.assertEqual('day2', self.service._with_folder_id('day', lambda i: i))
+        self.assertEqual(['motioneye', 'day'], self.lookups)
+        self.assertEqual(1, len(self.saves))
+
+        # only the missing subfolder is looked up, starting from its parent
+        self.assertEqual('other3', self.service._with_folder_id('other', lambda i: i))
+        self.assertEqual(['motioneye', 'day', 'other'], self.lookups)
+
+        # the resolved ids are kept along with the state
+        service = uploadservices.GoogleDrive(camera_id='1')
+        service.load(self.saves[-1])
+        self.assertEqual('other3', service._get_folder_id('other'))
+
+    def test_not_found(self):
+        self.service._with_folder_id('day', lambda i: i)
+        self.folders.clear()
+        used = []
+
+        def func(folder_id):
+            used.append(folder_id)
+            if folder_id == 'day2':
+                raise uploadservices._NotFoundError('File not found')
+
+        self.service._with_folder_id('day', func)
+        self.assertEqual(['day2', 'day4'], used)
+        self.assertEqual('day4', self.service._folder_ids['/motioneye/day'])
+
+
+class TestServicesState(unittest.TestCase):
+    def setUp(self):
+        self.conf_path = tempfile.mkdtemp()
+        self._patches = [
+            patch('motioneye.settings.CONF_PATH', self.conf_path),
+            patch('motioneye.uploadservices._services', None),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        shutil.rmtree(self.conf_path)
+
+    def test_refresh(self):
+        service = uploadservices.get(1, 'sftp')
+        service.load({'server': 'old', 'port': 22, 'location': '/'})
+        service.save()
+        service._conn = conn = Mock()
+
+        # another process changes the state of another service
+        other = uploadservices.GoogleDrive(camera_id='1')
+        other.load({'location': '/motioneye'})
+        other.save()
+
+        with patch('os.path.getmtime', return_value=1):
+            self.assertIs(service, uploadservices.get(1, 'sftp'))
+            self.assertEqual('/motioneye', uploadservices.get(1, 'gdrive')._location)
+
+        self.assertIs(conn, service._conn)
+
+        # a changed setting of the service itself is applied too
+        file_path = os.path.join(self.conf_path, 'uploadservices.json')
+        with open(file_path) as f:
+            data = json.load(f)
+
+        data['1']['sftp']['server'] = 'new'
+        with open(file_path, 'w') as f:
+            json.dump(data, f)
+
+        with patch('os.path.getmtime', return_value=2):
+            self.assertIs(service, uploadservices.get(1, 'sftp'))
+
+        self.assertEqual('new', service._server)
+        conn.close.assert_called_once_with()
+
+
+class TestGooglePhotoBatch(unittest.TestCase):
+    def test_batch_create(self):
+        service = uploadservices.GooglePhoto(camera_id='1')
+        service.MAX_BATCH_CREATE = 2
+        service.save = Mock()
+        service._upload_bytes = Mock(side_effect=[b't1', b't2', b't3'])
+        service._create_media = Mock(
+            side_effect=[
+                [{'status': {'message': 'Success'}}, {'status': {'code': 3}}],
+                [{'status': {'message': 'Success'}}],
+            ]
+        )
+
+        failed = service.upload_files(None, [__file__, __file__, __file__], 'cam')
+
+        self.assertEqual([__file__], failed)
+        self.assertEqual(
+            [call([b't1', b't2'], 'cam'), call([b't3'], 'cam')],
+            service._create_media.call_args_list,
+        )
+
+        # the created media items are not created again by a retry
+        size = os.path.getsize(__file__)
+        self.assertTrue(service.is_uploaded(__file__, size))
+        self.assertEqual([], service.upload_files(None, [__file__], 'cam'))
+        self.assertEqual(3, service._upload_bytes.call_count)
+
+        restored = uploadservices.GooglePhoto(camera_id='1')
+        restored.load(service.dump())
+        self.assertTrue(restored.is_uploaded(__file__, size))
+
+
+class TestUploadBatches(AsyncTestCase):
+    camera_config = {
+        '@upload_service': 'ftp',
+        '@upload_concurrency': 2,
+        '@upload_bandwidth': 100,
+        '@upload_subfolders': False,
+        'camera_name': 'cam',
+        'target_dir': '/media',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self._patches = [
+            patch('motioneye.settings.UPLOAD_BATCH_WINDOW', 0.1),
+            patch('motioneye.settings.UPLOAD_BATCH_SIZE', 3),
+            patch('motioneye.tasks.add'),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+        uploadservices._batches.clear()
+        super().tearDown()
+
+    @gen_test
+    async def test_window(self):
+        uploadservices.schedule_upload(1, self.camera_config, 'a.jpg', batch=True)
+        uploadservices.schedule_upload(1, self.camera_config, 'b.jpg', batch=True)
+        uploadservices.schedule_upload(2, self.camera_config, 'c.jpg', batch=True)
+        self.assertFalse(tasks.add.called)
+
+        await gen.sleep(0.2)
+
+        self.assertEqual(2, tasks.add.call_count)
+        args, kwargs = tasks.add.call_args_list[0]
+        self.assertIs(uploadservices.upload_media_files, args[1])
+        self.assertEqual(['a.jpg', 'b.jpg'], kwargs['filenames'])
+        self.assertEqual(1, kwargs['camera_id'])
+        self.assertEqual(102400, kwargs['bandwidth'])  # a lone upload
+        self.assertEqual('upload:1:ftp', kwargs['group'])
+
+        # a single picture is uploaded on its own
+        args, kwargs = tasks.add.call_args_list[1]
+        self.assertIs(uploadservices.upload_media_file, args[1])
+        self.assertEqual('c.jpg', kwargs['filename'])
+
+    def test_bandwidth_share(self):
+        config = dict(self.camera_config, **{'@upload_concurrency': 16})
+        with patch('motioneye.tasks.count_group', return_value=3) as count_group:
+            uploadservices.schedule_upload(1, config, 'a.jpg')
+
+        count_group.assert_called_once_with('upload:1:ftp')
+        args, kwargs = tasks.add.call_args
+
+        # bounded by the number of upload workers
+        self.assertEqual(2, kwargs['group_limit'])
+        self.assertEqual(51200, kwargs['bandwidth'])
+
+    @gen_test
+    async def test_size(self):
+        for name in ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']:
+            uploadservices.schedule_upload(1, self.camera_config, name, batch=True)
+
+        args, kwargs = tasks.add.call_args
+        self.assertEqual(['a.jpg', 'b.jpg', 'c.jpg'], kwargs['filenames'])
+        self.assertEqual({(1, 'ftp')}, set(uploadservices._batches))
+
+        uploadservices.flush_batches()
+        args, kwargs = tasks.add.call_args
+        self.assertEqual('d.jpg', kwargs['filename'])
+        self.assertEqual({}, uploadservices._batches)
+
+    def test_partial_failure(self):
+        service = Mock()
+        service.upload_files.return_value = [__file__]
+        with patch('motioneye.uploadservices.get', return_value=service):
+            with self.assertRaises(tasks.RetryWith) as cm:
+                uploadservices.upload_media_files(
+                    1, 'cam', None, 'ftp', [__file__, __file__, '/missing']
+                )
+
+        service.upload_files.assert_called_once_with(None, [__file__, __file__], 'cam')
+        self.assertEqual({'filenames': [__file__], 'resume': {}}, cm.exception.params)
+
+
+if __name__ == '__main__':
+    unittest.main()
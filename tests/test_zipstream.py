@@ -0,0 +1,80 @@
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+from zipfile import ZipFile
+
+from motioneye import zipstream
+
+
+class TestZipStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.contents = {
+            'a.jpg': b'a' * 10,
+            '2024-01-01/b.jpg': os.urandom(3 * zipstream.CHUNK_SIZE // 2),
+            'é.jpg': b'',
+        }
+        self.entries = []
+        for name, data in self.contents.items():
+            path = os.path.join(self.tmp_dir, name.replace('/', '_'))
+            with open(path, 'wb') as f:
+                f.write(data)
+
+            self.entries.append(zipstream.ZipEntry(path, name, len(data), 1.7e9))
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _read(self, stream):
+        data = b''.join(stream.chunks())
+        self.assertEqual(len(data), stream.size())
+
+        with ZipFile(BytesIO(data)) as f:
+            self.assertIsNone(f.testzip())
+            return {i.filename: f.read(i) for i in f.infolist()}
+
+    def test_archive(self):
+        self.assertEqual(self._read(zipstream.ZipStream(self.entries)), self.contents)
+
+    def test_empty_archive(self):
+        self.assertEqual(self._read(zipstream.ZipStream([])), {})
+
+    def test_zip64_end_records(self):
+        with patch('motioneye.zipstream._ZIP64_COUNT_LIMIT', 2):
+            stream = zipstream.ZipStream(self.entries)
+            self.assertEqual(self._read(stream), self.contents)
+
+    def test_file_changed_meanwhile(self):
+        with open(self.entries[0].path, 'wb') as f:
+            f.write(b'short')
+
+        os.remove(self.entries[1].path)
+
+        result = self._read(zipstream.ZipStream(self.entries))
+        self.assertEqual(result['a.jpg'], b'short' + bytes(5))
+        self.assertEqual(
+            result['2024-01-01/b.jpg'], bytes(3 * zipstream.CHUNK_SIZE // 2)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()